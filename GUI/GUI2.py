@@ -10,6 +10,7 @@ import diskcache
 import sys
 sys.path.insert(1, './table_processing')
 from Table_processor_main import process_content
+from result_cache import DEFAULT_CACHE_DIRECTORY
 from pathlib import Path
 
 cache = diskcache.Cache("./cache")
@@ -66,7 +67,7 @@ def save_file(name, content):
     data = content.encode("utf8").split(b";base64,")[1]
     with open(os.path.join(UPLOAD_DIRECTORY, name), "wb") as fp:
         fp.write(base64.decodebytes(data))
-    output_filename = process_content(base64.decodebytes(data))[0]
+    output_filename = process_content(base64.decodebytes(data), input_intermediate_output=False, cache_dir=DEFAULT_CACHE_DIRECTORY)[0]
     output_filename = Path(output_filename)
 
 
@@ -0,0 +1,57 @@
+# Compare the time taken to find the row and column limits of tables with many structure boxes,
+# checking every limit against every kept limit (the previous approach) and with limit_clustering
+import sys
+sys.path.insert(1, './table_processing')
+from limit_clustering import calculate_row_column_limits, points_to_pixels, ROW_THRESHOLD, COLUMN_THRESHOLD
+import random
+import time
+
+# Manual setting variables
+box_counts = [100, 1000, 5000]  # number of structure boxes in each generated table
+dpi = 144
+random.seed(0)
+
+
+def naive_remove_duplicates(limits, threshold):
+    unique = []
+    for limit in limits:
+        if not True in [abs(limit - x) < abs(threshold) for x in unique]:
+            unique.append(limit)
+    unique.sort()
+    return unique
+
+
+def naive_row_column_limits(boxes, image_size):
+    row_threshold = points_to_pixels(ROW_THRESHOLD, dpi)
+    column_threshold = points_to_pixels(COLUMN_THRESHOLD, dpi)
+    row_limits = naive_remove_duplicates(sorted([box[i] for box in boxes for i in [1, 3]]), row_threshold)
+    column_limits = naive_remove_duplicates(sorted([box[i] for box in boxes for i in [0, 2]]), column_threshold)[1:-1]
+    width, height = image_size
+    row_limits = naive_remove_duplicates(row_limits + [0, height], row_threshold)
+    column_limits = naive_remove_duplicates(column_limits + [0, width], column_threshold)
+    return row_limits, column_limits
+
+
+# Boxes of the rows, columns and cells of a grid, with some noise on every edge like the model's predictions
+def generate_boxes(count):
+    size = max(2, int((count / 3) ** 0.5))
+    width, height = size * 60, size * 20
+    boxes = []
+    while len(boxes) < count:
+        column, row = random.randrange(size), random.randrange(size)
+        noise = [random.uniform(-2, 2) for i in range(4)]
+        boxes.append([column * 60 + noise[0], row * 20 + noise[1], (column + 1) * 60 + noise[2], (row + 1) * 20 + noise[3]])
+    return boxes, (width, height)
+
+
+for count in box_counts:
+    boxes, image_size = generate_boxes(count)
+    start = time.perf_counter()
+    naive = naive_row_column_limits(boxes, image_size)
+    naive_time = time.perf_counter() - start
+    start = time.perf_counter()
+    clustered = calculate_row_column_limits(boxes, image_size, dpi)
+    clustered_time = time.perf_counter() - start
+    assert (clustered[0], clustered[1]) == naive
+    print(str(count) + ' boxes: naive ' + '{0:.4f}'.format(naive_time) + 's, clustered ' + '{0:.4f}'.format(clustered_time) +
+          's (' + '{0:.0f}'.format(naive_time / clustered_time) + 'x), ' + str(len(naive[0])) + ' rows, ' + str(len(naive[1])) + ' columns')
@@ -0,0 +1,53 @@
+# Compare the memory allocated and time taken to prepare detection inputs from a rendered page,
+# through the image processor (pixmap -> PIL image -> processor) and through the fast path (pixmap view -> InputEncoder)
+import sys
+sys.path.insert(1, './table_processing')
+from model_input import pixmap_to_array, InputEncoder
+from transformers import DetrImageProcessor
+from torch.profiler import profile, ProfilerActivity
+from PIL import Image
+import tracemalloc
+import fitz
+import time
+
+# Manual setting variables
+file_path = './tests/resources/multipletab.pdf'
+zoom = 2.0
+repeats = 5  # number of times each path is timed
+
+doc = fitz.open(file_path)
+pix = doc[0].get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+page_bytes = pix.width * pix.height * 3
+processor = DetrImageProcessor()
+encoder = InputEncoder(processor)
+
+
+def processor_path():
+    image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    return processor(image, return_tensors="pt")['pixel_values']
+
+
+def fast_path():
+    return encoder.encode([pixmap_to_array(pix)])[0]
+
+
+paths = {'processor': processor_path, 'fast': fast_path}
+fast_path()  # allocate the reused buffer before measuring
+for name, function in paths.items():
+    # Memory allocated by torch (CPU tensors) and by Python/NumPy during one call
+    tracemalloc.start()
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        function()
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    torch_bytes = sum([event.self_cpu_memory_usage for event in prof.events() if event.self_cpu_memory_usage > 0])
+
+    start = time.perf_counter()
+    for i in range(0, repeats):
+        function()
+    elapsed = (time.perf_counter() - start) / repeats
+    print(name + ': ' + '{0:.1f}'.format(elapsed * 1000) + 'ms, torch allocations ' + '{0:.1f}'.format(torch_bytes / page_bytes) +
+          ' page sizes, python/numpy peak ' + '{0:.1f}'.format(traced_peak / page_bytes) + ' page sizes')
+
+difference = (processor_path() - fast_path()).abs().max().item()
+print('Largest difference between the paths: ' + '{0:.2e}'.format(difference))
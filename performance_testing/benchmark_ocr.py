@@ -0,0 +1,32 @@
+# Compare the time taken by the table OCR modes on the same detected table
+import sys
+sys.path.insert(1, './table_processing')
+from Table_Detector import Table_Detector
+import time
+import logging
+logging.basicConfig(filename='benchmarking_log', filemode='a', datefmt='%Y-%m-%d %H:%M:%S',
+                    level=logging.WARNING, format='[%(asctime)s][%(levelname)s] %(message)s\n')
+
+# Manual setting variables
+t_name = 'test_extract_table_content'
+file_path = './tests/resources/' + t_name + '/'  + t_name + '.pdf'
+repeats = 3  # number of times each mode is timed
+
+# Detection and structure recognition are only run once, each mode then re-runs the OCR step
+detc_table = Table_Detector(file_path)
+tables = [table['table_content'] for page in detc_table.get_page_data() for table in page['tables']]
+
+timings = {}
+shapes = {}
+for ocr_mode in ['cell', 'table']:
+    start = time.perf_counter()
+    for i in range(0, repeats):
+        for table in tables:
+            table.ocr_mode = ocr_mode
+            table.extract_table_content()
+    timings[ocr_mode] = (time.perf_counter() - start) / repeats
+    shapes[ocr_mode] = [table.get_raw_dataframe().shape for table in tables]
+
+for ocr_mode in timings:
+    print(ocr_mode + ' OCR: ' + '{0:.3f}'.format(timings[ocr_mode]) + 's per run, table shapes: ' + str(shapes[ocr_mode]))
+print('Speedup: ' + '{0:.1f}'.format(timings['cell'] / timings['table']) + 'x')
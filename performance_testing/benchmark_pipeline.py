@@ -7,6 +7,7 @@ from table_metrics import test_tables
 import pandas as pd
 import numpy as np
 import random
+import time
 # xlsxwriter not imported, but needs to be downloaded in environment
 import logging
 logging.basicConfig(filename='benchmarking_log', filemode='a', datefmt='%Y-%m-%d %H:%M:%S',
@@ -15,11 +16,11 @@ logging.basicConfig(filename='benchmarking_log', filemode='a', datefmt='%Y-%m-%d
 # Manual setting variables
 n = 1  # number of tables to generate
 randomize_all_parameters = True  # if all generated table parameters should be randomized
+profiles = ['fast', 'balanced', 'accurate']  # speed/accuracy profiles run on the same generated tables (see profiles.py)
 
 # Initialize variables
-tables = {}
-failed_tables = []
 gen_params = []
+file_paths = {}
 
 # Loop for n # of tables
 for i in range(0,n):
@@ -36,32 +37,52 @@ for i in range(0,n):
     logging.warning('Generated table ' + t_name)
     file_path = 'generated_tables/' + t_name + '/'  + t_name
     true_table.to_excel(file_path + '_true.xlsx', index = False)
-    # Detect table from pdf, export to and read from excel processed table
-    try:
-        detc_table = Table_Detector(file_path+'.pdf')  # run table detector model on pdf
-        table = detc_table.get_page_data()[0]['tables'][0]['table_content']
-        detc_table.to_excel(file_path+'.xlsx')
-        read_table = pd.read_excel(file_path+'.xlsx', dtype=str)  # force extract text as string (otherwise there may be errors with some numbers)
-        detc_table.output_table_steps(file_path+'_intermediate_output/')
-    except IndexError:  # could not detect table from pdf
-        logging.error('Could not detect table from pdf ' + t_name)
-        read_table = pd.DataFrame()
-        failed_tables.append(t_name)
-        logging.error('Could not detect table ' + t_name + ' from pdf')
-    tables[t_name] = [true_table, read_table]
+    file_paths[t_name] = (file_path, true_table)
 
-# Calculate table extraction performance metrics and format output dfs
-metrics_df = test_tables(tables)  # metrics function
-metrics_df.loc[metrics_df.index.isin(failed_tables), list(metrics_df.columns.values)] = 0  # deal with failed detection tables
-summary_df = metrics_df.astype(float).describe().fillna(0).apply(lambda s: s.apply('{0:.3f}'.format))  
-summary_df.loc[summary_df.index == 'count'] = summary_df.loc[summary_df.index == 'count'].astype(float).astype(int).astype(str)  # format count column
-summary_df = summary_df.reset_index().rename(columns={'index':''})
-metrics_df = metrics_df.apply(lambda s: s.apply('{0:.3f}'.format)).reset_index().rename(columns={'index':'filename'})  # number formatting
-logging.warning(pd.DataFrame(np.row_stack((summary_df.columns, summary_df.to_numpy())),    # log metrics summary
-                columns=['']*len(summary_df.columns), index=['']*(1+len(summary_df))))
+# Detect the tables with each profile and time it
+profile_metrics = {}
+throughput = []
+for profile in profiles:
+    tables = {}
+    failed_tables = []
+    pages = 0
+    start = time.perf_counter()
+    for t_name, (file_path, true_table) in file_paths.items():
+        # Detect table from pdf, export to and read from excel processed table
+        try:
+            detc_table = Table_Detector(file_path+'.pdf', profile = profile)  # run table detector model on pdf
+            pages += len(detc_table.get_page_data())
+            table = detc_table.get_page_data()[0]['tables'][0]['table_content']
+            detc_table.to_excel(file_path + '_' + profile + '.xlsx')
+            read_table = pd.read_excel(file_path + '_' + profile + '.xlsx', dtype=str)  # force extract text as string (otherwise there may be errors with some numbers)
+            detc_table.output_table_steps(file_path + '_' + profile + '_intermediate_output/')
+        except IndexError:  # could not detect table from pdf
+            read_table = pd.DataFrame()
+            failed_tables.append(t_name)
+            logging.error('Could not detect table ' + t_name + ' from pdf with the ' + profile + ' profile')
+        tables[t_name] = [true_table, read_table]
+    elapsed = time.perf_counter() - start  # includes writing the outputs, which is the same for every profile
 
-# Add generated parameters to metrics sheet to allow identification of well & poor performing tables by characteristics
-metrics_df = pd.merge(metrics_df, pd.DataFrame(gen_params), on = 'filename', how = 'left')
+    # Calculate table extraction performance metrics
+    metrics_df = test_tables(tables)  # metrics function
+    metrics_df.loc[metrics_df.index.isin(failed_tables), list(metrics_df.columns.values)] = 0  # deal with failed detection tables
+    profile_metrics[profile] = metrics_df
+    throughput.append(dict({'profile': profile, 'tables': len(tables), 'failed': len(failed_tables), 'seconds': elapsed,
+                            'pages per second': pages / elapsed, 'tables per second': len(tables) / elapsed},
+                           **metrics_df.astype(float).mean().to_dict()))
+
+# Format output dfs, one summary and one sheet of all tables per profile
+summaries = {}
+for profile, metrics_df in profile_metrics.items():
+    summary_df = metrics_df.astype(float).describe().fillna(0).apply(lambda s: s.apply('{0:.3f}'.format))
+    summary_df.loc[summary_df.index == 'count'] = summary_df.loc[summary_df.index == 'count'].astype(float).astype(int).astype(str)  # format count column
+    summaries[profile] = summary_df.reset_index().rename(columns={'index':''})
+    metrics_df = metrics_df.apply(lambda s: s.apply('{0:.3f}'.format)).reset_index().rename(columns={'index':'filename'})  # number formatting
+    # Add generated parameters to metrics sheet to allow identification of well & poor performing tables by characteristics
+    profile_metrics[profile] = pd.merge(metrics_df, pd.DataFrame(gen_params), on = 'filename', how = 'left')
+throughput_df = pd.DataFrame(throughput)
+throughput_df[throughput_df.columns[1:]] = throughput_df[throughput_df.columns[1:]].apply(lambda s: s.apply('{0:.3f}'.format))
+logging.warning(throughput_df.to_string(index = False))  # log throughput and mean metrics of each profile
 
 # Function to export excel files with auto-formatting
 def write_report(exported_df, exported_dfName):
@@ -75,7 +96,9 @@ def write_report(exported_df, exported_dfName):
 # Export metrics data
 try:
     writerFinal = pd.ExcelWriter('table_metrics.xlsx')
-    write_report(metrics_df, 'All Tables'), write_report(summary_df, 'Metrics Summary')
+    write_report(throughput_df, 'Profiles')
+    for profile in profiles:
+        write_report(profile_metrics[profile], 'All Tables ' + profile), write_report(summaries[profile], 'Metrics Summary ' + profile)
     writerFinal.close()
 except PermissionError:
     logging.error('Metrics sheet could not be exported due to excel file already being open')
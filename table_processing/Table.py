@@ -4,146 +4,204 @@ Also from: https://huggingface.co/docs/transformers/model_doc/table-transformer
 and lastly this: https://github.com/microsoft/table-transformer
 '''
 
-from transformers import TableTransformerForObjectDetection
 from PIL import Image
-import pytesseract
 import os
-import getpass
-import pandas as pd
 import numpy as np
-import matplotlib
-matplotlib.use('agg')
-import matplotlib.pyplot as plt
-from table_tools import get_bounding_boxes, remove_duplicate_limits, clean_cell_text
-pytesseract.pytesseract.tesseract_cmd = os.path.join('C:/Users',getpass.getuser(),'AppData/Local/Programs/Tesseract-OCR/tesseract.exe')
+from table_tools import get_bounding_boxes, clean_cell_text, assign_words_to_cells, convert_colorspace, COLORSPACES, get_grid_intervals, find_blank_cells
+from model_registry import get_structure_model
+from limit_clustering import calculate_row_column_limits, points_to_pixels, DEFAULT_DPI
+from ocr_memo import run_ocr_jobs
+from ocr_backends import get_ocr_backend
+from profiles import get_profile, get_model_input_size, OCR_UPSCALE
+
+OCR_MODES = ['cell', 'table']
+BLANK_CELL_BORDER = 1.5  # points trimmed from each side of a cell before measuring its ink, to leave out grid lines
 
 
 class Table:
 
     # Constructor for the table class. Accepts an image of the table.
-    # Todo: accept another data structure as well for building a table without OCR
-    def __init__(self, image = None):
+    # table_structure can be given when structure recognition was already run on the image
+    # (e.g. batched across a document by Table_Detector), otherwise the model is run here.
+    # ocr_mode is either 'cell' (one OCR call per cell) or 'table' (one OCR call for the whole table,
+    # with each word then assigned to a cell).
+    # max_workers and executor_type set the pool used to run the OCR jobs (see ocr_pool.map_ordered).
+    # ocr_backend is a backend name or object from ocr_backends (e.g. 'pytesseract' or 'tesserocr').
+    # With extract_content False the OCR is left to the caller (e.g. Table_Detector pools it across tables).
+    # words can be given to fill the cells from already known text (e.g. the PDF text layer) instead of OCR,
+    # as a list of (x1, y1, x2, y2, text, line_id) in table image coordinates.
+    # colorspace is the colorspace the OCR reads the table in ('rgb', 'gray' or 'binary', see table_tools.COLORSPACES).
+    # The structure model always gets the RGB image, the conversion is done once for the whole table.
+    # dpi is the resolution the table image was rendered at, the thresholds used to find the rows and columns depend on it.
+    # In 'cell' mode, cells with less ink than blank_cell_threshold of their area (e.g. 0.002) are left empty without OCR.
+    # The default None reads every cell: a cell holding only '-', '.' or '—' can have less ink than that in a wide column.
+    # ocr_memo is an OcrMemo (see ocr_memo.py) used to read each distinct cell image only once.
+    # engine is the inference engine of the structure model ('torch', 'quantized' or 'onnx', see inference_engines.py).
+    # profile is a speed/accuracy profile (see profiles.py), it sets the model's threshold and input size and the OCR upscale.
+    def __init__(self, image = None, table_structure = None, ocr_mode = 'cell', max_workers = 1, executor_type = 'thread', extract_content = True,
+                 ocr_backend = 'pytesseract', words = None, colorspace = 'rgb', dpi = DEFAULT_DPI, blank_cell_threshold = None,
+                 ocr_memo = None, engine = 'torch', profile = None):
+        self.profile = get_profile(profile)
+        self.words = words
+        self.engine = engine
+        self.ocr_memo = ocr_memo
+        self.dpi = dpi
+        self.blank_cell_threshold = blank_cell_threshold
+        self.skipped_cells = 0
+        if ocr_mode not in OCR_MODES:
+            raise Exception("Invalid OCR mode: " + str(ocr_mode) + ". Must be one of " + str(OCR_MODES))
+        self.ocr_mode = ocr_mode
+        if colorspace not in COLORSPACES:
+            raise Exception("Invalid colorspace: " + str(colorspace) + ". Must be one of " + str(COLORSPACES))
+        self.colorspace = colorspace
+        self.ocr_backend = get_ocr_backend(ocr_backend)
+        self.max_workers = max_workers
+        self.executor_type = executor_type
         if image != None:
             self.image = image
             self._load_model()
-            self._find_bounding_boxes()
+            if table_structure is None:
+                self._find_bounding_boxes()
+            else:
+                self.table_structure = table_structure
             self._calculate_row_column_limits()
-            self.extract_table_content()
+            if extract_content:
+                self.extract_table_content()
 
 
     def _load_model(self):
-        self.model = TableTransformerForObjectDetection.from_pretrained("microsoft/table-transformer-structure-recognition")
+        self.model = get_structure_model(self.engine)
 
 
     def _find_bounding_boxes(self):
-        self.table_structure, self.model = get_bounding_boxes(self.image, self.model)
+        self.table_structure, self.model = get_bounding_boxes(self.image, self.model, threshold = self.profile['threshold'],
+                                                              input_size = get_model_input_size(self.profile))
         self.table_structure = self.table_structure[0]  #[0] as the boxes are returns a list of table structures of length 1
 
-    def _calculate_raw_row_column_limits(self):
-        # Use boundaries of bounding boxes to set row and column limits
-        self.row_limits = []
-        self.column_limits = []
-        for box in self.get_bounding_box_list():
-            x1,y1,x2,y2 = box
-            self.row_limits.append(y1)
-            self.row_limits.append(y2)
-            self.column_limits.append(x1)
-            self.column_limits.append(x2)
-        self.row_limits.sort()
-        self.column_limits.sort()
-        
-
+    # Row and column limits from the edges of the structure boxes, see limit_clustering
+    # row_support and column_support are the number of box edges found at each limit
     def _calculate_row_column_limits(self):
-        self._calculate_raw_row_column_limits()
-        row_thresh, col_thresh = 8, 16   # threshold is in pixels
-        self.row_limits = remove_duplicate_limits(self.row_limits, row_thresh)  
-        self.column_limits = remove_duplicate_limits(self.column_limits, col_thresh)
-
-        # Remove left-most and right most column limits to handle clipping issue (temporary fix) and replace them with the image limits
-        self.column_limits.sort()
-        self.column_limits.pop(0)
-        self.column_limits.pop()
-
-        # Add image boundaries to the row and column limits
-        width, height = self.image.size
-        self.row_limits.append(0)
-        self.row_limits.append(height)
-        self.column_limits.append(0)
-        self.column_limits.append(width)     
-        
-        self.row_limits = remove_duplicate_limits(self.row_limits, row_thresh)
-        self.column_limits = remove_duplicate_limits(self.column_limits, col_thresh)  
+        (self.row_limits, self.column_limits,
+         self.row_support, self.column_support) = calculate_row_column_limits(self.get_bounding_box_list(), self.image.size, self.dpi)
 
 
     def plot_image(self, image):
+        import matplotlib.pyplot as plt
         plt.figure()
         plt.imshow(image)
         plt.show()
         plt.close()
 
 
+    # The table image in the colorspace used for OCR, converted on first use
+    def get_ocr_image(self):
+        if not hasattr(self, 'ocr_image'):
+            self.ocr_image = convert_colorspace(self.image, self.colorspace)
+        return self.ocr_image
+
+
+    # Split the OCR image into the cells of the grid given by the row and column limits
+    # Returns a list of rows, each a list of cell images as NumPy arrays. The cells are views of one array of
+    # the whole table, so no pixels are copied. The grid is the same as the one used by assign_words_to_cells().
+    def get_cell_views(self):
+        if not hasattr(self, 'ocr_array'):
+            self.ocr_array = np.asarray(self.get_ocr_image())
+        column_intervals = get_grid_intervals(self.column_limits)
+        if len(column_intervals) == 0:
+            return []
+        return [[self.ocr_array[y1:y2, x1:x2] for x1, x2 in column_intervals] for y1, y2 in get_grid_intervals(self.row_limits)]
+
+
     # Transform the table into a list of lists representation
-    # Consists of images of the individual cells in the table  
+    # Consists of images of the individual cells in the table, in the OCR colorspace (see get_cell_views())
     # Generates self.table_pre_ocr  
     def generate_table_pre_ocr(self):
-        row_images = get_cropped_rows(self.image, self.row_limits)
-        self.table_pre_ocr = []
-        for row in row_images:
-            row_pre_ocr = []
-            if row.size[1] > 0:
-                cells = get_cropped_columns(row, self.column_limits)
-                for cell in cells:
-                    width, height = cell.size
-                    if width > 0 and height > 0:
-                        row_pre_ocr.append(cell)
-            if len(row_pre_ocr) > 0:
-                self.table_pre_ocr.append(row_pre_ocr)
+        self.table_pre_ocr = self.get_cell_views()
+
+
+    # Which cells of the grid are blank, as a list of rows of booleans in the shape of get_cell_views()
+    def get_blank_cells(self):
+        row_intervals = get_grid_intervals(self.row_limits)
+        column_intervals = get_grid_intervals(self.column_limits)
+        if self.blank_cell_threshold is None or len(column_intervals) == 0:
+            return [[False] * len(column_intervals) for row in row_intervals]
+        if not hasattr(self, 'ocr_array'):
+            self.ocr_array = np.asarray(self.get_ocr_image())
+        border = round(points_to_pixels(BLANK_CELL_BORDER, self.dpi))
+        return find_blank_cells(self.ocr_array, row_intervals, column_intervals, self.blank_cell_threshold, border).tolist()
 
 
     # Generates a datafram representation of the table contents using OCR
     # No post OCR cleanup
     # Generates self.raw_table_data
     def generate_raw_table_text(self):
+        results, calls = run_ocr_jobs(self.get_ocr_jobs(), self.ocr_memo, max_workers = self.max_workers, executor_type = self.executor_type)
+        self.set_ocr_results(results)
+
+
+    # Returns the OCR work for this table as a list of (function, image, backend, scale) jobs, see run_ocr_job()
+    # In 'cell' mode there is one job per cell that isn't blank, in row then column order.
+    # In 'table' mode there is a single job for the whole table image.
+    # There are no jobs when the words of the table are already known.
+    def get_ocr_jobs(self):
+        if self.words != None:
+            return []
+        if self.ocr_mode == 'table':
+            return [(ocr_table_words, self.get_ocr_image(), self.ocr_backend, self.profile['ocr_upscale'])]
         self.generate_table_pre_ocr()
-        raw_rows = []
-        for row in self.table_pre_ocr:
-            raw_cells = []
-            for cell in row:
-                width, height = cell.size
-                cell = cell.resize((int(width*2.5), int(height*2.5)))
-                ocr_text = pytesseract.image_to_string(cell)
-                raw_cells.append(ocr_text)
-            raw_rows.append(raw_cells)
+        self.blank_cells = self.get_blank_cells()
+        self.skipped_cells = sum([row.count(True) for row in self.blank_cells])
+        return [(ocr_cell, cell, self.ocr_backend, self.profile['ocr_upscale']) for row, blank_row in zip(self.table_pre_ocr, self.blank_cells)
+                for cell, blank in zip(row, blank_row) if not blank]
+
+
+    # Builds self.raw_table_data from the results of the jobs returned by get_ocr_jobs(), in the same order
+    def set_ocr_results(self, results):
+        if self.words != None:
+            raw_rows = assign_words_to_cells(self.words, self.row_limits, self.column_limits)
+        elif self.ocr_mode == 'table':
+            # Each word found is placed in the cell of the row and column limits containing it
+            raw_rows = assign_words_to_cells(results[0], self.row_limits, self.column_limits)
+        else:
+            # Blank cells had no job, they are left empty
+            results = iter(results)
+            raw_rows = [['' if blank else next(results) for blank in blank_row] for blank_row in self.blank_cells]
+        import pandas as pd
         self.raw_table_data = pd.DataFrame.from_records(raw_rows[1:], columns=raw_rows[0])
 
 
+    def clean_table_text(self):
+        self.table_data = self.raw_table_data.applymap(clean_cell_text)
+
 
     def extract_table_content(self):
         self.generate_raw_table_text()
-        self.table_data = self.raw_table_data.applymap(clean_cell_text)
+        self.clean_table_text()
 
     
+    # Drawn on its own Figure rather than through pyplot, so no GUI backend is needed (or set) to save it
     def plot_bounding_boxes(self, file_name):
+        from matplotlib.figure import Figure
+        from matplotlib.patches import Rectangle
         # colors for visualization
         COLORS = [[0.000, 0.447, 0.741], [0.850, 0.325, 0.098], [0.929, 0.694, 0.125],
                   [0.494, 0.184, 0.556], [0.466, 0.674, 0.188], [0.301, 0.745, 0.933]]
         
-        plt.figure(figsize=(16,10))
-        plt.imshow(self.image)
-        ax = plt.gca()
+        figure = Figure(figsize=(16,10))
+        ax = figure.add_subplot()
+        ax.imshow(self.image)
         colors = COLORS * 100
         boxes = self.get_bounding_box_list()
         labels = self.get_labels()
         scores = self.get_scores()
         for score, label, (xmin, ymin, xmax, ymax), c in zip(scores, labels, boxes, colors):
-            ax.add_patch(plt.Rectangle((xmin, ymin), xmax - xmin, ymax - ymin,
+            ax.add_patch(Rectangle((xmin, ymin), xmax - xmin, ymax - ymin,
                                     fill=False, color=c, linewidth=3))
             text = f'{self.model.config.id2label[label]}: {score:0.2f}'
             ax.text(xmin, ymin, text, fontsize=15,
                     bbox=dict(facecolor='yellow', alpha=0.5))
-        plt.axis('off')
-        plt.savefig(file_name + ".jpg")
-        plt.close()
+        ax.axis('off')
+        figure.savefig(file_name + ".jpg")
 
 
     # Return the raw ocr table content
@@ -155,16 +213,26 @@ class Table:
     def save_pre_ocr_table(self, file_path):
         if not os.path.exists(str(file_path)):
             os.makedirs(str(file_path))
+        if not hasattr(self, 'table_pre_ocr'):
+            self.generate_table_pre_ocr()  # not generated when OCR was run on the whole table
         row_id = 0
         for row in self.table_pre_ocr:
             column_id = 0
             for cell in row:
                 file_name = file_path + "/row_" + str(row_id) + "_column_" + str(column_id) + ".jpg"
-                cell.save(file_name)
+                if cell.size > 0:
+                    Image.fromarray(cell).save(file_name)
                 column_id += 1
             row_id += 1
 
 
+    # Drop the images and the model once only the extracted text is needed, to free their memory
+    def release_images(self):
+        for attribute in ['image', 'ocr_image', 'ocr_array', 'table_pre_ocr', 'model']:
+            if hasattr(self, attribute):
+                delattr(self, attribute)
+
+
     def get_as_dataframe(self):
         return self.table_data
     
@@ -178,8 +246,44 @@ class Table:
         return self.table_structure['scores'].tolist()   
 
 
+# OCR jobs are module level functions so that they can be sent to a process pool
+# A job is (function, image, backend) followed by any other arguments of the function
+def run_ocr_job(job):
+    function, image, backend = job[:3]
+    return function(image, backend, *job[3:])
+
+
+# cell is an array from Table.get_cell_views(), it is only turned into an image here, enlarged by scale
+def ocr_cell(cell, backend, scale = OCR_UPSCALE):
+    if cell.size == 0:
+        return ''  # the cell is outside the table image
+    cell = Image.fromarray(cell)
+    width, height = cell.size
+    cell = cell.resize((int(width*scale), int(height*scale)))
+    return backend.image_to_string(cell)
+
+
+# OCR the whole table image at once, enlarged by scale, and return the words found as (x1, y1, x2, y2, text, line_id)
+def ocr_table_words(image, backend, scale = OCR_UPSCALE):
+    width, height = image.size
+    image = image.resize((int(width*scale), int(height*scale)))
+    data = backend.image_to_data(image)
+    words = []
+    for i in range(0, len(data['text'])):
+        text = data['text'][i].strip()
+        if text == '':
+            continue
+        x1 = data['left'][i] / scale
+        y1 = data['top'][i] / scale
+        x2 = x1 + data['width'][i] / scale
+        y2 = y1 + data['height'][i] / scale
+        line_id = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        words.append((x1, y1, x2, y2, text, line_id))
+    return words
+
+
 def get_cropped_rows(image, row_limits):
-    row_limits.sort()
+    row_limits = sorted(row_limits)
     cropped_rows = []
     width, height = image.size
     x1 = 0
@@ -194,7 +298,7 @@ def get_cropped_rows(image, row_limits):
 
 ## TODO: refactor to eliminate code duplication between this method and get_cropped_rows()
 def get_cropped_columns(image, column_limits):
-    column_limits.sort()
+    column_limits = sorted(column_limits)
     x2 = 0
     cropped_columns = []
     width, height = image.size
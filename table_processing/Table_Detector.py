@@ -4,65 +4,355 @@ Also from: https://huggingface.co/docs/transformers/model_doc/table-transformer
 and lastly this: https://github.com/microsoft/table-transformer
 '''
 
-from transformers import TableTransformerForObjectDetection
 from PIL import Image
-import matplotlib.pyplot as plt
 import fitz
-import pandas as pd
 import logging
 import os
+import threading
+import copy
+import hashlib
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from Table import Table
-from table_tools import get_bounding_boxes
+from ocr_memo import OcrMemo, iter_ocr_results
+from ocr_backends import get_ocr_backend, get_backend_settings
+from table_tools import get_bounding_boxes, get_words_in_box
+from profiles import get_profile, get_model_input_size, RENDER_ZOOM
+from model_input import pixmap_to_array
+from limit_clustering import POINTS_PER_INCH
+from model_registry import get_detection_model, get_structure_model, DETECTION_MODEL_ID, STRUCTURE_MODEL_ID
+from pipeline import Pipeline
+from result_cache import hash_content
+
+PAGE_FINGERPRINTS = ['content', 'pixmap']
+PDF_STAGES = ['render', 'crop']  # pipeline stages that use PyMuPDF
 
 class Table_Detector:
 
     # Requires EITHER an image of a page or a path to a pdf file.
-    def __init__(self, filename = None, filedata = None):
+    # structure_batch_size is the number of table images run through the structure model at once. Only tables whose
+    # model inputs have the same size are batched, so the results are the same as recognizing each table on its own.
+    # With pad_structure_batches, tables of any size are batched, padded to the largest (see table_tools.get_bounding_boxes),
+    # and the detected pages are held until they have structure_batch_size tables, so the tables of consecutive pages
+    # are recognized together. The results then match within a small tolerance only, and pages are yielded in groups.
+    # detection_batch_size is the number of pages rendered ahead and run through the detection model at once,
+    # capped so that the rendered pages waiting for detection use at most max_batch_memory_mb.
+    # ocr_mode is passed to each Table (see Table for the options).
+    # max_workers is the number of OCR workers shared by all the tables in the document, executor_type
+    # is either 'thread' or 'process'.
+    # ocr_backend is a backend name or object from ocr_backends, shared by all the tables. A backend given by name is
+    # closed at the end of each run, a backend object is left for the caller to close.
+    # With use_text_layer, tables that have at least min_text_words words of the PDF text layer inside their box are
+    # filled from it instead of OCR. OCR is still used for scanned pages and for the other tables. Off by default.
+    # With eager False nothing is processed on construction, the pages are processed as they are read from iter_pages().
+    # pipeline_workers runs the render, detect, crop, structure and ocr stages concurrently as a pipeline (see pipeline.py),
+    # as a dict of the number of workers for each stage, e.g. {'detect': 2, 'ocr': 8}. Stages not listed get 1 worker.
+    # The render and crop stages can only have 1 worker: PyMuPDF can't be used from several threads at once.
+    # pipeline_queue_size is the size of the queue between stages. In pipeline mode, pages are detected one at a time.
+    # cache is a ResultCache (see result_cache.py). When given, the results of a document processed before with the same
+    # configuration are loaded from it instead of being processed again. Cached results have no images.
+    # page_cache is a ResultCache for single pages. Pages already processed with the same configuration, in this or any
+    # other document, are loaded from it. page_fingerprint is how pages are identified: 'content' hashes the page's
+    # content stream, images and size without rendering it, 'pixmap' hashes the rendered page.
+    # Pages are rendered at detection_zoom for table detection. When ocr_zoom is different, each table found is rendered
+    # again on its own at ocr_zoom for structure recognition and OCR, so the full page is never rendered at the high zoom.
+    # The table boxes are in the coordinates of the page rendered at ocr_zoom.
+    # colorspace is the colorspace the tables are read in by OCR (see Table), the models always get RGB images.
+    # With fast_inputs the model inputs are prepared by model_input.InputEncoder, straight from the rendered pixmap
+    # for detection, instead of by the image processor. The results match within a small tolerance.
+    # blank_cell_threshold is passed to each Table, cells with less ink than it are not read by OCR (None reads every cell).
+    # With memoize_ocr, cell images that look the same are only read by OCR once per run (see ocr_memo.py).
+    # ocr_memo is an OcrMemo to use instead, e.g. to share the results between documents or keep them on disk.
+    # engine is the inference engine of both models: 'torch', 'quantized' or 'onnx' (see inference_engines.py).
+    # profile is a speed/accuracy profile name or dict (see profiles.py). It sets the zooms, the padding of the table boxes,
+    # the models' threshold and input size and the OCR upscale. detection_zoom and ocr_zoom override the profile's when given.
+    def __init__(self, filename = None, filedata = None, structure_batch_size = 4, pad_structure_batches = False, detection_batch_size = 1, max_batch_memory_mb = 256, ocr_mode = 'cell',
+                 max_workers = 1, executor_type = 'thread', ocr_backend = 'pytesseract', use_text_layer = False, min_text_words = 1, eager = True,
+                 pipeline_workers = None, pipeline_queue_size = 2, cache = None, page_cache = None, page_fingerprint = 'content',
+                 detection_zoom = None, ocr_zoom = None, colorspace = 'rgb',
+                 fast_inputs = False, blank_cell_threshold = None, memoize_ocr = True, ocr_memo = None,
+                 engine = 'torch', profile = None):
+        if page_fingerprint not in PAGE_FINGERPRINTS:
+            raise Exception("Invalid page fingerprint: " + str(page_fingerprint) + ". Must be one of " + str(PAGE_FINGERPRINTS))
+        for stage in PDF_STAGES:
+            if pipeline_workers != None and pipeline_workers.get(stage, 1) > 1:
+                raise Exception("Invalid number of " + stage + " workers: " + str(pipeline_workers[stage]) + ". PyMuPDF can't be used from several threads, must be 1")
         self.page_data = None
-        if filename != None:
-            logging.info("Processing from filename: " + str(filename))
-            self.page_data = self.get_tables_from_pdf(filename = filename)
-        elif filedata != None:
-            logging.info("Processing from file content.")
-            self.page_data = self.get_tables_from_pdf(content = filedata)
-        else:
+        self.profile = get_profile(profile)
+        self.detection_zoom = detection_zoom if detection_zoom != None else self.profile['detection_zoom']
+        self.ocr_zoom = ocr_zoom if ocr_zoom != None else self.profile['ocr_zoom']
+        self.colorspace = colorspace
+        self.fast_inputs = fast_inputs
+        self.blank_cell_threshold = blank_cell_threshold
+        self.memoize_ocr = memoize_ocr
+        self.engine = engine
+        self.ocr_memo = ocr_memo
+        self._run_memo = None
+        self._keep_page_images = True
+        self.cache = cache
+        self.page_cache = page_cache
+        self.page_fingerprint = page_fingerprint
+        self.run_stats = {}
+        self.pipeline_workers = pipeline_workers
+        self.pipeline_queue_size = pipeline_queue_size
+        self._stats_lock = threading.Lock()
+        self.filename = filename
+        self.filedata = filedata
+        self.use_text_layer = use_text_layer
+        self.min_text_words = min_text_words
+        self.ocr_backend = get_ocr_backend(ocr_backend)
+        self._owns_ocr_backend = isinstance(ocr_backend, str)  # made here from its name, so it is closed after each run
+        self.ocr_mode = ocr_mode
+        self.max_workers = max_workers
+        self.executor_type = executor_type
+        self.structure_batch_size = structure_batch_size
+        self.pad_structure_batches = pad_structure_batches
+        self.detection_batch_size = detection_batch_size
+        self.max_batch_memory_mb = max_batch_memory_mb
+        if filename == None and filedata == None:
             message = "Require filename or filedata parameters."
             logging.error(message)
             raise Exception(message)
+        if eager:
+            if filename != None:
+                logging.info("Processing from filename: " + str(filename))
+                self.page_data = self.get_tables_from_pdf(filename = filename)
+            else:
+                logging.info("Processing from file content.")
+                self.page_data = self.get_tables_from_pdf(content = filedata)
 
 
     def get_page_data(self):
         return self.page_data
 
     # This will need to be refactored to use the new Table class
+    # Drawn on its own Figure rather than through pyplot, so no GUI backend is needed (or set) to save it
     def plot_table_results(self, pil_img, scores, labels, boxes, model, file_name):
+        from matplotlib.figure import Figure
+        from matplotlib.patches import Rectangle
         # colors for visualization
         COLORS = [[0.000, 0.447, 0.741], [0.850, 0.325, 0.098], [0.929, 0.694, 0.125],
                 [0.494, 0.184, 0.556], [0.466, 0.674, 0.188], [0.301, 0.745, 0.933]]
 
-        plt.figure(figsize=(16,10))
-        plt.imshow(pil_img)
-        ax = plt.gca()
+        figure = Figure(figsize=(16,10))
+        ax = figure.add_subplot()
+        ax.imshow(pil_img)
         colors = COLORS * 100
         for score, label, (xmin, ymin, xmax, ymax),c  in zip(scores.tolist(), labels.tolist(), boxes.tolist(), colors):
-            ax.add_patch(plt.Rectangle((xmin, ymin), xmax - xmin, ymax - ymin,
+            ax.add_patch(Rectangle((xmin, ymin), xmax - xmin, ymax - ymin,
                                     fill=False, color=c, linewidth=3))
             text = f'{model.config.id2label[label]}: {score:0.2f}'
             ax.text(xmin, ymin, text, fontsize=15,
                     bbox=dict(facecolor='yellow', alpha=0.5))
-        plt.axis('off')
-        plt.savefig(file_name)
-        plt.show()
+        ax.axis('off')
+        figure.savefig(file_name)
 
 
+    # Accepts a page image or a list of page images
     def find_tables(self, image):
-        model = TableTransformerForObjectDetection.from_pretrained("microsoft/table-transformer-detection")
-        return get_bounding_boxes(image, model)
-    
+        model = get_detection_model(self.engine)
+        return get_bounding_boxes(image, model, batch_size = self.detection_batch_size, fast_inputs = self.fast_inputs,
+                                  threshold = self.profile['threshold'], input_size = get_model_input_size(self.profile))
+
+
+    # Run structure recognition on a list of table images in batches
+    # Returns the table structure of each image, in the same order as the images
+    def find_table_structures(self, images):
+        model = get_structure_model(self.engine)
+        return get_bounding_boxes(images, model, batch_size = self.structure_batch_size, fast_inputs = self.fast_inputs,
+                                  threshold = self.profile['threshold'], input_size = get_model_input_size(self.profile),
+                                  pad_batches = self.pad_structure_batches)[0]
+
 
     def get_tables_from_pdf(self, filename = None, content = None):
+        if self.cache == None:
+            return list(self.iter_pages(filename = filename, content = content, release_images = False))
+
+        if content == None:
+            with open(filename, 'rb') as file:
+                content = file.read()
+        key = self.cache.make_key(content, self.get_config())
+        results = self.cache.get(key)
+        if results != None:
+            logging.info("Loaded results from cache: " + hash_content(content))
+            return results
+        results = list(self.iter_pages(content = content, release_images = False))
+        self.cache.set(key, [copy_without_images(page_data) for page_data in results])
+        return results
+
+
+    # Every setting that changes the extracted tables, used to tell cached results apart
+    def get_config(self):
+        return {'detection_model': DETECTION_MODEL_ID,
+                'structure_model': STRUCTURE_MODEL_ID,
+                'threshold': self.profile['threshold'],
+                'input_size': get_model_input_size(self.profile),
+                'detection_zoom': self.detection_zoom,
+                'ocr_zoom': self.ocr_zoom,
+                'colorspace': self.colorspace,
+                'fast_inputs': self.fast_inputs,
+                'pad_structure_batches': self.pad_structure_batches,
+                'engine': self.engine,
+                'blank_cell_threshold': self.blank_cell_threshold,
+                'padding': self.profile['padding'],
+                'ocr_upscale': self.profile['ocr_upscale'],
+                'ocr_mode': self.ocr_mode,
+                'ocr_backend': getattr(self.ocr_backend, 'name', type(self.ocr_backend).__name__),
+                'ocr_backend_settings': get_backend_settings(self.ocr_backend),
+                'use_text_layer': self.use_text_layer,
+                'min_text_words': self.min_text_words}
+
+
+    # Process the pdf one page at a time and yield each page's results (same format as get_page_data()) as soon as they are ready
+    # Uses the filename or filedata given to the constructor if neither filename nor content is given.
+    # With release_images, the page and table images of a page are dropped once the next page is requested,
+    # so only the pages of the current detection batch are held in memory (with pad_structure_batches, the pages
+    # of the current structure batch).
+    def iter_pages(self, filename = None, content = None, release_images = True):
+        if filename == None and content == None:
+            filename = self.filename
+            content = self.filedata
+        self.run_stats = {'pages': 0, 'tables': 0, 'text_layer_tables': 0, 'page_cache_hits': 0, 'page_cache_misses': 0,
+                          'ocr_calls': 0, 'blank_cells_skipped': 0, 'ocr_memo_hits': 0}
+        self._run_memo = OcrMemo() if self.memoize_ocr and self.ocr_memo == None else None
+        self._keep_page_images = not release_images
+        if self.pipeline_workers != None:
+            pages = self._iter_pages_pipelined(filename, content)
+        else:
+            pages = self._iter_pages_batched(filename, content)
+        try:
+            for page_data in pages:
+                self.run_stats['pages'] += 1
+                yield page_data
+                if release_images:
+                    self._release_page_images(page_data)
+        finally:
+            if self._owns_ocr_backend:
+                self.ocr_backend.close()
+        logging.info("Tables read from the PDF text layer: " + str(self.run_stats['text_layer_tables']) + " of " + str(self.run_stats['tables']))
+        if self.page_cache != None:
+            logging.info("Page cache hits: " + str(self.run_stats['page_cache_hits']) + ", misses: " + str(self.run_stats['page_cache_misses']))
+        logging.info("OCR calls: " + str(self.run_stats['ocr_calls']) + ", blank cells skipped: " + str(self.run_stats['blank_cells_skipped']) +
+                     ", OCR memo hit rate: " + '{0:.1%}'.format(self.get_ocr_memo_hit_rate()))
+
+
+    # Counts from the last run: pages, tables, tables read from the text layer, page cache hits and misses,
+    # OCR calls made, blank cells that were left empty without OCR and OCR jobs answered from the OCR memo
+    def get_run_stats(self):
+        return self.run_stats
+
+
+    # Share of the OCR jobs of the last run that were answered from the OCR memo
+    def get_ocr_memo_hit_rate(self):
+        total = self.run_stats.get('ocr_calls', 0) + self.run_stats.get('ocr_memo_hits', 0)
+        return self.run_stats.get('ocr_memo_hits', 0) / total if total > 0 else 0.0
+
+
+    def _add_run_stat(self, name, count):
+        with self._stats_lock:
+            self.run_stats[name] = self.run_stats.get(name, 0) + count
+
+
+    # Each step runs on a batch of pages before the next step starts
+    # With pad_structure_batches, the detected pages wait for structure recognition until they have structure_batch_size
+    # tables between them (or are structure_batch_size pages), so the tables of consecutive pages are recognized in the
+    # same batches. Otherwise each detection batch goes through structure recognition and OCR as soon as it is detected.
+    def _iter_pages_batched(self, filename, content):
+        doc = self._open_pdf(filename, content)
+        try:
+            pending_pages = []
+            for pages in self._iter_page_batches(doc):
+                # Pages loaded from the page cache already have their tables
+                todo = [page_data for page_data in pages if 'tables' not in page_data]
+                self._detect_page_tables(todo)
+                self._render_table_images(todo, doc)
+                for page_data in todo:
+                    page_data['processed'] = True
+                pending_pages.extend(pages)
+                pending_tables = sum([len(page_data['tables']) for page_data in pending_pages if page_data.get('processed')])
+                if not self.pad_structure_batches or pending_tables >= self.structure_batch_size or len(pending_pages) >= self.structure_batch_size:
+                    for page_data in self._finish_pages(pending_pages):
+                        yield page_data
+                    pending_pages = []
+            for page_data in self._finish_pages(pending_pages):
+                yield page_data
+        finally:
+            doc.close()
+
+
+    # Structure recognition and OCR for the detected pages, batched across their tables
+    def _finish_pages(self, pages):
+        todo = [page_data for page_data in pages if page_data.pop('processed', False)]
+        self._recognize_table_structures(todo)
+        self._read_page_tables(todo)
+        self._store_cached_pages(todo)
+        return pages
+
+
+    # Each step runs on its own workers, connected by bounded queues, with the pages coming out in order
+    def _iter_pages_pipelined(self, filename, content):
+        # PyMuPDF isn't thread safe, even with a document per thread, so everything that uses the document (rendering
+        # the pages and tables, reading their text) is done on one thread of its own for the render and crop stages
+        pdf_thread = ThreadPoolExecutor(max_workers = 1)
+        def on_pdf_thread(function, *arguments):
+            return pdf_thread.submit(function, *arguments).result()
+
+        doc = None
+        try:
+            doc = on_pdf_thread(self._open_pdf, filename, content)
+            page_count = on_pdf_thread(len, doc)
+
+            def render(page_index):
+                return on_pdf_thread(lambda: self._detach_pixmap(self._render_page(doc[page_index], page_index + 1)[0]))
+
+            # Pages loaded from the page cache already have their tables and go straight through
+            def detect(page_data):
+                if 'tables' not in page_data:
+                    self._detect_page_tables([page_data])
+                    page_data['processed'] = True
+                return page_data
+
+            def crop(page_data):
+                if page_data.get('processed'):
+                    on_pdf_thread(self._render_table_images, [page_data], doc)
+                return page_data
+
+            def structure(page_data):
+                if page_data.get('processed'):
+                    self._recognize_table_structures([page_data])
+                return page_data
+
+            def ocr(page_data):
+                if page_data.pop('processed', False):
+                    self._read_page_tables([page_data])
+                    self._store_cached_pages([page_data])
+                return page_data
+
+            stages = [('render', render), ('detect', detect), ('structure', structure), ('ocr', ocr)]
+            if self.detection_zoom != self.ocr_zoom:
+                stages.insert(2, ('crop', crop))
+            pipeline = Pipeline([(name, function, self.pipeline_workers.get(name, 1)) for name, function in stages], queue_size = self.pipeline_queue_size)
+            for page_data in pipeline.run(range(0, page_count)):
+                yield page_data
+        finally:
+            if doc != None:
+                on_pdf_thread(doc.close)
+            pdf_thread.shutdown()
+
+
+    # Replace the pixmap of a page rendered with fast_inputs by a copy of its pixels, so that the pixmap is read and
+    # freed on the thread that rendered it and the other pipeline stages never touch PyMuPDF
+    def _detach_pixmap(self, page_data):
+        pix = page_data.pop('pixmap', None)
+        if pix != None:
+            page_data['pixels'] = pixmap_to_array(pix).copy()
+        return page_data
+
+
+    def _open_pdf(self, filename = None, content = None):
         if filename != None:
             doc = fitz.open(filename)
         elif content != None:
@@ -77,43 +367,234 @@ class Table_Detector:
             logging.error(message)
             doc.close()
             raise Exception(message)
+        return doc
 
-        results = []
-        # To get better resolution
-        zoom_x = 2.0  # horizontal zoom
-        zoom_y = 2.0  # vertical zoom
-        mat = fitz.Matrix(zoom_x, zoom_y)  # zoom factor 2 in each dimension
 
+    # Render the pages of the document and group them into the batches that are run through detection together
+    def _iter_page_batches(self, doc):
         pageCount = 1
+        pending_pages = []
+        pending_bytes = 0
         for page in doc: # iterate over pdf pages
-            
-            pix = page.get_pixmap(matrix=mat)  # render page to an image
-            page_image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            (table_bounds, model) = self.find_tables(page_image) 
+            page_data, page_bytes = self._render_page(page, pageCount)
+            pending_pages.append(page_data)
+            pending_bytes += page_bytes
+            pageCount +=1
+
+            # Run detection once enough pages have been rendered ahead
+            if len(pending_pages) >= self.detection_batch_size or pending_bytes >= self.max_batch_memory_mb * 1024 * 1024:
+                yield pending_pages
+                pending_pages = []
+                pending_bytes = 0
+        if len(pending_pages) > 0:
+            yield pending_pages
+
+
+    # Render a page to an image. Returns the page data and the size of the image in bytes.
+    # If the page is in the page cache, the cached page data is returned instead, with no image.
+    def _render_page(self, page, pageNum):
+        cache_key = None
+        if self.page_cache != None and self.page_fingerprint == 'content':
+            # Checked before rendering so that unchanged pages aren't rendered at all
+            cache_key = self.page_cache.make_key(fingerprint_page_content(page), self.get_config())
+            cached_page = self._get_cached_page(cache_key, pageNum)
+            if cached_page != None:
+                return cached_page, 0
+
+        # To get better resolution
+        zoom_x = self.detection_zoom  # horizontal zoom
+        zoom_y = self.detection_zoom  # vertical zoom
+        mat = fitz.Matrix(zoom_x, zoom_y)
+
+        pix = page.get_pixmap(matrix=mat)  # render page to an image
+        if self.page_cache != None and self.page_fingerprint == 'pixmap':
+            cache_key = self.page_cache.make_key(pix.samples, self.get_config())
+            cached_page = self._get_cached_page(cache_key, pageNum)
+            if cached_page != None:
+                return cached_page, 0
+
+        page_data = {}
+        if self.fast_inputs:
+            # Detection reads the pixmap directly (the pipeline reads a copy of its pixels, see _detach_pixmap), it is
+            # dropped once the tables are found. The page image is only made then, when the tables are cropped from it
+            # or the page images are kept.
+            page_data['pixmap'] = pix
+        else:
+            page_data['image'] = pixmap_to_image(pix)
+        page_data['pageNum'] = pageNum
+        page_data['page_size'] = (page.rect.width, page.rect.height)
+        page_data['words'] = self._get_page_words(page, self.ocr_zoom, self.ocr_zoom)  # in the coordinates of the table boxes
+        page_data['page_cache_key'] = cache_key
+        return page_data, pix.width * pix.height * 3
+
+
+    def _get_cached_page(self, cache_key, pageNum):
+        page_data = self.page_cache.get(cache_key)
+        if page_data == None:
+            self._add_run_stat('page_cache_misses', 1)
+            return None
+        self._add_run_stat('page_cache_hits', 1)
+        page_data['pageNum'] = pageNum  # the same page may be at a different position in this document
+        return page_data
+
+
+    def _store_cached_pages(self, pages):
+        for page_data in pages:
+            if page_data.get('page_cache_key') != None:
+                self.page_cache.set(page_data['page_cache_key'], copy_without_images(page_data))
+
+
+    # Structure recognition for the tables found on a batch of pages, batched across every table in the pages
+    def _recognize_table_structures(self, pages):
+        pending_tables = [table_data for page_data in pages for table_data in page_data['tables']]
+        structures = self.find_table_structures([table_data['table_image'] for table_data in pending_tables])
+        for table_data, table_structure in zip(pending_tables, structures):
+            table_data['table_content'] = Table(image = table_data['table_image'], table_structure = table_structure, ocr_mode = self.ocr_mode,
+                                                extract_content = False, ocr_backend = self.ocr_backend, words = table_data['words'],
+                                                colorspace = self.colorspace, dpi = POINTS_PER_INCH * self.ocr_zoom,
+                                                blank_cell_threshold = self.blank_cell_threshold, engine = self.engine, profile = self.profile)
+
+
+    # OCR for the tables of a batch of pages, pooled across the tables
+    def _read_page_tables(self, pages):
+        pending_tables = [table_data for page_data in pages for table_data in page_data['tables']]
+        self.extract_table_content([table_data['table_content'] for table_data in pending_tables])
+        self._add_run_stat('tables', len(pending_tables))
+        self._add_run_stat('text_layer_tables', len([table_data for table_data in pending_tables if table_data['words'] != None]))
+
+
+    # Drop everything held for a page that isn't needed to write its tables out
+    def _release_page_images(self, page_data):
+        page_data.pop('image', None)
+        page_data.pop('pixmap', None)
+        page_data.pop('pixels', None)
+        page_data.pop('model', None)
+        page_data.pop('words', None)
+        page_data.pop('page_cache_key', None)
+        page_data.pop('page_size', None)
+        for table_data in page_data['tables']:
+            table_data.pop('table_image', None)
+            table_data.pop('words', None)
+            table_data['table_content'].release_images()
+
+
+    # Words of the page's text layer, in rendered image coordinates, as (x1, y1, x2, y2, text, line_id)
+    # Returns None when the text layer isn't used
+    def _get_page_words(self, page, zoom_x, zoom_y):
+        if not self.use_text_layer:
+            return None
+        words = []
+        rotation_matrix = page.rotation_matrix  # the words are given on the unrotated page, the page is rendered rotated
+        for x1, y1, x2, y2, text, block_num, line_num, word_num in page.get_text("words"):
+            rect = fitz.Rect(x1, y1, x2, y2) * rotation_matrix
+            words.append((rect.x0 * zoom_x, rect.y0 * zoom_y, rect.x1 * zoom_x, rect.y1 * zoom_y, text, (block_num, line_num)))
+        return words
+
+
+    # Words of the text layer inside a table box, in the coordinates of the box. Returns None if the table has
+    # too few of them to be filled from the text layer, so that it is read by OCR.
+    def _get_table_words(self, page_words, box):
+        if page_words == None:
+            return None
+        words = get_words_in_box(page_words, box)
+        if words == None or len(words) < self.min_text_words:
+            return None
+        return words
+
+
+    # Run the OCR for all the tables through one worker pool, so cells of different tables are read concurrently
+    # Cells already read in this run (or in the shared ocr_memo) are answered from the memo
+    # The jobs of each table are only made when the pool reaches it, and each table gets its results as soon as
+    # all of its jobs are done, so only the jobs the pool is working on are held at once.
+    def extract_table_content(self, tables):
+        memo = self.ocr_memo if self.ocr_memo != None else self._run_memo
+        job_counts = deque()  # (table, number of jobs) of the tables whose jobs were handed to the pool, in order
+        def iter_jobs():
+            for table in tables:
+                jobs = table.get_ocr_jobs()
+                job_counts.append((table, len(jobs)))
+                for job in jobs:
+                    yield job
+        results = []
+        for result, ran in iter_ocr_results(iter_jobs(), memo, max_workers = self.max_workers, executor_type = self.executor_type):
+            self._add_run_stat('ocr_calls' if ran else 'ocr_memo_hits', 1)
+            results.append(result)
+            self._finish_tables(job_counts, results)
+        self._finish_tables(job_counts, results)
+
+
+    # Give their results to the tables at the front of job_counts that have all of theirs in results
+    def _finish_tables(self, job_counts, results):
+        while len(job_counts) > 0 and len(results) >= job_counts[0][1]:
+            table, count = job_counts.popleft()
+            table.set_ocr_results(results[:count])
+            del results[:count]
+            table.clean_table_text()
+            self._add_run_stat('blank_cells_skipped', getattr(table, 'skipped_cells', 0))
+
+
+    # Run table detection on a batch of rendered pages and crop out the tables found on each page
+    # Results are matched back to their page by position in the batch
+    # When tables are read at a different zoom than the pages are detected at, the table images are
+    # rendered afterwards by _render_table_images()
+    def _detect_page_tables(self, pages):
+        if self.fast_inputs:
+            images = [page_data['pixels'] if 'pixels' in page_data else pixmap_to_array(page_data['pixmap']) for page_data in pages]
+        else:
+            images = [page_data['image'] for page_data in pages]
+        (table_bounds, model) = self.find_tables(images)
+        scale = self.ocr_zoom / self.detection_zoom  # from detection image to table box coordinates
+        padding_scale = self.ocr_zoom / RENDER_ZOOM
+        for page_data, page_bounds in zip(pages, table_bounds):
+            pix = page_data.pop('pixmap', None)
+            pixels = page_data.pop('pixels', None)
+            crop_tables = self.detection_zoom == self.ocr_zoom and len(page_bounds['boxes']) > 0
+            if crop_tables or self._keep_page_images:
+                if pix != None:
+                    page_data['image'] = pixmap_to_image(pix)
+                elif pixels is not None:
+                    page_data['image'] = Image.fromarray(pixels)
+            page_image = page_data.get('image')
             tables = []
-            for table in table_bounds:
+            for box, score, label in zip(page_bounds['boxes'].tolist(), page_bounds['scores'], page_bounds['labels']):
                 table_data = {}
                 
                 # Enlarge box since the default cuts it too close to the boundaries
-                expanded_box = table['boxes'].tolist()[0]
-                padding = [-10, -8, 12, 10]  # x1, y1, x2, y2
+                expanded_box = [value * scale for value in box]
+                padding = self.profile['padding']  # x1, y1, x2, y2
                 for i in range(0, len(padding)):
-                    expanded_box[i] += padding[i]  # add padding to assure all data is contained in the identified table box
-                table_data['box'] = tuple(expanded_box)
-                table_data['table_image'] = page_image.crop(table_data['box'])
-                table_data['table_content'] = Table(image = table_data['table_image'])
-                table_data['score'] = table['scores'][0]
-                table_data['label'] = table['labels'][0]
+                    expanded_box[i] += padding[i] * padding_scale  # add padding to assure all data is contained in the identified table box
+                if self.detection_zoom == self.ocr_zoom:
+                    table_data['box'] = tuple(expanded_box)
+                    table_data['table_image'] = page_image.crop(table_data['box'])
+                else:
+                    # Only the part of the box that is on the page can be rendered
+                    width, height = page_data['page_size']
+                    limits = [0, 0, width * self.ocr_zoom, height * self.ocr_zoom]
+                    table_data['box'] = (max(expanded_box[0], limits[0]), max(expanded_box[1], limits[1]),
+                                         min(expanded_box[2], limits[2]), min(expanded_box[3], limits[3]))
+                table_data['words'] = self._get_table_words(page_data['words'], table_data['box'])
+                table_data['score'] = score
+                table_data['label'] = label
                 tables.append(table_data)
-            page_data = {}
-            page_data['image'] = page_image
             page_data['tables'] = tables
+            page_data['detection'] = page_bounds  # raw detection output (boxes, scores, labels) for the full page
             page_data['model'] = model
-            page_data['pageNum'] = pageCount
-            results.append(page_data)
-            pageCount +=1
-        doc.close()
-        return results
+            if pix != None and not self._keep_page_images:
+                page_data.pop('image', None)  # only made to crop the tables
+        return pages
+
+
+    # Render each table that wasn't cropped from the page image on its own, at ocr_zoom
+    def _render_table_images(self, pages, doc):
+        mat = fitz.Matrix(self.ocr_zoom, self.ocr_zoom)
+        for page_data in pages:
+            for table_data in page_data['tables']:
+                if 'table_image' in table_data:
+                    continue
+                x1, y1, x2, y2 = [value / self.ocr_zoom for value in table_data['box']]
+                pix = doc[page_data['pageNum'] - 1].get_pixmap(matrix=mat, clip=fitz.Rect(x1, y1, x2, y2))
+                table_data['table_image'] = pixmap_to_image(pix)
 
 
     # Function to export intermediate outputs such as full page image, full table image, and table bounding boxes
@@ -131,11 +612,14 @@ class Table_Detector:
         page_id = 0
         for page in self.page_data:
             page_id += 1
+            if 'image' not in page:
+                logging.warning("No images for page " + str(page_id) + " (results loaded from cache), skipping its intermediate output.")
+                continue
 
             # Save image of the page
             page['image'].save(str(folder_path) + '/page_'+str(page_id)+'.jpg')
-            results = self.find_tables(page['image'])
-            self.plot_table_results(page['image'], results[0][0]['scores'], results[0][0]['labels'], results[0][0]['boxes'], results[1], str(folder_path) + '/page_'+str(page_id)+'full'+'.jpg')
+            detection = page['detection']
+            self.plot_table_results(page['image'], detection['scores'], detection['labels'], detection['boxes'], page['model'], str(folder_path) + '/page_'+str(page_id)+'full'+'.jpg')
             
             # Iterate through the tables on the page (may be more than one)
             table_id = 0
@@ -153,14 +637,19 @@ class Table_Detector:
                 table['table_content'].save_pre_ocr_table(str(folder_path) + "/" + table_id_string + "_pre_ocr_cells/")
    
 
-    def to_excel(self, filename='all_excel.xlsx', raw = False):
-        if self.page_data == None:
+    # pages can be any iterable of page results, such as iter_pages(), to write the sheets as the pages are processed.
+    # By default the page data processed on construction is written.
+    def to_excel(self, filename='all_excel.xlsx', raw = False, pages = None):
+        if pages == None:
+            pages = self.page_data
+        if pages == None:
             logging.warn("No page data to write to excel. No output file generated ")
             return
 
         logging.info("Writing table data to excel.")
+        import pandas as pd
         with pd.ExcelWriter(filename) as writer:
-            for page_dict in self.page_data: #For each page
+            for page_dict in pages: #For each page
                 counter = 1
                 for table_dict in page_dict['tables']:
                     table = table_dict['table_content']
@@ -174,3 +663,41 @@ class Table_Detector:
                     counter += 1
         logging.info("Finished writing table data to excel.")
         return filename
+
+
+
+# RGB PIL image of a rendered pixmap
+def pixmap_to_image(pix):
+    return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+
+# Copy of a page's results with the images left out, as stored in the result cache
+def copy_without_images(page_data):
+    page_copy = {key: value for key, value in page_data.items() if key not in ['image', 'pixmap', 'pixels', 'model', 'words', 'page_cache_key', 'page_size']}
+    page_copy['tables'] = []
+    for table_data in page_data['tables']:
+        table_copy = {key: value for key, value in table_data.items() if key not in ['table_image', 'words']}
+        table_copy['table_content'] = copy.copy(table_data['table_content'])
+        table_copy['table_content'].release_images()
+        page_copy['tables'].append(table_copy)
+    return page_copy
+
+
+# Hash of everything that is drawn on a page: its size and rotation, its content streams, the images, fonts and
+# form XObjects it uses, and its annotations with their appearance streams. Object numbers are left out of the
+# annotations, as they change when a document is saved again.
+def fingerprint_page_content(page):
+    doc = page.parent
+    fingerprint = hashlib.sha256()
+    fingerprint.update(str((tuple(page.rect), page.rotation)).encode('utf8'))
+    fingerprint.update(page.read_contents())
+    xrefs = [image[0] for image in page.get_images(full = True)] + [font[0] for font in page.get_fonts(full = True)]
+    xrefs += [xobject[0] for xobject in page.get_xobjects()]
+    for annot_xref in [annot[0] for annot in page.annot_xrefs()]:
+        fingerprint.update(re.sub(r'\d+ \d+ R', 'R', doc.xref_object(annot_xref, compressed = True)).encode('utf8'))
+        appearance = doc.xref_get_key(annot_xref, 'AP/N')[1]
+        xrefs += [int(xref) for xref in re.findall(r'(\d+) \d+ R', appearance)]
+    for xref in sorted(set(xrefs)):
+        if xref > 0 and doc.xref_is_stream(xref):
+            fingerprint.update(doc.xref_stream_raw(xref))
+    return fingerprint.digest()
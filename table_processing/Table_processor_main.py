@@ -1,4 +1,7 @@
 from Table_Detector import Table_Detector
+from result_cache import ResultCache
+from ocr_memo import OcrMemo
+from profiles import get_profile_names, DEFAULT_PROFILE
 import logging
 from pathlib import Path
 
@@ -32,18 +35,65 @@ def validate_output_filename(filename):
     return filename
 
 
+# The result caches opened so far, one per directory
+result_caches = {}
+
+
+def get_cache(cache_dir):
+    if cache_dir == None:
+        return None
+    if str(cache_dir) not in result_caches:
+        result_caches[str(cache_dir)] = ResultCache(cache_dir)
+    return result_caches[str(cache_dir)]
+
+
+# The OCR memos kept on disk, one per directory
+ocr_memos = {}
+
+
+def get_ocr_memo(ocr_memo_dir):
+    if ocr_memo_dir == None:
+        return None
+    if str(ocr_memo_dir) not in ocr_memos:
+        ocr_memos[str(ocr_memo_dir)] = OcrMemo(persistent = get_cache(ocr_memo_dir))
+    return ocr_memos[str(ocr_memo_dir)]
+
+
+# The result and page caches for cache_dir and page_cache_dir. Cached results have no images, so the caches are
+# left out when the intermediate output is requested.
+def get_caches(cache_dir, page_cache_dir, input_intermediate_output):
+    if input_intermediate_output == True:
+        if cache_dir != None or page_cache_dir != None:
+            logging.info("Intermediate output requested, the result cache is not used.")
+        return None, None
+    return get_cache(cache_dir), get_cache(page_cache_dir)
+
+
 # Process the content of the input file.
 # Returns the path to the output file
 # This is the main method to call if you have file content instead of a file path
 # (Notably used by the GUI)
-def process_content(content, output_file_path = default_output, input_intermediate_output = True):
+# max_workers is the number of OCR workers used for the document, executor_type is 'thread' or 'process' (see ocr_pool.py)
+# pipeline_workers runs the processing steps as a pipeline, with the number of workers for each step (see Table_Detector)
+# cache_dir is the directory of the result cache. Files already processed with the same settings are loaded from it.
+# The result and page caches are not used when input_intermediate_output is True.
+# page_cache_dir is the directory of the page cache. Only pages that weren't processed before with the same settings are processed.
+# ocr_memo_dir is the directory where OCR results of cell images are kept, to be reused by every document (see ocr_memo.py).
+# engine is the inference engine of the models: 'torch', 'quantized' or 'onnx' (see inference_engines.py).
+# profile is the speed/accuracy profile, 'fast', 'balanced', 'accurate' or a custom one (see profiles.py).
+# With use_text_layer, tables of digital PDFs are filled from the PDF's text layer instead of OCR (see Table_Detector).
+def process_content(content, output_file_path = default_output, input_intermediate_output = True, max_workers = 1, executor_type = 'thread', pipeline_workers = None,
+                    cache_dir = None, page_cache_dir = None, ocr_memo_dir = None, engine = 'torch', profile = None, use_text_layer = False):
     logging.info("Processing file content.")
     output_file_path = validate_output_filename(output_file_path)
     output_dir = Path(output_file_path).parents[0]
     intermediate_output_path = str(output_dir) + '/intermediate_output/'
     
     try:
-        detector = Table_Detector(filedata = content)
+        cache, page_cache = get_caches(cache_dir, page_cache_dir, input_intermediate_output)
+        detector = Table_Detector(filedata = content, max_workers = max_workers, executor_type = executor_type, pipeline_workers = pipeline_workers,
+                                  cache = cache, page_cache = page_cache, ocr_memo = get_ocr_memo(ocr_memo_dir),
+                                  engine = engine, profile = profile, use_text_layer = use_text_layer)
         logging.info("Saving output to: " + str(output_file_path))
         detector.to_excel(str(output_file_path))
         logging.info("Saving intermediate steps to: " + str(intermediate_output_path))
@@ -60,7 +110,17 @@ def process_content(content, output_file_path = default_output, input_intermedia
 # Returns the path to the output file
 # This is the main method to call if you have a path to an input file
 # (Notably used by the console application)
-def process_pdf(input_file_path, output_file_path = default_output, input_intermediate_output = False):
+# max_workers is the number of OCR workers used for the document, executor_type is 'thread' or 'process' (see ocr_pool.py)
+# pipeline_workers runs the processing steps as a pipeline, with the number of workers for each step (see Table_Detector)
+# cache_dir is the directory of the result cache. Files already processed with the same settings are loaded from it.
+# The result and page caches are not used when input_intermediate_output is True.
+# page_cache_dir is the directory of the page cache. Only pages that weren't processed before with the same settings are processed.
+# ocr_memo_dir is the directory where OCR results of cell images are kept, to be reused by every document (see ocr_memo.py).
+# engine is the inference engine of the models: 'torch', 'quantized' or 'onnx' (see inference_engines.py).
+# profile is the speed/accuracy profile, 'fast', 'balanced', 'accurate' or a custom one (see profiles.py).
+# With use_text_layer, tables of digital PDFs are filled from the PDF's text layer instead of OCR (see Table_Detector).
+def process_pdf(input_file_path, output_file_path = default_output, input_intermediate_output = False, max_workers = 1, executor_type = 'thread', pipeline_workers = None,
+                cache_dir = None, page_cache_dir = None, ocr_memo_dir = None, engine = 'torch', profile = None, use_text_layer = False):
     logging.info("Processing path provided: " + str(input_file_path))
     input_file_path = validate_input_filename(input_file_path)
     output_file_path = validate_output_filename(output_file_path)
@@ -69,7 +129,10 @@ def process_pdf(input_file_path, output_file_path = default_output, input_interm
     intermediate_output_path = str(output_dir) + '/intermediate_output/'
 
     try:
-        detector = Table_Detector(filename = str(input_file_path))
+        cache, page_cache = get_caches(cache_dir, page_cache_dir, input_intermediate_output)
+        detector = Table_Detector(filename = str(input_file_path), max_workers = max_workers, executor_type = executor_type, pipeline_workers = pipeline_workers,
+                                  cache = cache, page_cache = page_cache, ocr_memo = get_ocr_memo(ocr_memo_dir),
+                                  engine = engine, profile = profile, use_text_layer = use_text_layer)
         logging.info("Saving output to: " + str(output_file_path))
         detector.to_excel(filename = str(output_file_path))
         logging.info("Saving intermediate steps to: " + str(output_file_path))
@@ -82,6 +145,64 @@ def process_pdf(input_file_path, output_file_path = default_output, input_interm
     return (str(output_file_path), str(intermediate_output_path))
 
 
+# Submit the input file to a running extraction server (see extraction_server.py) instead of processing it here.
+# The models are already loaded by the server, so there is no start-up cost. The tables of each page are logged as the
+# server finishes the page. The output file is written by the server in its output directory, named after
+# output_file_path, or after the input file when no output file is given.
+# Returns the path to the output file on the server and the final status of the job (None and 'failed' when the
+# server refused the file or couldn't be reached)
+def submit_pdf(input_file_path, output_file_path = default_output, server_url = None, profile = None):
+    from urllib import request
+    from urllib.error import HTTPError, URLError
+    import json
+    from extraction_server import get_server_url
+    if server_url == None:
+        server_url = get_server_url()
+    input_file_path = validate_input_filename(input_file_path)
+    output_file_path = validate_output_filename(output_file_path)
+    # The output is named inside the server's output directory: after the input unless another name was given
+    output_name = output_file_path.name if str(output_file_path) != default_output else input_file_path.stem + '.xlsx'
+    logging.info("Submitting " + str(input_file_path) + " to " + server_url)
+    # The server may run in another directory, so it gets an absolute input path
+    job_request = {'path': str(input_file_path.resolve()), 'output': output_name, 'profile': profile}
+    submission = request.Request(server_url + '/jobs', data = json.dumps(job_request).encode('utf8'), headers = {'Content-Type': 'application/json'})
+    try:
+        with request.urlopen(submission) as response:
+            job = json.loads(response.read())
+        with request.urlopen(server_url + '/jobs/' + job['id'] + '/pages') as response:
+            for line in response:
+                result = json.loads(line)
+                if 'job' in result:
+                    job = result['job']
+                else:
+                    logging.info("Page " + str(result['page']) + ": " + str(len(result['tables'])) + " tables")
+    except HTTPError as e:
+        body = e.read()
+        try:
+            error = json.loads(body)['error']
+        except (ValueError, KeyError):
+            error = body.decode('utf8', 'replace')
+        logging.error('submit_pdf - The server refused the file: ' + str(e.code) + ' ' + str(error))
+        return (None, 'failed')
+    except URLError as e:
+        logging.error('submit_pdf - Could not reach the server at ' + server_url + ': ' + str(e.reason))
+        return (None, 'failed')
+    if job['status'] != 'done':
+        logging.error('submit_pdf - The server could not process the file: ' + str(job['error']))
+    logging.info("Processing complete. Results are in: " + str(job['output']))
+    return (job['output'], job['status'])
+
+
+# Ask for the speed/accuracy profile, the default profile is used if the answer isn't one of them
+def input_profile():
+    profile = input('Which profile would you like to use? (' + '/'.join(get_profile_names()) + ', default ' + DEFAULT_PROFILE + '): ').strip()
+    if profile not in get_profile_names():
+        if profile != '':
+            print('Unknown profile, running as ' + DEFAULT_PROFILE)
+        profile = DEFAULT_PROFILE
+    return profile
+
+
 # Main console application
 def console_main():
     logging.info("Table Processor started")
@@ -93,12 +214,67 @@ def console_main():
             input_intermediate_output = True
         else:
             input_intermediate_output = False
-        output_file_path, intermediate_output_path = process_pdf(input_file_path, output_file_path, input_intermediate_output)
+        profile = input_profile()
+        output_file_path, intermediate_output_path = process_pdf(input_file_path, output_file_path, input_intermediate_output, profile = profile)
     except NameError:
         print('NameError, spelt incorrectly, running as False')
         output_file_path, intermediate_output_path = process_pdf(input_file_path, output_file_path)
     logging.info("Table Processor finished. Results are in: " + output_file_path+"\n"+ 'Intermediate Output are in: ' + intermediate_output_path)
 
 
+# Command line: with no arguments, asks for the files in the console. With --serve, runs the extraction server.
+# With --server, the input file is submitted to a running extraction server instead of being processed here.
+# With --batch, the input is a directory or a glob pattern of PDF files, processed into --output-dir (see batch_processing.py).
+# With --queue, the PDFs of the input directory or glob pattern are added to a queue file shared by several workers, and with
+# no input the jobs of the queue are processed, e.g. on each of several machines (see job_queue.py).
+def main(arguments = None):
+    import argparse
+    from extraction_server import DEFAULT_HOST, DEFAULT_PORT
+    parser = argparse.ArgumentParser(description = "Extract the tables of a PDF file to an Excel file.")
+    parser.add_argument('input', nargs = '?', help = "input PDF file, asked for in the console when not given")
+    parser.add_argument('--output', default = default_output, help = "output xlsx file")
+    parser.add_argument('--profile', default = None, help = "speed/accuracy profile (see profiles.py)")
+    parser.add_argument('--server', default = None, help = "URL of a running extraction server to submit the input file to")
+    parser.add_argument('--serve', action = 'store_true', help = "run the extraction server")
+    parser.add_argument('--batch', action = 'store_true', help = "process every PDF of the input directory or glob pattern")
+    parser.add_argument('--output-dir', default = './batch_output', help = "output directory of a batch, with its manifest")
+    parser.add_argument('--queue', default = None, help = "job queue file to add the input to, or to process jobs from")
+    parser.add_argument('--host', default = DEFAULT_HOST, help = "address the server listens on")
+    parser.add_argument('--port', type = int, default = DEFAULT_PORT, help = "port the server listens on")
+    parser.add_argument('--input-root', action = 'append', default = None, help = "directory the server reads input files from (repeat for several, any by default)")
+    parser.add_argument('--workers', type = int, default = 1, help = "number of documents the server or batch processes at once")
+    parser.add_argument('--engine', default = 'torch', help = "inference engine of the models (see inference_engines.py)")
+    parser.add_argument('--text-layer', action = 'store_true', help = "fill the tables of digital PDFs from their text layer instead of OCR")
+    arguments = parser.parse_args(arguments)
+    detector_options = {'use_text_layer': True} if arguments.text_layer else None
+
+    if arguments.serve:
+        from extraction_server import ExtractionServer
+        server = ExtractionServer(host = arguments.host, port = arguments.port, workers = arguments.workers, engine = arguments.engine,
+                                  profile = arguments.profile, input_roots = arguments.input_root, detector_options = detector_options)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
+    elif arguments.queue != None:
+        from job_queue import JobQueue, run_worker
+        if arguments.input != None:
+            queue = JobQueue(arguments.queue)
+            logging.info("Added " + str(queue.add_files(arguments.input, arguments.output_dir)) + " jobs to " + arguments.queue + ": " + str(queue.get_counts()))
+        else:
+            logging.info("Jobs processed: " + str(run_worker(arguments.queue, engine = arguments.engine, profile = arguments.profile,
+                                                                detector_options = detector_options)))
+    elif arguments.input == None:
+        console_main()
+    elif arguments.batch:
+        from batch_processing import process_batch
+        process_batch(arguments.input, arguments.output_dir, workers = arguments.workers, engine = arguments.engine, profile = arguments.profile,
+                      detector_options = detector_options)
+    elif arguments.server != None:
+        submit_pdf(arguments.input, arguments.output, server_url = arguments.server, profile = arguments.profile)
+    else:
+        process_pdf(arguments.input, arguments.output, profile = arguments.profile, engine = arguments.engine, use_text_layer = arguments.text_layer)
+
+
 if __name__ == '__main__':
-    console_main()
+    main()
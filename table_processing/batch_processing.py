@@ -0,0 +1,169 @@
+from pathlib import Path
+import glob
+import json
+import logging
+import os
+import time
+
+from ocr_pool import map_unordered
+from result_cache import hash_content
+
+'''
+Batch processing of many PDFs without the console prompts, e.g. a directory or a glob of PDF files:
+    python table_processing/Table_processor_main.py --batch "scans/**/*.pdf" --output-dir extracted --workers 8
+The files are processed by a pool of worker processes, each loading the models once. Every file gets its own
+output file, named after its path relative to the input directory, so the outputs don't depend on which
+worker processed which file or in what order.
+Files whose output names would only differ by case (e.g. a.pdf and a.PDF) are rejected before anything is processed.
+A manifest (manifest.jsonl in the output directory) records the hash, status, timings and output of each file.
+It is appended to as soon as each file finishes and compacted, in input order, at the end of the run. A run that was stopped
+is resumed by running the same command again: files already done with the same content and settings are skipped,
+failed and missing files are processed again.
+'''
+
+MANIFEST_NAME = 'manifest.jsonl'
+
+
+# The absolute paths of the PDF files of a directory (recursively) or matching a glob pattern, sorted, and the
+# directory their output names are relative to
+def find_input_files(source):
+    if os.path.isdir(str(source)):
+        root = Path(source).resolve()
+        files = [path for path in root.rglob('*') if path.suffix.lower() == '.pdf' and path.is_file()]
+    else:
+        files = [Path(path).resolve() for path in glob.glob(str(source), recursive = True) if Path(path).suffix.lower() == '.pdf' and os.path.isfile(path)]
+        root = Path(os.path.commonpath([str(path.parent) for path in files])) if len(files) > 0 else Path('.').resolve()
+    return sorted(files), root
+
+
+# Output path of a file: its path relative to root, under output_directory, as an xlsx file
+def get_output_path(path, root, output_directory):
+    return Path(output_directory) / Path(path).relative_to(root).with_suffix('.xlsx')
+
+
+# Output paths of files (see get_output_path). Raises if two files would get the same output, also when the names
+# only differ by case, as they do on a case-insensitive file system.
+def get_output_paths(files, root, output_directory):
+    outputs = [get_output_path(path, root, output_directory) for path in files]
+    first_files = {}
+    for path, output in zip(files, outputs):
+        other = first_files.setdefault(str(output).lower(), path)
+        if other != path:
+            raise Exception("Invalid input files: " + str(other) + " and " + str(path) + " would have the same output " + str(output))
+    return outputs
+
+
+# The last record of each file in the manifest, by input path
+def load_manifest(manifest_path):
+    records = {}
+    if not os.path.exists(str(manifest_path)):
+        return records
+    with open(str(manifest_path), 'r', encoding = 'utf8') as file:
+        for line in file:
+            line = line.strip()
+            if line == '':
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # a line cut short when the run was stopped
+            records[record['input']] = record
+    return records
+
+
+# Rewrite the manifest with only the last record of each file, sorted by input path
+def compact_manifest(manifest_path):
+    records = load_manifest(manifest_path)
+    temporary_path = str(manifest_path) + '.tmp'
+    with open(temporary_path, 'w', encoding = 'utf8') as file:
+        for input_path in sorted(records.keys()):
+            file.write(json.dumps(records[input_path], sort_keys = True) + '\n')
+    os.replace(temporary_path, str(manifest_path))
+
+
+def hash_file(path):
+    with open(str(path), 'rb') as file:
+        return hash_content(file.read())
+
+
+# A file is skipped when its last record is done with the same content and settings and its output still exists
+# (files with no tables have no output)
+def is_done(record, path, settings):
+    return (record != None and record['status'] == 'done' and record.get('settings') == settings and
+            (record['output'] == None or os.path.exists(record['output'])) and record['sha256'] == hash_file(path))
+
+
+# Run once in each worker: load the models so every file of the worker uses them, and split the CPU threads
+# between the workers
+def initialize_worker(engine, threads):
+    import model_registry
+    if threads != None:
+        import torch
+        torch.set_num_threads(threads)
+    model_registry.warm_up(engine)
+
+
+# Process one file of the batch. task is (input path, output path, settings), returns the file's manifest record.
+# The output is written under a temporary name and renamed when complete, so a stopped run never leaves a partial output.
+def process_file(task):
+    from Table_Detector import Table_Detector
+    input_path, output_path, settings = task
+    record = {'input': input_path, 'output': output_path, 'settings': settings, 'sha256': None, 'started': time.time(), 'error': None}
+    start = time.perf_counter()
+    try:
+        with open(input_path, 'rb') as file:
+            content = file.read()
+        record['sha256'] = hash_content(content)
+        detector = Table_Detector(filedata = content, eager = False, engine = settings['engine'], profile = settings['profile'],
+                                  **settings['options'])
+        os.makedirs(os.path.dirname(output_path), exist_ok = True)
+        pages = list(detector.iter_pages())
+        if detector.get_run_stats()['tables'] > 0:
+            temporary_path = output_path[:-len('.xlsx')] + '.partial.xlsx'
+            detector.to_excel(filename = temporary_path, pages = pages)
+            os.replace(temporary_path, output_path)
+        else:
+            record['output'] = None  # no tables found, there is nothing to write
+        record['status'] = 'done'
+        record['pages'] = detector.get_run_stats()['pages']
+        record['tables'] = detector.get_run_stats()['tables']
+    except Exception as e:
+        logging.error('process_file - ' + input_path + ' could not be processed: ' + str(e))
+        record['status'] = 'failed'
+        record['error'] = str(e)
+        record['output'] = None
+    record['seconds'] = time.perf_counter() - start
+    return record
+
+
+# Process every PDF of source (a directory or a glob pattern) into output_directory with workers processes.
+# engine and profile are used for every file (see Table_Detector), detector_options are passed on to each Table_Detector.
+# Returns the counts of files done, failed and skipped (already done by an earlier run).
+def process_batch(source, output_directory, workers = 1, engine = 'torch', profile = None, detector_options = None, executor_type = 'process'):
+    files, root = find_input_files(source)
+    os.makedirs(str(output_directory), exist_ok = True)
+    manifest_path = Path(output_directory) / MANIFEST_NAME
+    records = load_manifest(manifest_path)
+    settings = {'engine': engine, 'profile': profile, 'options': detector_options if detector_options != None else {}}
+    settings = json.loads(json.dumps(settings))  # as it is read back from the manifest
+
+    tasks = []
+    counts = {'done': 0, 'failed': 0, 'skipped': 0}
+    for path, output_path in zip(files, get_output_paths(files, root, output_directory)):
+        if is_done(records.get(str(path)), path, settings):
+            counts['skipped'] += 1
+            continue
+        tasks.append((str(path), str(output_path), settings))
+    logging.info("Batch of " + str(len(files)) + " files, " + str(counts['skipped']) + " already done, " + str(len(tasks)) + " to process")
+
+    threads = max(1, (os.cpu_count() or 1) // workers) if workers > 1 and executor_type == 'process' else None
+    with open(str(manifest_path), 'a', encoding = 'utf8') as manifest:
+        for record in map_unordered(process_file, tasks, max_workers = workers, executor_type = executor_type,
+                                  initializer = initialize_worker, initargs = (engine, threads)):
+            manifest.write(json.dumps(record, sort_keys = True) + '\n')
+            manifest.flush()
+            counts[record['status']] += 1
+            logging.info(record['status'] + ": " + record['input'] + " in " + '{0:.1f}'.format(record['seconds']) + "s")
+    compact_manifest(manifest_path)
+    logging.info("Batch complete: " + str(counts))
+    return counts
@@ -0,0 +1,324 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import OrderedDict, deque
+from pathlib import Path
+import base64
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+from Table_Detector import Table_Detector
+from profiles import get_profile
+import model_registry
+
+'''
+Resident extraction server. Keeps the models loaded between documents and processes the PDFs submitted to it
+with a local HTTP API, so each document doesn't pay for starting Python, importing torch and loading the models.
+    python table_processing/Table_processor_main.py --serve
+The API (JSON):
+- POST /jobs: submit a PDF, {"path": ...} or {"content": <base64>}, with an optional "output" xlsx path and "profile".
+  The request must have the Content-Type application/json. The output path is relative to the server's output directory
+  and can't lead out of it. When the server has input roots, the path must be inside one of them.
+- GET /jobs/<id>: status of a job (queued, running, done or failed), its timings and output
+- GET /jobs/<id>/pages: the results of each page as a JSON line, streamed as the pages are done, until the job ends
+- GET /stats: queue depth, running and finished jobs, and the latency (wait and processing time) of recent jobs
+- GET /health
+Jobs are processed in submission order by a fixed number of workers. The server only listens on localhost by default.
+'''
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_OUTPUT_DIRECTORY = './server_output'
+MAX_FINISHED_JOBS = 1000  # finished jobs kept for status requests, the oldest are dropped first
+LATENCY_WINDOW = 1000  # number of recent jobs the latency stats are computed from
+
+
+def get_server_url(host = DEFAULT_HOST, port = DEFAULT_PORT):
+    return 'http://' + host + ':' + str(port)
+
+
+# Absolute path of path, relative to directory when it isn't absolute. Raises if it isn't inside directory, including
+# through '..' or a symbolic link.
+def resolve_inside(path, directory, description):
+    directory = os.path.realpath(str(directory))
+    resolved = os.path.realpath(os.path.join(directory, str(path)))
+    if os.path.commonpath([resolved, directory]) != directory:
+        raise Exception("Invalid " + description + ": " + str(path) + ". Must be inside " + directory)
+    return resolved
+
+
+# Results of a page as sent to clients: the page number and the box, score and cells of each table found on it
+def page_to_json(page_data):
+    tables = []
+    for table_data in page_data['tables']:
+        table = table_data['table_content'].get_as_dataframe()
+        tables.append({'box': [float(value) for value in table_data['box']],
+                       'score': float(table_data['score']),
+                       'columns': [str(column) for column in table.columns],
+                       'rows': table.astype(str).values.tolist()})
+    return {'page': page_data['pageNum'], 'tables': tables}
+
+
+class Job:
+
+    def __init__(self, job_id, filename = None, content = None, output = None, profile = None):
+        self.id = job_id
+        self.filename = filename
+        self.content = content
+        self.output = output
+        self.profile = profile
+        self.status = 'queued'
+        self.error = None
+        self.pages = []
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.condition = threading.Condition()
+
+    def is_finished(self):
+        return self.status in ['done', 'failed']
+
+    def add_page(self, page):
+        with self.condition:
+            self.pages.append(page)
+            self.condition.notify_all()
+
+    def set_status(self, status, error = None):
+        with self.condition:
+            self.status = status
+            self.error = error
+            if status == 'running':
+                self.started = time.time()
+            elif self.is_finished():
+                self.finished = time.time()
+                self.content = None  # the PDF isn't needed anymore
+            self.condition.notify_all()
+
+    # Yield the page results from start on, waiting for the next page until the job is finished
+    def iter_pages(self, start = 0):
+        index = start
+        while True:
+            with self.condition:
+                while index >= len(self.pages) and not self.is_finished():
+                    self.condition.wait()
+                pages = self.pages[index:]
+                finished = self.is_finished()
+            for page in pages:
+                yield page
+            index += len(pages)
+            if finished and index >= len(self.pages):
+                return
+
+    def to_json(self):
+        return {'id': self.id, 'status': self.status, 'error': self.error, 'input': self.filename, 'output': self.output,
+                'pages': len(self.pages), 'submitted': self.submitted, 'started': self.started, 'finished': self.finished}
+
+
+class ExtractionServer:
+
+    # workers is the number of documents processed at the same time. engine and profile are the defaults of the jobs
+    # (see Table_Detector), detector_options are passed on to every Table_Detector, e.g. {'max_workers': 4}.
+    # The outputs are written inside output_directory. input_roots is a list of directories the submitted paths must be
+    # in, None allows any path the server can read.
+    # With warm_up the models are loaded before the server starts listening.
+    def __init__(self, host = DEFAULT_HOST, port = DEFAULT_PORT, workers = 1, engine = 'torch', profile = None,
+                 output_directory = DEFAULT_OUTPUT_DIRECTORY, input_roots = None, detector_options = None, warm_up = True):
+        self.engine = engine
+        self.profile = profile
+        self.output_directory = output_directory
+        self.input_roots = input_roots
+        self.detector_options = detector_options if detector_options != None else {}
+        self.jobs = OrderedDict()
+        self.queue = queue.Queue()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.waits = deque(maxlen = LATENCY_WINDOW)
+        self.durations = deque(maxlen = LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        if warm_up:
+            model_registry.warm_up(engine)
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self))
+        self.httpd.daemon_threads = True
+        self.workers = [threading.Thread(target = self._work, daemon = True) for i in range(0, workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def get_url(self):
+        host, port = self.httpd.server_address[:2]
+        return get_server_url(host, port)
+
+    def serve_forever(self):
+        logging.info("Extraction server listening on " + self.get_url())
+        self.httpd.serve_forever()
+
+    # Serve from a background thread, e.g. for tests
+    def start(self):
+        thread = threading.Thread(target = self.serve_forever, daemon = True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for worker in self.workers:
+            self.queue.put(None)
+
+    # Add a job to the queue. Either filename or content (the PDF bytes) is required.
+    # output is relative to the output directory, by default the job's id.
+    def submit(self, filename = None, content = None, output = None, profile = None):
+        if filename == None and content == None:
+            raise Exception("A job requires a path or the content of a PDF file.")
+        if filename != None and Path(filename).suffix != '.pdf':
+            raise Exception("Invalid input file type, input must be a pdf file.")
+        if filename != None and self.input_roots != None:
+            filename = self._resolve_input(filename)
+        if output != None and Path(output).suffix != '.xlsx':
+            raise Exception("Invalid output file type, output must be an xlsx file.")
+        if profile != None:
+            get_profile(profile)  # raises for an unknown profile
+        job_id = uuid.uuid4().hex
+        output = resolve_inside(output if output != None else job_id + '.xlsx', self.output_directory, 'output path')
+        job = Job(job_id, filename, content, output, profile if profile != None else self.profile)
+        with self._lock:
+            self.jobs[job_id] = job
+            self._drop_finished_jobs()
+        self.queue.put(job)
+        logging.info("Job " + job_id + " queued: " + str(filename if filename != None else 'file content'))
+        return job
+
+    # The real path of filename, which must be inside one of the input roots
+    def _resolve_input(self, filename):
+        real_path = os.path.realpath(str(filename))
+        for root in self.input_roots:
+            root = os.path.realpath(str(root))
+            if os.path.commonpath([real_path, root]) == root:
+                return real_path
+        raise Exception("Invalid input path: " + str(filename) + ". Must be inside one of " + str(self.input_roots))
+
+    def get_job(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def _drop_finished_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.is_finished()]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job == None:
+                return
+            with self._lock:
+                self.running += 1
+            job.set_status('running')
+            try:
+                self._run_job(job)
+                job.set_status('done')
+            except Exception as e:
+                logging.error("Job " + job.id + " failed: " + str(e))
+                job.set_status('failed', str(e))
+            with self._lock:
+                self.running -= 1
+                if job.status == 'done':
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self.waits.append(job.started - job.submitted)
+                self.durations.append(job.finished - job.started)
+
+    def _run_job(self, job):
+        detector = Table_Detector(filename = job.filename, filedata = job.content, eager = False, engine = self.engine, profile = job.profile,
+                                  **self.detector_options)
+        os.makedirs(os.path.dirname(os.path.abspath(job.output)), exist_ok = True)
+        detector.to_excel(filename = job.output, pages = self._publish_pages(job, detector.iter_pages()))
+
+    # Pass the pages on to to_excel() and give their results to the job as each one is done
+    def _publish_pages(self, job, pages):
+        for page_data in pages:
+            job.add_page(page_to_json(page_data))
+            yield page_data
+
+    def get_stats(self):
+        with self._lock:
+            return {'queue_depth': self.queue.qsize(),
+                    'running': self.running,
+                    'completed': self.completed,
+                    'failed': self.failed,
+                    'wait_seconds': get_latency_stats(list(self.waits)),
+                    'processing_seconds': get_latency_stats(list(self.durations))}
+
+
+# Mean and percentiles of a list of durations in seconds
+def get_latency_stats(durations):
+    if len(durations) == 0:
+        return {'count': 0, 'mean': None, 'p50': None, 'p95': None, 'max': None}
+    durations = sorted(durations)
+    percentile = lambda p: durations[min(len(durations) - 1, int(p * len(durations)))]
+    return {'count': len(durations), 'mean': sum(durations) / len(durations), 'p50': percentile(0.5), 'p95': percentile(0.95), 'max': durations[-1]}
+
+
+def make_handler(server):
+
+    class ExtractionRequestHandler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            logging.debug("Extraction server: " + format % args)
+
+        def send_json(self, value, status = 200):
+            body = json.dumps(value).encode('utf8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parts = [part for part in self.path.split('?')[0].split('/') if part != '']
+            if parts == ['health']:
+                return self.send_json({'status': 'ok'})
+            if parts == ['stats']:
+                return self.send_json(server.get_stats())
+            if len(parts) in [2, 3] and parts[0] == 'jobs':
+                job = server.get_job(parts[1])
+                if job == None:
+                    return self.send_json({'error': 'Unknown job: ' + parts[1]}, 404)
+                if len(parts) == 2:
+                    return self.send_json(job.to_json())
+                if parts[2] == 'pages':
+                    return self.stream_pages(job)
+            self.send_json({'error': 'Not found: ' + self.path}, 404)
+
+        # One JSON line per page as the pages are done, then a last line with the job's final status.
+        # The response has no length, it ends when the connection is closed.
+        def stream_pages(self, job):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for page in job.iter_pages():
+                self.wfile.write((json.dumps(page) + '\n').encode('utf8'))
+                self.wfile.flush()
+            self.wfile.write((json.dumps({'job': job.to_json()}) + '\n').encode('utf8'))
+            self.close_connection = True
+
+        def do_POST(self):
+            if self.path.split('?')[0].rstrip('/') != '/jobs':
+                return self.send_json({'error': 'Not found: ' + self.path}, 404)
+            # Browsers can send a form or text/plain to localhost from any page, but not JSON without asking first
+            if self.headers.get_content_type() != 'application/json':
+                return self.send_json({'error': 'Content-Type must be application/json'}, 415)
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                content = base64.b64decode(request['content']) if request.get('content') != None else None
+                job = server.submit(filename = request.get('path'), content = content, output = request.get('output'),
+                                    profile = request.get('profile'))
+            except Exception as e:
+                return self.send_json({'error': str(e)}, 400)
+            self.send_json(job.to_json(), 202)
+
+    return ExtractionRequestHandler
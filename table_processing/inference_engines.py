@@ -0,0 +1,184 @@
+import torch
+import os
+import sys
+import logging
+import argparse
+from types import SimpleNamespace
+
+'''
+Inference engines for the TableTransformer models. Every engine is called like the transformers model,
+engine(pixel_values=..., pixel_mask=...), returns an output with logits and pred_boxes and has the model's config.
+- 'torch': the full precision PyTorch model
+- 'quantized': the PyTorch model with the weights of its linear layers dynamically quantized to int8
+- 'onnx': the model exported to ONNX and run with ONNX Runtime
+The quantized and onnx engines are prepared once with the export command and loaded from the engine directory:
+    python table_processing/inference_engines.py export --engine onnx
+The export ends with a parity check against the torch model on the PDFs in tests/resources, which can also be run alone:
+    python table_processing/inference_engines.py parity --engine onnx
+'''
+
+ENGINES = ['torch', 'quantized', 'onnx']
+DEFAULT_ENGINE_DIRECTORY = './engines'
+ONNX_OPSET = 17
+PARITY_RESOURCES = './tests/resources'
+# Largest differences from the torch model accepted by the parity check, for the scores and the (relative) boxes
+PARITY_TOLERANCES = {'quantized': {'scores': 0.05, 'boxes': 0.02}, 'onnx': {'scores': 1e-3, 'boxes': 1e-3}}
+
+
+# The engine directory: the TABLE_ENGINE_DIR environment variable if set, otherwise DEFAULT_ENGINE_DIRECTORY
+def default_engine_directory():
+    return os.environ.get('TABLE_ENGINE_DIR', DEFAULT_ENGINE_DIRECTORY)
+
+
+def get_engine_path(model_id, engine, directory = None):
+    if directory == None:
+        directory = default_engine_directory()
+    return os.path.join(str(directory), model_id.replace('/', '--'), engine)
+
+
+def quantize_model(model):
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+# Runs an exported ONNX model with ONNX Runtime
+class OnnxEngine:
+
+    def __init__(self, path, config, threads = None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise Exception("The onnx inference engine requires the onnxruntime package to be installed.")
+        options = onnxruntime.SessionOptions()
+        if threads != None:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(str(path), options, providers = ['CPUExecutionProvider'])
+        self.config = config
+
+    def __call__(self, pixel_values, pixel_mask):
+        logits, pred_boxes = self.session.run(['logits', 'pred_boxes'], {'pixel_values': pixel_values.numpy(), 'pixel_mask': pixel_mask.numpy()})
+        return SimpleNamespace(logits = torch.from_numpy(logits), pred_boxes = torch.from_numpy(pred_boxes))
+
+    def eval(self):
+        return self
+
+
+# Load model_id as the given engine. load_model(model_id) loads the torch model when it is needed.
+# A quantized engine that wasn't exported is quantized on load instead.
+def load_engine(model_id, engine, load_model, directory = None):
+    if engine not in ENGINES:
+        raise Exception("Invalid inference engine: " + str(engine) + ". Must be one of " + str(ENGINES))
+    if engine == 'torch':
+        return load_model(model_id)
+    path = get_engine_path(model_id, engine, directory)
+    if engine == 'quantized':
+        if not os.path.exists(os.path.join(path, 'model.pt')):
+            logging.info("No quantized export of " + model_id + ", quantizing it on load")
+            return quantize_model(load_model(model_id)).eval()
+        from transformers import TableTransformerConfig, TableTransformerForObjectDetection
+        config = TableTransformerConfig.from_pretrained(path)
+        config.use_pretrained_backbone = False  # the backbone weights are in the export
+        model = quantize_model(TableTransformerForObjectDetection(config).eval())
+        model.load_state_dict(torch.load(os.path.join(path, 'model.pt')))
+        return model.eval()
+    if not os.path.exists(os.path.join(path, 'model.onnx')):
+        raise Exception("No ONNX export of " + model_id + " in " + path + ". Run: python table_processing/inference_engines.py export --engine onnx")
+    from transformers import TableTransformerConfig
+    return OnnxEngine(os.path.join(path, 'model.onnx'), TableTransformerConfig.from_pretrained(path))
+
+
+# Prepare the files of an engine for the torch model of model_id, in get_engine_path()
+def export_engine(model, model_id, engine, directory = None):
+    path = get_engine_path(model_id, engine, directory)
+    os.makedirs(path, exist_ok = True)
+    model.config.save_pretrained(path)
+    if engine == 'quantized':
+        torch.save(quantize_model(model).state_dict(), os.path.join(path, 'model.pt'))
+    elif engine == 'onnx':
+        pixel_values = torch.rand(1, 3, 800, 1066)
+        pixel_mask = torch.ones(1, 800, 1066, dtype = torch.int64)
+        dynamic_axes = {'pixel_values': {0: 'batch', 2: 'height', 3: 'width'}, 'pixel_mask': {0: 'batch', 1: 'height', 2: 'width'},
+                        'logits': {0: 'batch'}, 'pred_boxes': {0: 'batch'}}
+        with torch.no_grad():
+            torch.onnx.export(model, (pixel_values, pixel_mask), os.path.join(path, 'model.onnx'), input_names = ['pixel_values', 'pixel_mask'],
+                              output_names = ['logits', 'pred_boxes'], dynamic_axes = dynamic_axes, opset_version = ONNX_OPSET, dynamo = False)
+    else:
+        raise Exception("Only the quantized and onnx engines can be exported, not " + str(engine))
+    return path
+
+
+# Compare the outputs of engine with the ones of reference (the torch model) on the model inputs of images
+# Returns the largest difference in class probabilities and in boxes, and whether the boxes kept at the detection
+# threshold are the same (same count and labels)
+def check_parity(engine, reference, images, threshold = 0.7):
+    from model_registry import get_image_processor
+    image_processor = get_image_processor()
+    report = {'images': len(images), 'scores': 0.0, 'boxes': 0.0, 'same_detections': True}
+    for image in images:
+        encoding = image_processor(image, return_tensors = "pt")
+        with torch.no_grad():
+            expected = reference(pixel_values = encoding['pixel_values'], pixel_mask = encoding['pixel_mask'])
+            actual = engine(pixel_values = encoding['pixel_values'], pixel_mask = encoding['pixel_mask'])
+        expected_scores = expected.logits.softmax(-1)
+        actual_scores = actual.logits.softmax(-1)
+        report['scores'] = max(report['scores'], (expected_scores - actual_scores).abs().max().item())
+        report['boxes'] = max(report['boxes'], (expected.pred_boxes - actual.pred_boxes).abs().max().item())
+        # Same rule as post_process_object_detection: the best class other than "no object" above the threshold
+        expected_kept = expected_scores[0, :, :-1].max(-1)
+        actual_kept = actual_scores[0, :, :-1].max(-1)
+        expected_labels = expected_kept.indices[expected_kept.values > threshold].tolist()
+        actual_labels = actual_kept.indices[actual_kept.values > threshold].tolist()
+        report['same_detections'] = report['same_detections'] and expected_labels == actual_labels
+    return report
+
+
+def parity_passed(report, engine):
+    tolerances = PARITY_TOLERANCES[engine]
+    return report['same_detections'] and report['scores'] <= tolerances['scores'] and report['boxes'] <= tolerances['boxes']
+
+
+# Render the pages of the PDFs in directory as parity check inputs
+def load_parity_images(directory = PARITY_RESOURCES, zoom = 2.0):
+    import fitz
+    from PIL import Image
+    images = []
+    for root, dirs, files in os.walk(directory):
+        for name in sorted(files):
+            if not name.endswith('.pdf'):
+                continue
+            doc = fitz.open(os.path.join(root, name))
+            for page in doc:
+                pix = page.get_pixmap(matrix = fitz.Matrix(zoom, zoom))
+                images.append(Image.frombytes("RGB", [pix.width, pix.height], pix.samples))
+            doc.close()
+    return images
+
+
+def main(arguments = None):
+    from model_registry import DETECTION_MODEL_ID, STRUCTURE_MODEL_ID, _load_model
+    parser = argparse.ArgumentParser(description = "Export the TableTransformer models for an inference engine and check them against torch.")
+    parser.add_argument('command', choices = ['export', 'parity'])
+    parser.add_argument('--engine', choices = ['quantized', 'onnx'], required = True)
+    parser.add_argument('--models', choices = ['detection', 'structure', 'both'], default = 'both')
+    parser.add_argument('--directory', default = None, help = "engine directory (default: " + DEFAULT_ENGINE_DIRECTORY + ")")
+    parser.add_argument('--resources', default = PARITY_RESOURCES, help = "directory of the PDFs used for the parity check")
+    arguments = parser.parse_args(arguments)
+
+    model_ids = {'detection': [DETECTION_MODEL_ID], 'structure': [STRUCTURE_MODEL_ID], 'both': [DETECTION_MODEL_ID, STRUCTURE_MODEL_ID]}[arguments.models]
+    images = load_parity_images(arguments.resources)
+    passed = True
+    for model_id in model_ids:
+        reference = _load_model(model_id)
+        if arguments.command == 'export':
+            print("Exported " + model_id + " to " + export_engine(reference, model_id, arguments.engine, arguments.directory))
+        engine = load_engine(model_id, arguments.engine, _load_model, arguments.directory)
+        report = check_parity(engine, reference, images)
+        model_passed = parity_passed(report, arguments.engine)
+        passed = passed and model_passed
+        print(model_id + " " + arguments.engine + " parity on " + str(report['images']) + " images: largest score difference " +
+              '{0:.2e}'.format(report['scores']) + ", largest box difference " + '{0:.2e}'.format(report['boxes']) +
+              ", same detections: " + str(report['same_detections']) + (" - passed" if model_passed else " - FAILED"))
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
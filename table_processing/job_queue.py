@@ -0,0 +1,230 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from batch_processing import find_input_files, get_output_paths, initialize_worker, process_file
+
+'''
+Job queue shared by workers on several processes or machines, stored in a SQLite file.
+Workers lease one job at a time. A lease lasts lease_seconds and is kept alive by heartbeats while the job runs,
+so the job of a worker that died is leased again by another worker once its lease expires. A job that fails
+(or whose lease expires) is retried up to max_attempts times, then it is marked failed.
+Every job has a fixed output path, given when it is added. The output is written under a name unique to the lease
+and only renamed to the output path by the worker that completes the job while still holding its lease, so each
+job has a single output however many workers ran it.
+    python table_processing/Table_processor_main.py "scans/**/*.pdf" --queue jobs.db --output-dir extracted
+    python table_processing/Table_processor_main.py --queue jobs.db      (on every machine, as many times as needed)
+The queue file is locked by SQLite. On a shared directory it needs a file system with working locks, and the
+input and output paths must be the same on every machine.
+Lease expiry times are written with the clock of the worker that leases the job and compared with the clock of the
+others (SQLite's own time functions read the local clock too), so the clocks of the machines must agree, e.g. with
+NTP, to well within lease_seconds. A clock that is ahead takes over jobs whose leases haven't expired yet.
+'''
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+JOB_STATUSES = ['pending', 'leased', 'done', 'failed']
+
+
+def get_worker_id():
+    return socket.gethostname() + ':' + str(os.getpid())
+
+
+class JobQueue:
+
+    def __init__(self, path, lease_seconds = DEFAULT_LEASE_SECONDS, max_attempts = DEFAULT_MAX_ATTEMPTS, timeout = 60):
+        self.path = str(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        connection = self._connect()
+        try:
+            connection.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                                  id INTEGER PRIMARY KEY, input TEXT UNIQUE NOT NULL, output TEXT NOT NULL, status TEXT NOT NULL,
+                                  attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, token TEXT, lease_expires REAL,
+                                  added REAL, started REAL, finished REAL, error TEXT, result TEXT)''')
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)')
+        finally:
+            connection.close()
+
+    # A new connection for every call, so the queue can be used from any thread or process
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout = self.timeout, isolation_level = None)
+
+    # Run function(connection) in a write transaction. BEGIN IMMEDIATE takes the write lock right away, so two
+    # workers can't lease the same job.
+    def _write(self, function):
+        connection = self._connect()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = function(connection)
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+            return result
+        finally:
+            connection.close()
+
+    # Add a job for each input path with its output path, as a list of (input, output). Inputs already in the queue
+    # are left as they are. Returns the number of jobs added.
+    def add(self, jobs):
+        now = time.time()
+        def add_jobs(connection):
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO jobs (input, output, status, added) VALUES (?, ?, 'pending', ?)",
+                                   [(str(input_path), str(output_path), now) for input_path, output_path in jobs])
+            return connection.total_changes - before
+        return self._write(add_jobs)
+
+    # Add every PDF of source (a directory or a glob pattern), with their outputs named as in batch_processing
+    def add_files(self, source, output_directory):
+        files, root = find_input_files(source)
+        return self.add([(path, os.path.abspath(str(output_path))) for path, output_path in zip(files, get_output_paths(files, root, output_directory))])
+
+    # Lease the next job for worker_id. Returns the job as a dict (id, input, output, token, attempts) or None when
+    # there is no job to run. Jobs whose lease expired are leased again, or marked failed after max_attempts.
+    def lease(self, worker_id = None):
+        worker_id = worker_id if worker_id != None else get_worker_id()
+        def lease_job(connection):
+            now = time.time()
+            while True:
+                row = connection.execute("SELECT id, input, output, status, attempts FROM jobs WHERE status = 'pending' OR "
+                                         "(status = 'leased' AND lease_expires < ?) ORDER BY id LIMIT 1", (now,)).fetchone()
+                if row == None:
+                    return None
+                job_id, input_path, output_path, status, attempts = row
+                if status == 'leased' and attempts >= self.max_attempts:
+                    connection.execute("UPDATE jobs SET status = 'failed', token = NULL, finished = ?, error = ? WHERE id = ?",
+                                       (now, 'Lease expired ' + str(attempts) + ' times', job_id))
+                    continue
+                token = uuid.uuid4().hex
+                connection.execute("UPDATE jobs SET status = 'leased', attempts = ?, worker = ?, token = ?, lease_expires = ?, started = ? "
+                                   "WHERE id = ?", (attempts + 1, worker_id, token, now + self.lease_seconds, now, job_id))
+                return {'id': job_id, 'input': input_path, 'output': output_path, 'token': token, 'attempts': attempts + 1}
+        return self._write(lease_job)
+
+    # Extend the lease of job. Returns False if the lease was lost (it expired and the job was leased again).
+    def heartbeat(self, job):
+        def extend(connection):
+            cursor = connection.execute("UPDATE jobs SET lease_expires = ? WHERE id = ? AND token = ? AND status = 'leased'",
+                                        (time.time() + self.lease_seconds, job['id'], job['token']))
+            return cursor.rowcount == 1
+        return self._write(extend)
+
+    # Mark job done, moving temporary_output (if any) to the job's output path. Returns False, with nothing moved,
+    # if the lease was lost. The move is done while holding the queue's write lock, so only one worker can do it.
+    # result is stored with the job, with its output set to the job's output path once temporary_output is moved there.
+    def complete(self, job, temporary_output = None, result = None):
+        def finish(connection):
+            row = connection.execute('SELECT status, token FROM jobs WHERE id = ?', (job['id'],)).fetchone()
+            if row == None or row[0] != 'leased' or row[1] != job['token']:
+                return False
+            stored_result = result
+            if temporary_output != None:
+                os.replace(temporary_output, job['output'])
+                if result != None and result.get('output') == temporary_output:
+                    stored_result = dict(result, output = job['output'])
+            connection.execute("UPDATE jobs SET status = 'done', token = NULL, finished = ?, error = NULL, result = ? WHERE id = ?",
+                               (time.time(), json.dumps(stored_result, sort_keys = True), job['id']))
+            return True
+        return self._write(finish)
+
+    # Give job back after an error. It is retried unless it already ran max_attempts times. Returns False if the lease was lost.
+    def fail(self, job, error):
+        def give_back(connection):
+            row = connection.execute('SELECT status, token, attempts FROM jobs WHERE id = ?', (job['id'],)).fetchone()
+            if row == None or row[0] != 'leased' or row[1] != job['token']:
+                return False
+            status = 'pending' if row[2] < self.max_attempts else 'failed'
+            connection.execute('UPDATE jobs SET status = ?, token = NULL, lease_expires = NULL, finished = ?, error = ? WHERE id = ?',
+                               (status, time.time(), str(error), job['id']))
+            return True
+        return self._write(give_back)
+
+    # Number of jobs in each status
+    def get_counts(self):
+        connection = self._connect()
+        try:
+            counts = dict(connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        finally:
+            connection.close()
+        return {status: counts.get(status, 0) for status in JOB_STATUSES}
+
+    def get_jobs(self):
+        connection = self._connect()
+        connection.row_factory = sqlite3.Row
+        try:
+            return [dict(row) for row in connection.execute('SELECT * FROM jobs ORDER BY id').fetchall()]
+        finally:
+            connection.close()
+
+
+# Keeps the lease of job alive from a background thread while it runs. A heartbeat that fails (e.g. the queue is
+# locked for longer than its timeout) is logged and tried again at the next beat.
+class Heartbeat:
+
+    def __init__(self, queue, job):
+        self.queue = queue
+        self.job = job
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self._beat, daemon = True)
+        self._thread.start()
+
+    def _beat(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            try:
+                kept = self.queue.heartbeat(self.job)
+            except Exception as e:
+                logging.warning("Heartbeat of " + self.job['input'] + " failed, trying again: " + str(e))
+                continue
+            if not kept:
+                logging.warning("Lost the lease of " + self.job['input'])
+                return
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+# Lease and process jobs from the queue at queue_path until there are none left (or, with wait, forever, checking for
+# new jobs every poll_seconds). The models are loaded once. Returns the counts of jobs done, failed and lost.
+def run_worker(queue_path, worker_id = None, engine = 'torch', profile = None, detector_options = None, lease_seconds = DEFAULT_LEASE_SECONDS,
+               max_attempts = DEFAULT_MAX_ATTEMPTS, wait = False, poll_seconds = 5):
+    queue = JobQueue(queue_path, lease_seconds = lease_seconds, max_attempts = max_attempts)
+    worker_id = worker_id if worker_id != None else get_worker_id()
+    settings = {'engine': engine, 'profile': profile, 'options': detector_options if detector_options != None else {}}
+    initialize_worker(engine, None)
+    counts = {'done': 0, 'failed': 0, 'lost': 0}
+    while True:
+        job = queue.lease(worker_id)
+        if job == None:
+            if not wait:
+                return counts
+            time.sleep(poll_seconds)
+            continue
+        logging.info(worker_id + " leased " + job['input'] + " (attempt " + str(job['attempts']) + ")")
+        # Written under a name of its own, renamed to the output path by complete()
+        temporary_output = job['output'][:-len('.xlsx')] + '.' + job['token'] + '.xlsx'
+        heartbeat = Heartbeat(queue, job)
+        try:
+            record = process_file((job['input'], temporary_output, settings))
+        finally:
+            heartbeat.stop()
+        if record['status'] == 'done':
+            finished = queue.complete(job, record['output'], record)
+        else:
+            finished = queue.fail(job, record['error'])
+        if not finished:
+            counts['lost'] += 1
+            if record['output'] != None and os.path.exists(record['output']):
+                os.remove(record['output'])
+        else:
+            counts[record['status']] += 1
+
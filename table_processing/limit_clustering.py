@@ -0,0 +1,84 @@
+import bisect
+import numpy as np
+
+'''
+Clustering of the row and column limits given by the edges of the structure boxes of a table.
+Edges closer together than a threshold are merged into a single limit, the first (smallest) one of the group.
+Thresholds are given in points (1/72 inch) and converted to pixels for the resolution the table was rendered at,
+so the same table gives the same grid at any zoom.
+'''
+
+POINTS_PER_INCH = 72
+DEFAULT_DPI = 144  # pages rendered at a zoom of 2
+ROW_THRESHOLD = 4  # points, 8 pixels at the default DPI
+COLUMN_THRESHOLD = 8  # points, 16 pixels at the default DPI
+
+
+def points_to_pixels(points, dpi = DEFAULT_DPI):
+    return points * dpi / POINTS_PER_INCH
+
+
+# Group the limits into clusters of limits less than threshold apart from the cluster's first limit
+# Returns the sorted first limit of every cluster and the number of limits in each cluster (its support).
+# Gives the same limits as checking every limit against every kept one in sorted order (remove_duplicate_limits),
+# jumping from one cluster to the next by binary search instead.
+def cluster_limits(limits, threshold):
+    values = np.sort(np.asarray(limits, dtype=float))
+    threshold = abs(threshold)
+    starts = []
+    start = 0
+    while start < len(values):
+        starts.append(start)
+        end = int(np.searchsorted(values, values[start] + threshold, side='left'))
+        # Use the same comparison as within_threshold() for limits right at the threshold
+        while end < len(values) and values[end] - values[start] < threshold:
+            end += 1
+        while end > start + 1 and not values[end - 1] - values[start] < threshold:
+            end -= 1
+        start = max(end, start + 1)
+    support = np.diff(np.append(starts, len(values))).astype(int)
+    return values[starts].tolist(), support.tolist()
+
+
+# Add each of new_limits to the sorted limits, in order, unless it is less than threshold from a limit already there
+# Returns the new sorted list of limits
+def merge_limits(limits, new_limits, threshold):
+    merged = sorted(limits)
+    threshold = abs(threshold)
+    for limit in new_limits:
+        position = bisect.bisect_left(merged, limit)
+        # Only the nearest limit on each side can be within the threshold
+        if position > 0 and abs(limit - merged[position - 1]) < threshold:
+            continue
+        if position < len(merged) and abs(merged[position] - limit) < threshold:
+            continue
+        merged.insert(position, limit)
+    return merged
+
+
+# Row and column limits of a table from the boxes (x1, y1, x2, y2) of its structure, for a table image of
+# image_size (width, height) rendered at dpi.
+# Returns (row_limits, column_limits, row_support, column_support). The support of a limit is the number of box
+# edges merged into it, 0 for the image boundaries.
+def calculate_row_column_limits(bbox_list, image_size, dpi = DEFAULT_DPI):
+    row_threshold = points_to_pixels(ROW_THRESHOLD, dpi)
+    column_threshold = points_to_pixels(COLUMN_THRESHOLD, dpi)
+    boxes = np.asarray(bbox_list, dtype=float).reshape(-1, 4)
+    row_limits, row_support = cluster_limits(boxes[:, [1, 3]].ravel(), row_threshold)
+    column_limits, column_support = cluster_limits(boxes[:, [0, 2]].ravel(), column_threshold)
+
+    # Remove left-most and right most column limits to handle clipping issue (temporary fix) and replace them with the image limits
+    column_limits = column_limits[1:-1]
+    column_support = column_support[1:-1]
+
+    # Add image boundaries, unless they are duplicates of the limits already found
+    width, height = image_size
+    row_limits, row_support = _merge_with_support(row_limits, row_support, [0, height], row_threshold)
+    column_limits, column_support = _merge_with_support(column_limits, column_support, [0, width], column_threshold)
+    return row_limits, column_limits, row_support, column_support
+
+
+def _merge_with_support(limits, support, new_limits, threshold):
+    merged = merge_limits(limits, new_limits, threshold)
+    counts = dict(zip(limits, support))
+    return merged, [counts.get(limit, 0) for limit in merged]
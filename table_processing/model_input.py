@@ -0,0 +1,116 @@
+import numpy as np
+import threading
+import warnings
+
+'''
+Fast path for preparing model inputs from rendered pages.
+The rendered pixmap is wrapped as a NumPy array without copying it and a batch is resized and normalized
+straight into a tensor that is reused from one batch to the next. This does the same steps as the
+DetrImageProcessor (resize so the shortest edge is 800 and the longest at most 1333, rescale, normalize)
+without converting the page to a PIL image, back to an array and through several full size float copies.
+The results match the image processor within a small tolerance, not exactly, as the resize is done differently.
+'''
+
+
+# View of the pixmap's samples as a (height, width, channels) uint8 array. No data is copied, so the
+# pixmap must be kept alive (and not changed) for as long as the array is used.
+def pixmap_to_array(pix):
+    return np.ndarray((pix.height, pix.width, pix.n), dtype=np.uint8, buffer=pix.samples_mv, strides=(pix.stride, pix.n, 1))
+
+
+# (height, width) of a PIL image or an array from pixmap_to_array()
+def get_image_size(image):
+    if isinstance(image, np.ndarray):
+        return image.shape[0], image.shape[1]
+    return image.size[1], image.size[0]
+
+
+# Size the image processor resizes an image of the given size to, keeping the aspect ratio so that the
+# shortest edge is shortest_edge unless that makes the longest edge longer than longest_edge
+def get_input_size(height, width, shortest_edge = 800, longest_edge = 1333):
+    size = shortest_edge
+    raw_size = None
+    min_original_size = float(min((height, width)))
+    max_original_size = float(max((height, width)))
+    if max_original_size / min_original_size * size > longest_edge:
+        raw_size = longest_edge * min_original_size / max_original_size
+        size = int(round(raw_size))
+
+    if (height <= width and height == size) or (width <= height and width == size):
+        return height, width
+    if width < height:
+        return (int(raw_size * height / width) if raw_size is not None else int(size * height / width)), size
+    return size, (int(raw_size * width / height) if raw_size is not None else int(size * width / height))
+
+
+class InputEncoder:
+
+    # Reads the resize and normalization settings from image_processor (a DetrImageProcessor) so both paths agree
+    def __init__(self, image_processor):
+        import torch
+        size = image_processor.size
+        get = size.get if isinstance(size, dict) else lambda key: getattr(size, key, None)
+        self.shortest_edge = get('shortest_edge') or 800
+        self.longest_edge = get('longest_edge') or 1333
+        rescale_factor = image_processor.rescale_factor if image_processor.do_rescale else 1.0
+        mean = torch.tensor(image_processor.image_mean, dtype=torch.float32).reshape(1, 3, 1, 1)
+        std = torch.tensor(image_processor.image_std, dtype=torch.float32).reshape(1, 3, 1, 1)
+        # (pixel * rescale_factor - mean) / std, as a single multiply and add on the uint8 values
+        self.scale = rescale_factor / std
+        self.shift = -mean / std
+        self._buffer = torch.empty(0, dtype=torch.float32)
+        self._mask = torch.ones(0, dtype=torch.int64)  # the mask of batches with no padding, all ones
+
+    # input_size is an optional (shortest_edge, longest_edge) used instead of the image processor's
+    def get_input_size(self, image, input_size = None):
+        shortest_edge, longest_edge = input_size if input_size is not None else (self.shortest_edge, self.longest_edge)
+        height, width = get_image_size(image)
+        return get_input_size(height, width, shortest_edge, longest_edge)
+
+    # Encode images into (pixel_values, pixel_mask). images are arrays from pixmap_to_array() or RGB PIL images.
+    # Images of different input sizes are padded to the largest one, like the image processor does: the padding is
+    # 0 in pixel_values and in pixel_mask. pixel_values is a view of a buffer that is overwritten by the next call,
+    # so it has to be used before encoding the next batch. The resize of each image is its only other allocation.
+    def encode(self, images, input_size = None):
+        import torch
+        sizes = [self.get_input_size(image, input_size) for image in images]
+        height = max([size[0] for size in sizes])
+        width = max([size[1] for size in sizes])
+        padded = any([size != (height, width) for size in sizes])
+        count = height * width * 3 * len(images)
+        if self._buffer.numel() < count:
+            self._buffer = torch.empty(count, dtype=torch.float32)
+        pixel_values = self._buffer[:count].view(len(images), 3, height, width)
+        if padded:
+            pixel_values.zero_()
+        for i, (image, (image_height, image_width)) in enumerate(zip(images, sizes)):
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', UserWarning)  # the pixels are only read, so a read-only array is fine
+                pixels = torch.from_numpy(np.asarray(image)[:, :, :3])  # no copy for arrays
+            pixels = pixels.permute(2, 0, 1).unsqueeze(0)  # channels last view of the (1, 3, height, width) image
+            resized = torch.nn.functional.interpolate(pixels, size=(image_height, image_width), mode='bilinear', align_corners=False, antialias=True)
+            values = pixel_values[i, :, :image_height, :image_width]
+            values.copy_(resized[0])
+            if padded:
+                values.mul_(self.scale[0]).add_(self.shift[0])  # the padding stays 0
+        if not padded:
+            pixel_values.mul_(self.scale).add_(self.shift)
+            if self._mask.numel() < count // 3:
+                self._mask = torch.ones(count // 3, dtype=torch.int64)
+            return pixel_values, self._mask[:count // 3].view(len(images), height, width)
+        pixel_mask = torch.zeros((len(images), height, width), dtype=torch.int64)
+        for i, (image_height, image_width) in enumerate(sizes):
+            pixel_mask[i, :image_height, :image_width] = 1
+        return pixel_values, pixel_mask
+
+
+_local = threading.local()
+
+
+# One encoder (and buffer) per thread, so that threads running detection at the same time don't share a buffer
+def get_input_encoder(image_processor):
+    encoder = getattr(_local, 'encoder', None)
+    if encoder is None:
+        encoder = InputEncoder(image_processor)
+        _local.encoder = encoder
+    return encoder
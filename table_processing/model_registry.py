@@ -0,0 +1,81 @@
+import threading
+import logging
+
+'''
+Process-wide registry for the TableTransformer models and their image processor.
+Loading the checkpoints is by far the most expensive part of setting up a run, so
+each one is loaded once on first use and then shared by every Table_Detector and Table.
+transformers (and torch) are only imported then too, so importing this module is fast.
+'''
+
+DETECTION_MODEL_ID = "microsoft/table-transformer-detection"
+STRUCTURE_MODEL_ID = "microsoft/table-transformer-structure-recognition"
+
+_models = {}
+_lock = threading.RLock()
+
+
+def _load_model(model_id):
+    from transformers import TableTransformerForObjectDetection
+    logging.info("Loading model: " + model_id)
+    model = TableTransformerForObjectDetection.from_pretrained(model_id)
+    model.eval()
+    return model
+
+
+def _load_image_processor():
+    from transformers import DetrImageProcessor
+    return DetrImageProcessor()
+
+
+# Return the shared object stored under key, creating it with loader() on first use
+def _get(key, loader):
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            # Check again now that the lock is held, another thread may have loaded it
+            model = _models.get(key)
+            if model is None:
+                model = loader()
+                _models[key] = model
+    return model
+
+
+# Load model_id as an inference engine (see inference_engines.py). The torch engine is the model itself.
+def _load_engine(model_id, engine):
+    from inference_engines import load_engine
+    return load_engine(model_id, engine, lambda model_id: _load_model(model_id))
+
+
+def _get_engine(model_id, engine):
+    key = model_id if engine == 'torch' else model_id + ':' + engine
+    return _get(key, lambda: _load_engine(model_id, engine))
+
+
+def get_detection_model(engine = 'torch'):
+    return _get_engine(DETECTION_MODEL_ID, engine)
+
+
+def get_structure_model(engine = 'torch'):
+    return _get_engine(STRUCTURE_MODEL_ID, engine)
+
+
+def get_image_processor():
+    return _get("image_processor", _load_image_processor)
+
+
+# Load everything up front (e.g. before serving requests) so the first document doesn't pay for it
+def warm_up(engine = 'torch'):
+    get_image_processor()
+    get_detection_model(engine)
+    get_structure_model(engine)
+
+
+# Drop the shared models so their memory can be reclaimed. They are reloaded on next use.
+def unload():
+    with _lock:
+        _models.clear()
+
+
+def is_loaded(key):
+    return key in _models
@@ -0,0 +1,187 @@
+import threading
+import getpass
+import os
+from contextlib import contextmanager
+
+'''
+OCR backends used by Table. Every backend offers the same two calls:
+- image_to_string(image): the text in the image
+- image_to_data(image): the words in the image with their boxes, as a dict of lists in the format of
+  pytesseract.image_to_data(output_type=Output.DICT) (text, left, top, width, height, block_num, par_num, line_num)
+- close(): free what the backend holds between calls. It can still be used afterwards.
+'''
+
+# Default install location of tesseract on Windows, for the current user
+def default_windows_tesseract_cmd():
+    return os.path.join('C:/Users', getpass.getuser(), 'AppData/Local/Programs/Tesseract-OCR/tesseract.exe')
+
+
+# Path of the tesseract executable: the TESSERACT_CMD environment variable if set, then the default
+# Windows install location if it exists, otherwise 'tesseract' from the PATH
+# Only resolved when a backend is created, not when this module is imported.
+def default_tesseract_cmd():
+    if os.environ.get('TESSERACT_CMD'):
+        return os.environ['TESSERACT_CMD']
+    if os.path.exists(default_windows_tesseract_cmd()):
+        return default_windows_tesseract_cmd()
+    return 'tesseract'
+
+
+# pytesseract reads the path of the executable from a module variable when it runs tesseract. Calls with the same
+# path run concurrently, a call with another path waits until they are done so it can't change it under them.
+_tesseract_cmd_condition = threading.Condition()
+_tesseract_cmd_calls = [None, 0]  # path in use and number of calls using it
+
+
+@contextmanager
+def _use_tesseract_cmd(tesseract_cmd):
+    import pytesseract
+    with _tesseract_cmd_condition:
+        while _tesseract_cmd_calls[1] > 0 and _tesseract_cmd_calls[0] != tesseract_cmd:
+            _tesseract_cmd_condition.wait()
+        _tesseract_cmd_calls[0] = tesseract_cmd
+        _tesseract_cmd_calls[1] += 1
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    try:
+        yield pytesseract
+    finally:
+        with _tesseract_cmd_condition:
+            _tesseract_cmd_calls[1] -= 1
+            _tesseract_cmd_condition.notify_all()
+
+
+# Runs the tesseract executable through pytesseract. Every call starts a new tesseract process.
+# pytesseract is imported on first use.
+class PytesseractBackend:
+
+    name = 'pytesseract'
+
+    def __init__(self, tesseract_cmd = None, config = ''):
+        self.tesseract_cmd = tesseract_cmd if tesseract_cmd != None else default_tesseract_cmd()
+        self.config = config
+
+    def image_to_string(self, image):
+        with _use_tesseract_cmd(self.tesseract_cmd) as pytesseract:
+            return pytesseract.image_to_string(image, config=self.config)
+
+    def image_to_data(self, image):
+        with _use_tesseract_cmd(self.tesseract_cmd) as pytesseract:
+            return pytesseract.image_to_data(image, config=self.config, output_type=pytesseract.Output.DICT)
+
+    def close(self):
+        pass
+
+
+# Runs tesseract in-process through tesserocr. The engines are kept in a pool: each call takes an idle engine
+# (or starts one if there is none) and gives it back when done, so there are only as many engines as calls
+# that ran at the same time, and they are reused by every following call whatever thread or worker pool makes it.
+# close() ends the idle engines.
+class TesserocrBackend:
+
+    name = 'tesserocr'
+
+    def __init__(self, path = None, lang = 'eng'):
+        try:
+            import tesserocr
+        except ImportError:
+            raise Exception("The tesserocr OCR backend requires the tesserocr package to be installed.")
+        self.path = path
+        self.lang = lang
+        self._lock = threading.Lock()
+        self._idle = []
+
+    # The engines can't be sent to another process, each process starts its own
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        del state['_idle']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def _take_api(self):
+        with self._lock:
+            if len(self._idle) > 0:
+                return self._idle.pop()
+        import tesserocr
+        if self.path != None:
+            return tesserocr.PyTessBaseAPI(path = self.path, lang = self.lang)
+        return tesserocr.PyTessBaseAPI(lang = self.lang)
+
+    def _give_back(self, api):
+        with self._lock:
+            self._idle.append(api)
+
+    def close(self):
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for api in idle:
+            api.End()
+
+    def image_to_string(self, image):
+        api = self._take_api()
+        try:
+            api.SetImage(image)
+            return api.GetUTF8Text()
+        finally:
+            self._give_back(api)
+
+    def image_to_data(self, image):
+        api = self._take_api()
+        try:
+            return self._read_words(api, image)
+        finally:
+            self._give_back(api)
+
+    def _read_words(self, api, image):
+        import tesserocr
+        api.SetImage(image)
+        api.Recognize()
+        data = {'text': [], 'left': [], 'top': [], 'width': [], 'height': [], 'block_num': [], 'par_num': [], 'line_num': []}
+        iterator = api.GetIterator()
+        if iterator is None:
+            return data
+        level = tesserocr.RIL.WORD
+        block_num, par_num, line_num = 0, 0, 0
+        for word in tesserocr.iterate_level(iterator, level):
+            # Number blocks, paragraphs and lines the same way tesseract's own TSV output does
+            if word.IsAtBeginningOf(tesserocr.RIL.BLOCK):
+                block_num, par_num, line_num = block_num + 1, 0, 0
+            if word.IsAtBeginningOf(tesserocr.RIL.PARA):
+                par_num, line_num = par_num + 1, 0
+            if word.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                line_num += 1
+            box = word.BoundingBox(level)
+            if box is None:
+                continue
+            x1, y1, x2, y2 = box
+            data['text'].append(word.GetUTF8Text(level))
+            data['left'].append(x1)
+            data['top'].append(y1)
+            data['width'].append(x2 - x1)
+            data['height'].append(y2 - y1)
+            data['block_num'].append(block_num)
+            data['par_num'].append(par_num)
+            data['line_num'].append(line_num)
+        return data
+
+
+OCR_BACKENDS = {PytesseractBackend.name: PytesseractBackend, TesserocrBackend.name: TesserocrBackend}
+
+
+# Accepts a backend name (see OCR_BACKENDS) or an already configured backend object
+def get_ocr_backend(backend = 'pytesseract'):
+    if isinstance(backend, str):
+        if backend not in OCR_BACKENDS:
+            raise Exception("Invalid OCR backend: " + backend + ". Must be one of " + str(list(OCR_BACKENDS)))
+        return OCR_BACKENDS[backend]()
+    return backend
+
+
+# The settings of a backend that change its output, e.g. to tell cached results apart
+def get_backend_settings(backend):
+    return {key: value for key, value in vars(backend).items() if not key.startswith('_')}
@@ -0,0 +1,158 @@
+from collections import OrderedDict
+import numpy as np
+import hashlib
+import json
+import threading
+from ocr_pool import map_ordered
+from ocr_backends import get_backend_settings
+
+'''
+Memo of OCR results for cell images. Tables repeat the same values ("Yes", "N/A", "0", dates, units...),
+so each distinct cell bitmap is read once and the text is reused for every other cell that looks the same.
+Cells are identified by a hash of the cell binarized and trimmed to its ink, so the same text at a different
+position in its cell or on a slightly different background is still a match. The cells are not resized,
+so text of a different size is read again.
+'''
+
+# Hash of the cell (a grayscale or RGB array) after binarizing it and trimming it to the box around its ink.
+# The threshold comes from the cell itself: pixels are ink when they are further from the background (the median
+# pixel) than half the distance of the furthest pixel. So light text (gray, yellow...) and light text on a dark
+# background are binarized like black text, and only a cell whose pixels are all the same has no ink.
+def hash_cell(cell):
+    pixels = np.asarray(cell)
+    if pixels.ndim == 3:
+        pixels = pixels[:, :, :3].mean(axis=2)
+    if pixels.size == 0:
+        ink = np.zeros((0, 0), dtype=bool)
+    else:
+        distance = np.abs(pixels.astype(np.float32) - np.median(pixels))
+        ink = distance > distance.max() / 2
+    rows = np.flatnonzero(ink.any(axis=1))
+    columns = np.flatnonzero(ink.any(axis=0))
+    if len(rows) == 0:
+        ink = ink[0:0, 0:0]
+    else:
+        ink = ink[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1]
+    digest = hashlib.sha256(np.array(ink.shape, dtype=np.int64).tobytes())
+    digest.update(np.packbits(ink, axis=-1).tobytes())
+    return digest.hexdigest()
+
+
+class OcrMemo:
+
+    # max_entries is the number of results kept in memory, the least recently used are dropped first.
+    # persistent is an optional ResultCache (see result_cache.py) to also keep the results on disk between runs.
+    def __init__(self, max_entries = 10000, persistent = None):
+        self.max_entries = max_entries
+        self.persistent = persistent
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    # Key of the result of function(image, backend, *arguments), e.g. Table.ocr_cell. The backend settings and the
+    # other arguments are part of it.
+    def make_key(self, function, image, backend, *arguments):
+        settings = json.dumps([function.__name__, getattr(backend, 'name', type(backend).__name__), get_backend_settings(backend), arguments],
+                              sort_keys = True, default = str)
+        return 'ocr-' + hash_cell(image) + '-' + hashlib.sha256(settings.encode('utf8')).hexdigest()
+
+    # Returns the memoized text or None, and counts the hit or miss
+    def get(self, key):
+        with self._lock:
+            value = self.entries.get(key)
+            if value != None:
+                self.entries.move_to_end(key)
+        if value == None and self.persistent != None:
+            value = self.persistent.get(key)
+            if value != None:
+                self._remember(key, value)
+        with self._lock:
+            if value == None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    # Count a hit for a result reused without calling get(), e.g. a cell repeated within the same batch of jobs
+    def count_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def set(self, key, value):
+        self._remember(key, value)
+        if self.persistent != None:
+            self.persistent.set(key, value)
+
+    def _remember(self, key, value):
+        with self._lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)
+
+    def get_hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+
+# Run OCR jobs (see Table.run_ocr_job). Returns their results in order and the number of jobs that were run.
+# With a memo, jobs are only run for images not already in the memo, and only once for images that look the same.
+def run_ocr_jobs(jobs, memo = None, max_workers = 1, executor_type = 'thread'):
+    results = []
+    calls = 0
+    for result, ran in iter_ocr_results(jobs, memo, max_workers = max_workers, executor_type = executor_type):
+        results.append(result)
+        calls += ran
+    return results, calls
+
+
+# Same as run_ocr_jobs(), but yields (result, whether the job was run) for each job in order. jobs can be any
+# iterable: they are only read as the pool has room for them, so a generator of jobs is never held in memory at once.
+def iter_ocr_results(jobs, memo = None, max_workers = 1, executor_type = 'thread'):
+    from Table import run_ocr_job  # Table uses this module
+    if memo == None:
+        for result in map_ordered(run_ocr_job, jobs, max_workers = max_workers, executor_type = executor_type):
+            yield result, True
+        return
+
+    # The memo is only used from this thread: jobs are looked up as they are read and results stored as they come back
+    waiting = {}  # key of a job being run -> number of later jobs for the same image waiting for its result
+    shared = {}  # key -> [result, number of waiting jobs not yet answered]
+    def look_up(jobs):
+        for job in jobs:
+            key = memo.make_key(*job)
+            if key in waiting:
+                waiting[key] += 1
+                memo.count_hit()  # filled in from the job already run for the same cell
+                yield key, None, None
+                continue
+            value = memo.get(key)
+            if value == None:
+                waiting[key] = 0
+                yield key, job, None
+            else:
+                yield key, None, value
+
+    for key, value, ran in map_ordered(_run_memo_item, look_up(jobs), max_workers = max_workers, executor_type = executor_type):
+        if ran:
+            memo.set(key, value)
+            count = waiting.pop(key)
+            if count > 0:
+                shared[key] = [value, count]
+        elif value == None:
+            entry = shared[key]
+            value = entry[0]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del shared[key]
+        yield value, ran
+
+
+# item is (key, job, value) from iter_ocr_results(). The job is run unless it is None (its value is already known).
+def _run_memo_item(item):
+    from Table import run_ocr_job
+    key, job, value = item
+    if job == None:
+        return key, value, False
+    return key, run_ocr_job(job), True
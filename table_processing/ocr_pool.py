@@ -0,0 +1,60 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+
+'''
+Worker pool used to run OCR concurrently.
+Tesseract runs in its own process for every call, so a thread pool is usually enough to keep
+all cores busy. A process pool can be used instead for OCR backends that hold the GIL.
+'''
+
+EXECUTOR_TYPES = ['thread', 'process']
+
+
+# Apply func to every item and yield the results in the same order as the items.
+# At most max_pending items are submitted to the pool and not yet yielded at any time, so items can be
+# produced lazily and memory use stays flat no matter how many items there are.
+# initializer(*initargs) is called once in each worker before it runs any item (once in this thread without a pool).
+def map_ordered(func, items, max_workers = 1, max_pending = None, executor_type = 'thread', initializer = None, initargs = ()):
+    return _map(func, items, max_workers, max_pending, executor_type, initializer, initargs, ordered = True)
+
+
+# Same as map_ordered(), but the results are yielded as soon as each one is ready, in no particular order
+def map_unordered(func, items, max_workers = 1, max_pending = None, executor_type = 'thread', initializer = None, initargs = ()):
+    return _map(func, items, max_workers, max_pending, executor_type, initializer, initargs, ordered = False)
+
+
+def _map(func, items, max_workers, max_pending, executor_type, initializer, initargs, ordered):
+    if executor_type not in EXECUTOR_TYPES:
+        raise Exception("Invalid executor type: " + str(executor_type) + ". Must be one of " + str(EXECUTOR_TYPES))
+    if max_workers is None or max_workers <= 1:
+        if initializer != None:
+            initializer(*initargs)
+        for item in items:
+            yield func(item)
+        return
+    if max_pending is None:
+        max_pending = max_workers * 2
+    max_pending = max(max_pending, max_workers)
+
+    executor_class = ThreadPoolExecutor if executor_type == 'thread' else ProcessPoolExecutor
+    with executor_class(max_workers = max_workers, initializer = initializer, initargs = initargs) as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) >= max_pending:
+                for result in _take_results(pending, ordered):
+                    yield result
+            pending.append(executor.submit(func, item))
+        while len(pending) > 0:
+            for result in _take_results(pending, ordered):
+                yield result
+
+
+# Take the next results out of pending (a deque of futures): the first one when ordered, otherwise every one
+# already done, waiting for at least one
+def _take_results(pending, ordered):
+    if ordered:
+        return [pending.popleft().result()]
+    done = wait(pending, return_when = FIRST_COMPLETED).done
+    for future in done:
+        pending.remove(future)
+    return [future.result() for future in done]
@@ -0,0 +1,131 @@
+import threading
+import queue
+
+'''
+Staged pipeline engine. Each stage runs on its own pool of worker threads and the stages are
+connected by bounded queues, so a slow stage holds back the ones before it (backpressure) instead
+of letting work pile up in memory. Results come out in the same order as the inputs.
+'''
+
+_DONE = object()  # put on a queue when a stage has no more items to pass on
+
+
+class _Failure:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+class Pipeline:
+
+    # stages is a list of (name, function, workers). Each function takes the output of the previous stage.
+    # queue_size is the capacity of the queue in front of each stage.
+    # max_in_flight is the maximum number of items inside the pipeline at once, counting results waiting to be
+    # put back in order. It defaults to enough items to keep every worker busy.
+    def __init__(self, stages, queue_size = 2, max_in_flight = None):
+        if len(stages) == 0:
+            raise Exception("A pipeline needs at least one stage.")
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        if max_in_flight == None:
+            max_in_flight = sum([max(1, workers) for name, function, workers in stages]) + self.queue_size * len(stages)
+        self.max_in_flight = max(1, max_in_flight)
+
+
+    # Run every item through all the stages and yield the final results in input order
+    # An exception raised by any stage stops the pipeline and is raised here.
+    def run(self, items):
+        queues = [queue.Queue(maxsize = self.queue_size) for stage in self.stages]
+        queues.append(queue.Queue())  # results, bounded by max_in_flight
+        in_flight = threading.Semaphore(self.max_in_flight)
+        stop = threading.Event()
+        threads = [threading.Thread(target = self._feed, args = (items, queues[0], in_flight, stop), daemon = True)]
+        for index, (name, function, workers) in enumerate(self.stages):
+            workers = max(1, workers)
+            remaining = [workers]
+            lock = threading.Lock()
+            for worker in range(0, workers):
+                threads.append(threading.Thread(target = self._work, name = name + '_' + str(worker), daemon = True,
+                                                args = (function, queues[index], queues[index + 1], remaining, lock, stop)))
+        for thread in threads:
+            thread.start()
+
+        try:
+            pending = {}
+            next_index = 0
+            while True:
+                item = queues[-1].get()
+                if item is _DONE:
+                    break
+                index, result = item
+                if isinstance(result, _Failure):
+                    raise result.exception
+                pending[index] = result
+                while next_index in pending:
+                    result = pending.pop(next_index)
+                    next_index += 1
+                    in_flight.release()
+                    yield result
+        finally:
+            # Normally every thread has already finished here. If the caller stopped reading early,
+            # wake up any thread waiting on the semaphore or a queue so that it can see the stop.
+            stop.set()
+            for i in range(0, len(threads)):
+                in_flight.release()
+            for q in queues:
+                _drain(q)
+                try:
+                    q.put_nowait(_DONE)
+                except queue.Full:
+                    pass
+            for thread in threads:
+                thread.join(timeout = 0.1)
+
+
+    def _feed(self, items, output, in_flight, stop):
+        try:
+            for index, item in enumerate(items):
+                in_flight.acquire()
+                if stop.is_set():
+                    break
+                _put(output, (index, item), stop)
+        except Exception as e:
+            _put(output, (-1, _Failure(e)), stop)
+        _put(output, _DONE, stop)
+
+
+    def _work(self, function, input, output, remaining, lock, stop):
+        while not stop.is_set():
+            item = input.get()
+            if item is _DONE:
+                _put(input, _DONE, stop)  # let the other workers of this stage see it too
+                break
+            index, value = item
+            if not isinstance(value, _Failure):
+                try:
+                    value = function(value)
+                except Exception as e:
+                    value = _Failure(e)
+            _put(output, (index, value), stop)
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            _put(output, _DONE, stop)
+
+
+# Put an item on a bounded queue, giving up if the pipeline is stopped while waiting for space
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout = 0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def _drain(q):
+    try:
+        while True:
+            q.get_nowait()
+    except queue.Empty:
+        pass
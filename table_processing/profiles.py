@@ -0,0 +1,70 @@
+import copy
+from table_tools import DETECTION_THRESHOLD
+
+'''
+Speed/accuracy profiles. The settings that trade speed for accuracy are set together by a profile so they stay consistent:
+- detection_zoom: zoom the pages are rendered at for table detection
+- ocr_zoom: zoom the tables are rendered at for structure recognition and OCR
+- padding: pixels at RENDER_ZOOM added to each side (x1, y1, x2, y2) of the detected table boxes
+- threshold: minimum score of the boxes kept from the models
+- shortest_edge, longest_edge: size the model inputs are resized to (see model_input.get_input_size)
+- ocr_upscale: factor the cell (or table) images are enlarged by before OCR
+Profiles are given by name ('fast', 'balanced', 'accurate' or one added with register_profile()) or as a dict of
+settings. Settings missing from a dict are taken from the profile named by its 'base' key, 'balanced' by default.
+'''
+
+RENDER_ZOOM = 2.0  # pages are rendered at this zoom factor by default
+TABLE_PADDING = [-10, -8, 12, 10]  # pixels at RENDER_ZOOM added to each side (x1, y1, x2, y2) of the detected table boxes
+OCR_UPSCALE = 2.5  # cell images are enlarged by this factor before OCR by default
+DEFAULT_PROFILE = 'balanced'
+
+PROFILES = {
+    # Lower resolution everywhere: detection on pages at zoom 1, smaller model inputs and OCR on smaller images
+    'fast': {'detection_zoom': 1.0, 'ocr_zoom': 1.5, 'padding': TABLE_PADDING, 'threshold': DETECTION_THRESHOLD,
+             'shortest_edge': 600, 'longest_edge': 1000, 'ocr_upscale': 2.0},
+    # The defaults
+    'balanced': {'detection_zoom': RENDER_ZOOM, 'ocr_zoom': RENDER_ZOOM, 'padding': TABLE_PADDING, 'threshold': DETECTION_THRESHOLD,
+                 'shortest_edge': 800, 'longest_edge': 1333, 'ocr_upscale': OCR_UPSCALE},
+    # Tables rendered at a higher zoom for OCR, with more padding and the boxes the models are less sure of
+    'accurate': {'detection_zoom': RENDER_ZOOM, 'ocr_zoom': 3.0, 'padding': [-14, -12, 16, 14], 'threshold': 0.6,
+                 'shortest_edge': 800, 'longest_edge': 1333, 'ocr_upscale': 2.0},
+}
+PROFILE_SETTINGS = list(PROFILES[DEFAULT_PROFILE].keys())
+
+
+def get_profile_names():
+    return list(PROFILES.keys())
+
+
+# Returns the settings of a profile name or dict (see above) as a new dict, with its name under 'name'
+# A profile of None is the default profile.
+def get_profile(profile = None):
+    if profile == None:
+        profile = DEFAULT_PROFILE
+    if isinstance(profile, str):
+        if profile not in PROFILES:
+            raise Exception("Invalid profile: " + profile + ". Must be one of " + str(get_profile_names()))
+        settings = copy.deepcopy(PROFILES[profile])
+        settings['name'] = profile
+        return settings
+
+    profile = dict(profile)
+    settings = get_profile(profile.pop('base', DEFAULT_PROFILE))
+    settings['name'] = profile.pop('name', 'custom')
+    unknown = [key for key in profile if key not in PROFILE_SETTINGS]
+    if len(unknown) > 0:
+        raise Exception("Invalid profile settings: " + str(unknown) + ". Must be among " + str(PROFILE_SETTINGS))
+    settings.update(copy.deepcopy(profile))
+    return settings
+
+
+# Add a named custom profile, e.g. register_profile('scans', {'base': 'accurate', 'ocr_upscale': 3.0})
+def register_profile(name, settings):
+    settings = get_profile(settings)
+    del settings['name']
+    PROFILES[name] = settings
+
+
+# (shortest_edge, longest_edge) of the model inputs of a profile
+def get_model_input_size(profile):
+    return profile['shortest_edge'], profile['longest_edge']
@@ -0,0 +1,62 @@
+import hashlib
+import json
+import logging
+
+'''
+Persistent cache of extracted tables, stored on disk with diskcache.
+Entries are keyed by a hash of the PDF content and of the configuration used to process it,
+so the same file processed the same way is only processed once.
+When the cache is full, the least recently used entries are evicted.
+'''
+
+CACHE_VERSION = 1  # increase when the format of the cached results changes
+DEFAULT_CACHE_DIRECTORY = './result_cache'
+
+
+def hash_content(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class ResultCache:
+
+    def __init__(self, directory = DEFAULT_CACHE_DIRECTORY, size_limit_mb = 1024):
+        try:
+            import diskcache
+        except ImportError:
+            raise Exception("The result cache requires the diskcache package to be installed.")
+        self.cache = diskcache.Cache(str(directory), size_limit = int(size_limit_mb * 1024 * 1024),
+                                     eviction_policy = 'least-recently-used')
+        self.hits = 0
+        self.misses = 0
+
+
+    # Key for the results of processing content with the given configuration (any JSON serializable dict)
+    def make_key(self, content, config):
+        config_text = json.dumps(config, sort_keys = True, default = str)
+        return 'v' + str(CACHE_VERSION) + '-' + hash_content(content) + '-' + hashlib.sha256(config_text.encode('utf8')).hexdigest()
+
+
+    # Returns the cached value or None if there is none
+    def get(self, key):
+        value = self.cache.get(key)
+        if value == None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+
+    def set(self, key, value):
+        try:
+            self.cache.set(key, value)
+        except Exception as e:
+            # A result that can't be cached is only a missed optimization
+            logging.warning("Could not store results in cache: " + str(e))
+
+
+    def clear(self):
+        self.cache.clear()
+
+
+    def close(self):
+        self.cache.close()
@@ -1,22 +1,78 @@
 
 
-from transformers import DetrImageProcessor
-import torch
+import bisect
 import os
-import pandas as pd
-
-def get_bounding_boxes(image, model):
-#    width, height = image.size
-#    image.resize((int(width*0.5), int(height*0.5)))
-    feature_extractor = DetrImageProcessor()
-    encoding = feature_extractor(image, return_tensors="pt")
-#    encoding.keys()
-    with torch.no_grad():
-        outputs = model(**encoding)
-    width, height = image.size
-    bounding_boxes = feature_extractor.post_process_object_detection(outputs, threshold=0.7, target_sizes=[(height, width)])
+import numpy as np
+from PIL import Image
+from model_registry import get_image_processor
+from model_input import get_input_encoder, get_image_size
+from limit_clustering import calculate_row_column_limits, merge_limits, DEFAULT_DPI
+
+DETECTION_THRESHOLD = 0.7  # minimum score of the boxes kept from the models
+
+# Accepts a single image or a list of images. Returns one result (boxes, labels, scores) per image.
+# Images are run through the model batch_size at a time. Only images whose model inputs have the same size are
+# batched together, so no padding is added and each result is the same as running that image on its own.
+# With pad_batches, images of any size are batched: they are sorted by input size, each batch is padded to its
+# largest image and the pixel mask tells the model which pixels are padding. The results then depend a little on
+# the other images of the batch, they match running each image on its own within a small tolerance.
+# With fast_inputs the images are encoded by model_input.InputEncoder instead of the image processor. They can then
+# also be arrays from model_input.pixmap_to_array().
+# Boxes scoring less than threshold are dropped. input_size is the (shortest_edge, longest_edge) the images are resized
+# to for the model, None for the image processor's default.
+def get_bounding_boxes(image, model, batch_size=1, fast_inputs=False, threshold=DETECTION_THRESHOLD, input_size=None, pad_batches=False):
+    import torch
+    images = image if isinstance(image, list) else [image]
+    feature_extractor = get_image_processor()
+    encoder = get_input_encoder(feature_extractor)
+    if fast_inputs:
+        encode = lambda batch_images: encoder.encode(batch_images, input_size)
+    else:
+        encode = lambda batch_images: _encode_with_processor(batch_images, feature_extractor, input_size)
+    bounding_boxes = [None] * len(images)
+    input_sizes = [encoder.get_input_size(image, input_size) for image in images]
+    batches = _group_by_input_size(input_sizes, batch_size) if pad_batches else _group_by_equal_size(input_sizes, batch_size)
+    for indices in batches:
+        pixel_values, pixel_mask = encode([images[i] for i in indices])
+        with torch.no_grad():
+            outputs = model(pixel_values=pixel_values, pixel_mask=pixel_mask)
+        target_sizes = [get_image_size(images[i]) for i in indices]
+        results = feature_extractor.post_process_object_detection(outputs, threshold=threshold, target_sizes=target_sizes)
+        for i, result in zip(indices, results):
+            bounding_boxes[i] = result
     return bounding_boxes, model
 
+
+# Encode a batch of images with the image processor, which pads them to the largest one and masks the padding
+def _encode_with_processor(images, feature_extractor, input_size=None):
+    size = {} if input_size is None else {'size': {'shortest_edge': input_size[0], 'longest_edge': input_size[1]}}
+    encoding = feature_extractor(images, return_tensors="pt", **size)
+    return encoding['pixel_values'], encoding['pixel_mask']
+
+
+# Split the images into batches of at most batch_size, given the (height, width) each is resized to for the model
+# The images are sorted by size so each batch needs as little padding as possible. Returns lists of image indices.
+def _group_by_input_size(input_sizes, batch_size):
+    order = sorted(range(0, len(input_sizes)), key=lambda index: (input_sizes[index], index))
+    return _split_batches(order, batch_size)
+
+
+# Split the images into batches of at most batch_size images whose input size is exactly the same
+def _group_by_equal_size(input_sizes, batch_size):
+    groups = {}
+    for index, size in enumerate(input_sizes):
+        groups.setdefault(size, []).append(index)
+    batches = []
+    for group in groups.values():
+        batches.extend(_split_batches(group, batch_size))
+    return batches
+
+
+def _split_batches(group, batch_size):
+    batch_size = max(1, int(batch_size))
+    return [group[start:start + batch_size] for start in range(0, len(group), batch_size)]
+
+
 def calculate_intersection(box1, box2):
     x1 = max(box1[0], box2[0])
     y1 = max(box1[1], box2[1])
@@ -29,58 +85,19 @@ def calculate_intersection(box1, box2):
         return [x1, y1, x2, y2]
     
 
+# Keep the limits that are at least threshold away from every limit kept before them, in the order given
 def remove_duplicate_limits(limit_list, threshold):
-    unique = []
-    for limit in limit_list:
-        if not True in [within_threshold(limit, x, threshold) for x in unique]:
-            unique.append(limit)
-    unique.sort()
-    return unique
+    return merge_limits([], limit_list, threshold)
 
 
 def within_threshold(a, b, threshold):
     return abs(b - a) < abs(threshold)
 
 
-def _calculate_raw_row_column_limits(bbox_list):
-    # Use boundaries of bounding boxes to set row and column limits
-    row_limits = []
-    column_limits = []
-    for box in bbox_list:
-        x1,y1,x2,y2 = box
-        row_limits.append(y1)
-        row_limits.append(y2)
-        column_limits.append(x1)
-        column_limits.append(x2)
-    row_limits.sort()
-    column_limits.sort()
-
-    return(column_limits,row_limits)
-    
-
-def _calculate_row_column_limits(image_dim, bbox_list):
-    column_limits, row_limits =_calculate_raw_row_column_limits(bbox_list)
-    row_thresh, col_thresh = 8, 16
-    row_limits = remove_duplicate_limits(row_limits, row_thresh)
-    column_limits = remove_duplicate_limits(column_limits, col_thresh)
-
-    # Remove left-most and right most column limits to handle clipping issue (temporary fix) and replace them with the image limits
-    column_limits.sort()
-    column_limits.pop(0)
-    column_limits.pop()
-
-    # Add image boundaries to the row and column limits
-    width, height = image_dim
-    row_limits.append(0)
-    row_limits.append(height)
-    column_limits.append(0)
-    column_limits.append(width)      
-    
-    # Make sure that adding the new limits didn't add dubplicates
-    row_limits = remove_duplicate_limits(row_limits, row_thresh)
-    column_limits = remove_duplicate_limits(column_limits, col_thresh)
-
-    return(column_limits, row_limits)  
+# Returns (column_limits, row_limits) for a table image of image_dim (width, height), see limit_clustering
+def _calculate_row_column_limits(image_dim, bbox_list, dpi=DEFAULT_DPI):
+    row_limits, column_limits, row_support, column_support = calculate_row_column_limits(bbox_list, image_dim, dpi)
+    return(column_limits, row_limits)
 
 
 # Map function for cleaning the text in a dataframe
@@ -99,3 +116,123 @@ def clean_cell_text(raw_text):
     # remove all leading and trailing whitespaces
     processed_text = processed_text.strip()
     return processed_text
+
+
+# Split the span from 0 to the last limit into the intervals between consecutive limits,
+# using the same rounding as PIL's crop. Empty intervals are left out.
+def get_grid_intervals(limits):
+    intervals = []
+    start = 0
+    for limit in sorted(limits):
+        if round(limit) > round(start):
+            intervals.append((round(start), round(limit)))
+        start = limit
+    return intervals
+
+
+# Assign OCR words to the cells of the grid given by the row and column limits
+# words is a list of (x1, y1, x2, y2, text, line_id) in table image coordinates, in reading order.
+# A word goes to the cell containing its centre, found by binary search on the interval ends.
+# Returns a list of rows, each a list of cell strings. Words on different lines of a cell are separated by '\n'.
+def assign_words_to_cells(words, row_limits, column_limits):
+    row_intervals = get_grid_intervals(row_limits)
+    column_intervals = get_grid_intervals(column_limits)
+    row_ends = [end for start, end in row_intervals]
+    column_ends = [end for start, end in column_intervals]
+    if len(column_intervals) == 0:
+        return []
+    cells = [[[] for column in column_intervals] for row in row_intervals]
+
+    last_line = {}
+    for x1, y1, x2, y2, text, line_id in words:
+        row = min(bisect.bisect_right(row_ends, (y1 + y2) / 2), len(row_ends) - 1)
+        column = min(bisect.bisect_right(column_ends, (x1 + x2) / 2), len(column_ends) - 1)
+        cell = cells[row][column]
+        if len(cell) > 0:
+            cell.append('\n' if last_line[(row, column)] != line_id else ' ')
+        cell.append(text)
+        last_line[(row, column)] = line_id
+    return [[''.join(cell) for cell in row] for row in cells]
+
+
+# Select the words whose centre is inside the box and move them to the coordinates of the box
+# words are (x1, y1, x2, y2, text, line_id). Returns None if no word is in the box.
+def get_words_in_box(words, box):
+    bx1, by1, bx2, by2 = box
+    words_in_box = []
+    for x1, y1, x2, y2, text, line_id in words:
+        if bx1 <= (x1 + x2) / 2 < bx2 and by1 <= (y1 + y2) / 2 < by2:
+            words_in_box.append((x1 - bx1, y1 - by1, x2 - bx1, y2 - by1, text, line_id))
+    if len(words_in_box) == 0:
+        return None
+    return words_in_box
+
+
+# Convert an image to the colorspace it is read in by OCR, see COLORSPACES
+# 'rgb' leaves the image as it is, 'gray' keeps one channel and 'binary' also applies adaptive_binarize()
+COLORSPACES = ['rgb', 'gray', 'binary']
+
+def convert_colorspace(image, colorspace):
+    if colorspace not in COLORSPACES:
+        raise Exception("Invalid colorspace: " + str(colorspace) + ". Must be one of " + str(COLORSPACES))
+    if colorspace == 'rgb':
+        return image
+    image = image.convert('L')
+    if colorspace == 'binary':
+        image = adaptive_binarize(image)
+    return image
+
+
+# Local mean thresholding of a grayscale image (Bradley-Roth). A pixel becomes black (0) when it is more than
+# offset gray levels darker than the mean of the window_size x window_size pixels around it, otherwise white (255).
+# The window sums come from an integral image, so the cost doesn't depend on the window size.
+def adaptive_binarize(image, window_size = 31, offset = 10):
+    pixels = np.asarray(image, dtype=np.int64)
+    height, width = pixels.shape
+    integral = np.zeros((height + 1, width + 1), dtype=np.int64)
+    integral[1:, 1:] = pixels.cumsum(axis=0).cumsum(axis=1)
+
+    # Window bounds around every pixel, cut off at the image borders
+    half = window_size // 2
+    rows = np.arange(height)
+    columns = np.arange(width)
+    y1 = np.clip(rows - half, 0, height)[:, None]
+    y2 = np.clip(rows + half + 1, 0, height)[:, None]
+    x1 = np.clip(columns - half, 0, width)[None, :]
+    x2 = np.clip(columns + half + 1, 0, width)[None, :]
+    sums = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+    counts = (y2 - y1) * (x2 - x1)
+
+    # pixel < mean - offset, without dividing
+    dark = pixels * counts < sums - offset * counts
+    return Image.fromarray(np.where(dark, 0, 255).astype(np.uint8), mode='L')
+
+
+# Find the cells of the grid with almost no ink, that don't need to be read by OCR
+# image is the table as a grayscale (height, width) or RGB (height, width, 3) array. Pixels darker than dark_level are ink.
+# Each cell is trimmed by border pixels on every side (at most a quarter of its size) so that the grid lines
+# around it don't count. A cell is blank when less than threshold of its trimmed area is ink, or when it is empty.
+# Returns a (rows, columns) boolean array, computed for all the cells at once from an integral image.
+def find_blank_cells(image, row_intervals, column_intervals, threshold, border = 3, dark_level = 128):
+    pixels = np.asarray(image)
+    if pixels.ndim == 3:
+        pixels = pixels[:, :, :3].mean(axis=2)
+    height, width = pixels.shape
+    integral = np.zeros((height + 1, width + 1), dtype=np.int64)
+    integral[1:, 1:] = (pixels < dark_level).cumsum(axis=0).cumsum(axis=1)
+
+    y1, y2 = _trim_intervals(row_intervals, border, height)
+    x1, x2 = _trim_intervals(column_intervals, border, width)
+    y1, y2 = y1[:, None], y2[:, None]
+    x1, x2 = x1[None, :], x2[None, :]
+    ink = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+    area = (y2 - y1) * (x2 - x1)
+    return (ink < threshold * area) | (area == 0)
+
+
+def _trim_intervals(intervals, border, size):
+    intervals = np.asarray(intervals, dtype=np.int64).reshape(-1, 2)
+    trim = np.minimum(border, (intervals[:, 1] - intervals[:, 0]) // 4)
+    starts = np.clip(intervals[:, 0] + trim, 0, size)
+    ends = np.clip(intervals[:, 1] - trim, 0, size)
+    return starts, np.maximum(starts, ends)
@@ -97,3 +97,189 @@ def test_get_cropped_columns():
         assert len(column_list[counter].getcolors()) == 1
         assert column_list[counter].getcolors()[0][0] == column.size[0]*column.size[1]
         counter+=1
+
+
+def test_cropping_keeps_limit_order():
+    from PIL import Image
+    from table_processing.Table import get_cropped_rows, get_cropped_columns
+
+    im = Image.new('RGB', size = (90, 90))
+    limits = [60, 30, 90]
+    assert [row.size[1] for row in get_cropped_rows(im, limits)] == [30, 30, 30]
+    assert [column.size[0] for column in get_cropped_columns(im, limits)] == [30, 30, 30]
+    assert limits == [60, 30, 90]
+
+
+def test_cell_views():
+    import numpy as np
+    from PIL import Image
+    from table_processing.Table import Table
+
+    table = Table()
+    table.image = Image.new('RGB', size = (200, 90), color = (255, 255, 255))
+    table.image.paste((255, 0, 0), (100, 30, 200, 60))
+    table.row_limits = [0, 30.2, 60, 90]
+    table.column_limits = [0, 100, 200]
+    cells = table.get_cell_views()
+    assert [[cell.shape for cell in row] for row in cells] == [[(30, 100, 3)] * 2] * 3
+    for row in cells:
+        for cell in row:
+            assert np.shares_memory(cell, table.ocr_array)
+    assert cells[1][1][0, 0].tolist() == [255, 0, 0] and cells[1][0][0, 0].tolist() == [255, 255, 255]
+    # Each cell is the same as cropping it out of the table image
+    assert np.array_equal(cells[2][1], np.asarray(table.image.crop((100, 60, 200, 90))))
+
+
+def test_word_grid_matches_cell_grid():
+    from PIL import Image
+    from table_processing.Table import Table
+    from table_processing.table_tools import assign_words_to_cells
+
+    table = Table()
+    table.image = Image.new('RGB', size = (200, 90), color = (255, 255, 255))
+    table.row_limits = [0, 30.2, 30.4, 60, 90]
+    table.column_limits = [0, 0.3, 100, 200]
+    table.generate_table_pre_ocr()
+    cells = assign_words_to_cells([], table.row_limits, table.column_limits)
+    assert len(cells) == len(table.table_pre_ocr)
+    for row, pre_ocr_row in zip(cells, table.table_pre_ocr):
+        assert len(row) == len(pre_ocr_row)
+
+
+def test_parallel_ocr_keeps_cell_order(monkeypatch):
+    from PIL import Image
+    from table_processing import Table as table_module
+
+    monkeypatch.setattr(table_module, "ocr_cell", lambda cell, backend, scale: str((cell.shape[1], cell.shape[0])))
+    results = []
+    for max_workers in [1, 4]:
+        table = table_module.Table(max_workers = max_workers, blank_cell_threshold = None)
+        table.image = Image.new('RGB', size = (200, 90), color = (255, 255, 255))
+        table.row_limits = [0, 20, 50, 90]
+        table.column_limits = [0, 30, 100, 200]
+        table.generate_raw_table_text()
+        results.append(table.get_raw_dataframe())
+    assert results[0].equals(results[1])
+    assert list(results[1].columns) == ['(30, 20)', '(70, 20)', '(100, 20)']
+    assert results[1].values.tolist() == [['(30, 30)', '(70, 30)', '(100, 30)'], ['(30, 40)', '(70, 40)', '(100, 40)']]
+
+
+class FakeOcrBackend:
+    # Reports one word in every 100x30 cell of the table, the image it gets is upscaled 2.5x
+    def image_to_string(self, image):
+        return 'cell'
+
+    def image_to_data(self, image):
+        width, height = image.size
+        data = {'text': [], 'left': [], 'top': [], 'width': [], 'height': [], 'block_num': [], 'par_num': [], 'line_num': []}
+        for y in range(0, height, 75):
+            for x in range(0, width, 250):
+                data['text'].append(str(x) + '_' + str(y))
+                data['left'].append(x + 10)
+                data['top'].append(y + 10)
+                data['width'].append(50)
+                data['height'].append(20)
+                data['block_num'].append(1)
+                data['par_num'].append(1)
+                data['line_num'].append(y)
+        return data
+
+
+def test_ocr_backend_table_mode():
+    from PIL import Image
+    from table_processing.Table import Table
+
+    table = Table(ocr_mode = 'table', ocr_backend = FakeOcrBackend())
+    table.image = Image.new('RGB', size = (200, 90), color = (255, 255, 255))
+    table.row_limits = [0, 30, 60, 90]
+    table.column_limits = [0, 100, 200]
+    table.extract_table_content()
+    df = table.get_as_dataframe()
+    assert list(df.columns) == ['0_0', '250_0']
+    assert df.values.tolist() == [['0_75', '250_75'], ['0_150', '250_150']]
+
+
+def test_table_from_words_skips_ocr():
+    from PIL import Image
+    from table_processing.Table import Table
+
+    words = [(10, 5, 40, 20, 'Name', (0, 0)), (110, 5, 140, 20, 'Value', (0, 0)),
+             (10, 35, 40, 50, 'a', (1, 0)), (110, 35, 140, 50, '1', (1, 0))]
+    table = Table(words = words)
+    table.image = Image.new('RGB', size = (200, 60), color = (255, 255, 255))
+    table.row_limits = [0, 30, 60]
+    table.column_limits = [0, 100, 200]
+    assert table.get_ocr_jobs() == []
+    table.extract_table_content()
+    df = table.get_as_dataframe()
+    assert list(df.columns) == ['Name', 'Value']
+    assert df.values.tolist() == [['a', '1']]
+
+
+def test_release_images():
+    from PIL import Image
+    from table_processing.Table import Table
+
+    table = Table(words = [])
+    table.image = Image.new('RGB', size = (200, 60), color = (255, 255, 255))
+    table.row_limits = [0, 30, 60]
+    table.column_limits = [0, 100, 200]
+    table.generate_table_pre_ocr()
+    table.extract_table_content()
+    table.release_images()
+    assert not hasattr(table, 'image')
+    assert not hasattr(table, 'table_pre_ocr')
+    assert table.get_as_dataframe().shape == (1, 2)
+
+
+def test_ocr_colorspace():
+    from PIL import Image
+    from table_processing.Table import Table
+
+    for colorspace, mode in [('rgb', 'RGB'), ('gray', 'L'), ('binary', 'L')]:
+        table = Table(colorspace = colorspace, blank_cell_threshold = None)
+        table.image = Image.new('RGB', size = (200, 90), color = (255, 255, 255))
+        table.row_limits = [0, 30, 60, 90]
+        table.column_limits = [0, 100, 200]
+        assert [Image.fromarray(cell).mode for function, cell, backend, scale in table.get_ocr_jobs()] == [mode] * 6
+        assert table.image.mode == 'RGB'
+        table.ocr_mode = 'table'
+        assert table.get_ocr_jobs()[0][1].mode == mode
+
+
+def test_blank_cells_skip_ocr():
+    from PIL import Image, ImageDraw
+    from table_processing.Table import Table
+
+    table = Table(ocr_backend = FakeOcrBackend(), blank_cell_threshold = 0.002)
+    table.image = Image.new('RGB', size = (200, 90), color = (255, 255, 255))
+    draw = ImageDraw.Draw(table.image)
+    draw.line([(0, 30), (200, 30)], fill = (0, 0, 0), width = 2)  # grid lines don't count as ink
+    draw.line([(100, 0), (100, 90)], fill = (0, 0, 0), width = 2)
+    draw.rectangle([20, 10, 60, 20], fill = (0, 0, 0))
+    draw.rectangle([130, 70, 150, 80], fill = (0, 0, 0))
+    table.row_limits = [0, 30, 60, 90]
+    table.column_limits = [0, 100, 200]
+    assert len(table.get_ocr_jobs()) == 2
+    assert table.skipped_cells == 4
+    table.extract_table_content()
+    df = table.get_as_dataframe()
+    assert list(df.columns) == ['cell', '']
+    assert df.values.tolist() == [['', ''], ['', 'cell']]
+
+
+def test_dash_cells_are_read():
+    from PIL import Image, ImageDraw
+    from table_processing.Table import Table
+
+    # A wide column whose cells hold only a hyphen or an em dash, as drawn at 144 dpi. They have less ink than a
+    # blank cell threshold of 0.002, so they are only left out when one is asked for.
+    for blank_cell_threshold, jobs in [(None, 2), (0.002, 0)]:
+        table = Table(ocr_backend = FakeOcrBackend(), blank_cell_threshold = blank_cell_threshold)
+        table.image = Image.new('RGB', size = (600, 80), color = (255, 255, 255))
+        draw = ImageDraw.Draw(table.image)
+        draw.rectangle([296, 19, 301, 20], fill = (0, 0, 0))  # '-'
+        draw.rectangle([290, 59, 309, 60], fill = (0, 0, 0))  # '—'
+        table.row_limits = [0, 40, 80]
+        table.column_limits = [0, 600]
+        assert len(table.get_ocr_jobs()) == jobs
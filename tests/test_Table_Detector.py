@@ -51,4 +51,441 @@ def test_extract_table_content(column, row, true_table, read_table):
     assert len(true_table) == len(read_table)  # matching row amount
     assert len(true_table.columns.values) == len(read_table.columns.values)  # matching column amount
     for r in row:
-        assert str(true_table.iloc[r,column]) == str(read_table.iloc[r,column])  # matching cell contents
\ No newline at end of file
+        assert str(true_table.iloc[r,column]) == str(read_table.iloc[r,column])  # matching cell contents
+
+class FakeModel:
+    # Stands in for a TableTransformer model, finds one box whose position depends on the image content
+    def __init__(self):
+        from types import SimpleNamespace
+        self.batch_sizes = []
+        self.config = SimpleNamespace(id2label={0: 'table', 1: 'table rotated'})
+
+    def __call__(self, pixel_values, pixel_mask):
+        from types import SimpleNamespace
+        import torch
+        batch_size = pixel_values.shape[0]
+        self.batch_sizes.append(batch_size)
+        means = pixel_values.mean(dim=(1, 2, 3)).reshape(batch_size, 1, 1)
+        logits = torch.tensor([[[5.0, -5.0, -5.0]]]).repeat(batch_size, 1, 1)
+        pred_boxes = torch.tensor([[[0.5, 0.5, 0.4, 0.3]]]) + means * 0.01
+        return SimpleNamespace(logits=logits, pred_boxes=pred_boxes)
+
+
+class FakeTable:
+    # Stands in for Table so that no OCR is needed
+    def __init__(self, image, table_structure, ocr_mode = 'cell', extract_content = True, ocr_backend = None, words = None, colorspace = 'rgb', dpi = 144,
+                 blank_cell_threshold = None, engine = 'torch', profile = None):
+        self.image = image
+        self.profile = profile
+        self.words = words
+        self.colorspace = colorspace
+        self.table_structure = table_structure
+
+    def get_ocr_jobs(self):
+        return []
+
+    def set_ocr_results(self, results):
+        pass
+
+    def clean_table_text(self):
+        pass
+
+    def get_raw_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame([['a', 'b']], columns=['x', 'y'])
+
+    def get_as_dataframe(self):
+        return self.get_raw_dataframe()
+
+    def plot_bounding_boxes(self, file_name):
+        pass
+
+    def save_pre_ocr_table(self, file_path):
+        pass
+
+    def release_images(self):
+        del self.image
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    from table_processing import Table_Detector as detector_module
+    models = {'detection': FakeModel(), 'structure': FakeModel()}
+    monkeypatch.setattr(detector_module, "get_detection_model", lambda engine = 'torch': models['detection'])
+    monkeypatch.setattr(detector_module, "get_structure_model", lambda engine = 'torch': models['structure'])
+    monkeypatch.setattr(detector_module, "Table", FakeTable)
+    yield models
+
+
+def test_batched_page_detection(fake_models):
+    unbatched = Table_Detector(filename = "tests/resources/multipletab.pdf", detection_batch_size = 1).get_page_data()
+    assert fake_models['detection'].batch_sizes == [1, 1]
+
+    fake_models['detection'].batch_sizes.clear()
+    batched = Table_Detector(filename = "tests/resources/multipletab.pdf", detection_batch_size = 2).get_page_data()
+    assert fake_models['detection'].batch_sizes == [2]
+
+    assert [page['pageNum'] for page in batched] == [1, 2]
+    for batched_page, unbatched_page in zip(batched, unbatched):
+        assert [table['box'] for table in batched_page['tables']] == [table['box'] for table in unbatched_page['tables']]
+
+
+def test_structure_batches_across_pages(fake_models):
+    # Each page has one table, of different sizes. They are only recognized together when padding is asked for.
+    Table_Detector(filename = "tests/resources/multipletab.pdf", structure_batch_size = 4)
+    assert fake_models['structure'].batch_sizes == [1, 1]
+    fake_models['structure'].batch_sizes.clear()
+    Table_Detector(filename = "tests/resources/multipletab.pdf", structure_batch_size = 4, pad_structure_batches = True)
+    assert fake_models['structure'].batch_sizes == [2]
+    fake_models['structure'].batch_sizes.clear()
+    Table_Detector(filename = "tests/resources/multipletab.pdf", structure_batch_size = 1, pad_structure_batches = True)
+    assert fake_models['structure'].batch_sizes == [1, 1]
+
+
+def test_batched_page_detection_memory_ceiling(fake_models):
+    # A ceiling smaller than one page forces detection to run on each page as soon as it is rendered
+    Table_Detector(filename = "tests/resources/multipletab.pdf", detection_batch_size = 8, max_batch_memory_mb = 1)
+    assert fake_models['detection'].batch_sizes == [1, 1]
+
+
+def test_output_table_steps_reuses_detection(fake_models, tmp_path):
+    table_detector = Table_Detector(filename = "tests/resources/multipletab.pdf")
+    assert fake_models['detection'].batch_sizes == [1, 1]
+    for page in table_detector.get_page_data():
+        assert len(page['detection']['boxes']) == len(page['tables'])
+    table_detector.output_table_steps(str(tmp_path))
+    assert fake_models['detection'].batch_sizes == [1, 1]  # no extra inference for the intermediate output
+    assert os.path.exists(str(tmp_path / 'page_1full.jpg'))
+    assert os.path.exists(str(tmp_path / 'page_2full.jpg'))
+
+
+def test_text_layer_fills_tables(fake_models):
+    page_data = Table_Detector(filename = "tests/resources/multipletab.pdf", use_text_layer = True).get_page_data()
+    word_counts = []
+    for page in page_data:
+        for table in page['tables']:
+            assert table['words'] != None
+            assert table['table_content'].words == table['words']
+            width, height = table['table_image'].size
+            for x1, y1, x2, y2, text, line_id in table['words']:
+                assert 0 <= (x1 + x2) / 2 < width and 0 <= (y1 + y2) / 2 < height
+            word_counts.append(len(table['words']))
+
+    # The text layer is off by default
+    page_data = Table_Detector(filename = "tests/resources/multipletab.pdf").get_page_data()
+    for page in page_data:
+        for table in page['tables']:
+            assert table['words'] == None
+
+    # Tables with fewer than min_text_words words in their box are read by OCR, the others still use the text layer
+    page_data = Table_Detector(filename = "tests/resources/multipletab.pdf", use_text_layer = True, min_text_words = max(word_counts)).get_page_data()
+    tables = [table for page in page_data for table in page['tables']]
+    assert [table['words'] != None for table in tables] == [count >= max(word_counts) for count in word_counts]
+
+
+@pytest.mark.parametrize("rotation", [0, 90, 180, 270])
+def test_text_layer_on_rotated_pages(rotation):
+    import fitz
+    import numpy as np
+    doc = fitz.open()
+    page = doc.new_page(width = 300, height = 200)
+    page.insert_text((50, 100), "Word", fontsize = 14)
+    page.set_rotation(rotation)
+    detector = Table_Detector(filedata = doc.tobytes(), use_text_layer = True, eager = False)
+    x1, y1, x2, y2 = detector._get_page_words(page, 2.0, 2.0)[0][:4]
+    pix = page.get_pixmap(matrix = fitz.Matrix(2.0, 2.0))
+    pixels = np.frombuffer(pix.samples, dtype = np.uint8).reshape(pix.height, pix.width, pix.n).mean(axis = 2)
+    ys, xs = np.nonzero(pixels < 128)
+    # The word's box holds its ink in the rendered page
+    assert x1 <= xs.min() and xs.max() <= x2 and y1 <= ys.min() and ys.max() <= y2
+    doc.close()
+
+
+def test_iter_pages_releases_images(fake_models):
+    table_detector = Table_Detector(filename = "tests/resources/multipletab.pdf", eager = False)
+    assert table_detector.get_page_data() == None
+    assert fake_models['detection'].batch_sizes == []
+
+    pages = table_detector.iter_pages()
+    first_page = next(pages)
+    assert first_page['pageNum'] == 1
+    assert 'image' in first_page
+    assert fake_models['detection'].batch_sizes == [1]  # the second page hasn't been processed yet
+    second_page = next(pages)
+    assert second_page['pageNum'] == 2
+    assert 'image' not in first_page
+    for table in first_page['tables']:
+        assert 'table_image' not in table
+        assert not hasattr(table['table_content'], 'image')
+    assert list(pages) == []
+
+
+def test_to_excel_from_stream(fake_models, tmp_path):
+    import pandas as pd
+    filename = str(tmp_path / 'streamed.xlsx')
+    table_detector = Table_Detector(filename = "tests/resources/multipletab.pdf", eager = False)
+    table_detector.to_excel(filename = filename, pages = table_detector.iter_pages())
+    sheets = pd.read_excel(filename, sheet_name = None)
+    assert list(sheets.keys()) == ['Page1_1', 'Page2_1']
+
+
+def test_pipelined_pages_match_batched(fake_models):
+    batched = Table_Detector(filename = "tests/resources/multipletab.pdf").get_page_data()
+    pipelined = Table_Detector(filename = "tests/resources/multipletab.pdf",
+                               pipeline_workers = {'detect': 2, 'structure': 1, 'ocr': 2}).get_page_data()
+    assert [page['pageNum'] for page in pipelined] == [1, 2]
+    for batched_page, pipelined_page in zip(batched, pipelined):
+        assert [table['box'] for table in batched_page['tables']] == [table['box'] for table in pipelined_page['tables']]
+        assert [table['words'] for table in batched_page['tables']] == [table['words'] for table in pipelined_page['tables']]
+
+
+def test_result_cache_hit(fake_models, tmp_path):
+    from table_processing.result_cache import ResultCache
+    cache = ResultCache(str(tmp_path / 'cache'))
+    first = Table_Detector(filename = "tests/resources/multipletab.pdf", cache = cache)
+    assert fake_models['detection'].batch_sizes == [1, 1]
+    second = Table_Detector(filename = "tests/resources/multipletab.pdf", cache = cache)
+    assert fake_models['detection'].batch_sizes == [1, 1]  # nothing processed the second time
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert 'image' in first.get_page_data()[0]
+    assert 'image' not in second.get_page_data()[0]
+    for first_page, second_page in zip(first.get_page_data(), second.get_page_data()):
+        assert [table['box'] for table in first_page['tables']] == [table['box'] for table in second_page['tables']]
+    second.output_table_steps(str(tmp_path / 'intermediate'))
+
+    Table_Detector(filename = "tests/resources/multipletab.pdf", cache = cache, use_text_layer = True)
+    assert fake_models['detection'].batch_sizes == [1, 1, 1, 1]  # different settings are cached separately
+    cache.close()
+
+
+@pytest.mark.parametrize("page_fingerprint", ['content', 'pixmap'])
+def test_page_cache_reprocesses_changed_pages(fake_models, tmp_path, page_fingerprint):
+    import fitz
+    from table_processing.result_cache import ResultCache
+    cache = ResultCache(str(tmp_path / 'page_cache'))
+    doc = fitz.open("tests/resources/multipletab.pdf")
+    original = doc.tobytes()
+    doc[1].insert_text((72, 72), "Corrected")
+    reissued = doc.tobytes()
+    doc.close()
+
+    first = Table_Detector(filedata = original, page_cache = cache, page_fingerprint = page_fingerprint)
+    assert first.get_run_stats()['page_cache_misses'] == 2
+    assert fake_models['detection'].batch_sizes == [1, 1]
+
+    second = Table_Detector(filedata = reissued, page_cache = cache, page_fingerprint = page_fingerprint)
+    assert second.get_run_stats()['page_cache_hits'] == 1
+    assert second.get_run_stats()['page_cache_misses'] == 1
+    assert fake_models['detection'].batch_sizes == [1, 1, 1]  # only the changed page is processed again
+    assert [page['pageNum'] for page in second.get_page_data()] == [1, 2]
+    assert [table['box'] for table in second.get_page_data()[0]['tables']] == [table['box'] for table in first.get_page_data()[0]['tables']]
+
+    pipelined = Table_Detector(filedata = reissued, page_cache = cache, page_fingerprint = page_fingerprint, pipeline_workers = {'detect': 2})
+    assert pipelined.get_run_stats()['page_cache_hits'] == 2
+    assert fake_models['detection'].batch_sizes == [1, 1, 1]
+    cache.close()
+
+
+def test_page_fingerprint_includes_annotations():
+    import fitz
+    from table_processing.Table_Detector import fingerprint_page_content
+    doc = fitz.open("tests/resources/multipletab.pdf")
+    plain = [fingerprint_page_content(page) for page in doc]
+    annot = doc[1].add_freetext_annot(fitz.Rect(72, 72, 200, 100), "Corrected")
+    annot.update()
+    annotated = fitz.open("pdf", doc.tobytes())
+    assert [fingerprint_page_content(page) for page in annotated][0] == plain[0]
+    assert fingerprint_page_content(annotated[1]) != plain[1]
+    # Saving the document again gives the same fingerprints
+    assert [fingerprint_page_content(page) for page in fitz.open("pdf", annotated.tobytes(garbage = 4))] == \
+           [fingerprint_page_content(page) for page in annotated]
+
+    # A changed annotation changes the fingerprint of its page only
+    page = annotated[1]
+    before = fingerprint_page_content(page)
+    annot = next(page.annots())
+    annot.set_info(content = "Corrected again")
+    annot.update()
+    assert fingerprint_page_content(annotated[0]) == plain[0]
+    assert fingerprint_page_content(page) not in [plain[1], before]
+    doc.close()
+    annotated.close()
+
+
+def test_two_resolution_rendering(fake_models):
+    single = Table_Detector(filename = "tests/resources/multipletab.pdf").get_page_data()
+    two_resolutions = Table_Detector(filename = "tests/resources/multipletab.pdf", detection_zoom = 1.0, ocr_zoom = 2.0,
+                                     use_text_layer = True).get_page_data()
+    for single_page, page in zip(single, two_resolutions):
+        assert page['image'].width * 2 == single_page['image'].width  # detection ran on the small render
+        for table in page['tables']:
+            x1, y1, x2, y2 = table['box']
+            assert x1 >= 0 and y1 >= 0
+            assert x2 <= single_page['image'].width and y2 <= single_page['image'].height
+            width, height = table['table_image'].size
+            assert abs(width - (x2 - x1)) <= 2 and abs(height - (y2 - y1)) <= 2  # the clip is rounded out to whole pixels
+            for wx1, wy1, wx2, wy2, text, line_id in table['words']:
+                assert 0 <= (wx1 + wx2) / 2 < width and 0 <= (wy1 + wy2) / 2 < height
+
+    pipelined = Table_Detector(filename = "tests/resources/multipletab.pdf", detection_zoom = 1.0, ocr_zoom = 2.0,
+                               pipeline_workers = {'detect': 2, 'structure': 2}).get_page_data()
+    for page, pipelined_page in zip(two_resolutions, pipelined):
+        assert [table['box'] for table in page['tables']] == [table['box'] for table in pipelined_page['tables']]
+        assert [table['table_image'].size for table in page['tables']] == [table['table_image'].size for table in pipelined_page['tables']]
+
+
+@pytest.mark.parametrize("fast_inputs", [False, True])
+def test_pipeline_uses_pdf_from_one_thread(fake_models, monkeypatch, fast_inputs):
+    import threading
+    from table_processing import Table_Detector as detector_module
+    threads = set()
+    for name in ['_open_pdf', '_render_page', '_render_table_images']:
+        function = getattr(detector_module.Table_Detector, name)
+        def record(self, *arguments, function = function):
+            threads.add(threading.get_ident())
+            return function(self, *arguments)
+        monkeypatch.setattr(detector_module.Table_Detector, name, record)
+    # Pixmaps are only read on the PDF thread too, none reaches the detect stage
+    for name in ['pixmap_to_array', 'pixmap_to_image']:
+        function = getattr(detector_module, name)
+        def record_pixmap(pix, function = function):
+            threads.add(threading.get_ident())
+            return function(pix)
+        monkeypatch.setattr(detector_module, name, record_pixmap)
+    detect_page_tables = detector_module.Table_Detector._detect_page_tables
+    def detect(self, pages):
+        assert not any(isinstance(value, detector_module.fitz.Pixmap) for page_data in pages for value in page_data.values())
+        return detect_page_tables(self, pages)
+    monkeypatch.setattr(detector_module.Table_Detector, '_detect_page_tables', detect)
+    pages = Table_Detector(filename = "tests/resources/multipletab.pdf", detection_zoom = 1.0, ocr_zoom = 2.0, fast_inputs = fast_inputs,
+                           pipeline_workers = {'detect': 2, 'structure': 2, 'ocr': 2}).get_page_data()
+    assert [page['pageNum'] for page in pages] == [1, 2]
+    assert len(threads) == 1
+    if fast_inputs:
+        assert [page['image'].mode for page in pages] == ['RGB', 'RGB']  # made from the copied pixels
+
+    for stage in ['render', 'crop']:
+        with pytest.raises(Exception):
+            Table_Detector(filename = "tests/resources/multipletab.pdf", pipeline_workers = {stage: 2})
+
+
+def test_profiles(fake_models):
+    fast = Table_Detector(filename = "tests/resources/multipletab.pdf", profile = 'fast')
+    balanced = Table_Detector(filename = "tests/resources/multipletab.pdf")
+    assert fast.detection_zoom == 1.0 and fast.ocr_zoom == 1.5
+    assert fast.get_page_data()[0]['image'].width * 2 == balanced.get_page_data()[0]['image'].width
+    assert fast.get_config() != balanced.get_config()
+    for page in fast.get_page_data():
+        for table in page['tables']:
+            assert table['table_content'].profile['name'] == 'fast'  # the tables are read with the same profile
+
+    custom = Table_Detector(filename = "tests/resources/multipletab.pdf", profile = {'base': 'fast', 'threshold': 0.99}, ocr_zoom = 2.0)
+    assert custom.detection_zoom == 1.0 and custom.ocr_zoom == 2.0
+    assert custom.get_config()['threshold'] == 0.99
+    assert Table_Detector(filename = "tests/resources/multipletab.pdf", profile = 'balanced', eager = False).get_config() == balanced.get_config()
+
+
+def test_fast_inputs_match(fake_models):
+    slow = Table_Detector(filename = "tests/resources/multipletab.pdf").get_page_data()
+    fast = Table_Detector(filename = "tests/resources/multipletab.pdf", fast_inputs = True).get_page_data()
+    for slow_page, fast_page in zip(slow, fast):
+        assert 'pixmap' not in fast_page  # only kept until detection
+        assert len(slow_page['tables']) == len(fast_page['tables'])
+        for slow_table, fast_table in zip(slow_page['tables'], fast_page['tables']):
+            assert slow_table['box'] == pytest.approx(fast_table['box'], abs = 0.1)
+
+
+def test_fast_inputs_make_page_images_lazily(fake_models):
+    for zooms in [{}, {'detection_zoom': 1.0, 'ocr_zoom': 2.0}]:
+        detector = Table_Detector(filename = "tests/resources/multipletab.pdf", fast_inputs = True, eager = False, **zooms)
+        pages = [('image' in page_data, [table['table_image'].size for table in page_data['tables']]) for page_data in detector.iter_pages()]
+        assert [has_image for has_image, _ in pages] == [False, False]
+        assert [len(sizes) for _, sizes in pages] == [1, 1]
+    # The page images are kept when the results are kept, e.g. for the intermediate output
+    assert ['image' in page_data for page_data in Table_Detector(filename = "tests/resources/multipletab.pdf", fast_inputs = True).get_page_data()] == [True, True]
+
+
+def test_ocr_colorspace_keeps_rgb_model_inputs(fake_models):
+    from table_processing.table_tools import convert_colorspace
+    rgb = Table_Detector(filename = "tests/resources/multipletab.pdf", fast_inputs = True).get_page_data()
+    for colorspace in ['gray', 'binary']:
+        gray = Table_Detector(filename = "tests/resources/multipletab.pdf", fast_inputs = True, colorspace = colorspace,
+                              detection_zoom = 1.0, ocr_zoom = 2.0).get_page_data()
+        same_zoom = Table_Detector(filename = "tests/resources/multipletab.pdf", fast_inputs = True, colorspace = colorspace).get_page_data()
+        for rgb_page, gray_page in zip(rgb, same_zoom):
+            assert [table['box'] for table in rgb_page['tables']] == [table['box'] for table in gray_page['tables']]
+        for page in gray + same_zoom:
+            for table in page['tables']:
+                # The models get RGB images, only the OCR branch of each table is converted
+                assert table['table_image'].mode == 'RGB'
+                assert table['table_content'].colorspace == colorspace
+                assert convert_colorspace(table['table_image'], colorspace).mode == 'L'
+
+
+class CountingOcrBackend:
+    def __init__(self):
+        self._calls = [0]  # private, so it isn't part of the backend settings
+
+    @property
+    def calls(self):
+        return self._calls[0]
+
+    def image_to_string(self, image):
+        self._calls[0] += 1
+        return 'text'
+
+
+def test_ocr_counts_in_run_stats(fake_models, monkeypatch):
+    from table_processing import Table as table_module
+    from table_processing import Table_Detector as detector_module
+    monkeypatch.setattr(detector_module, "Table", table_module.Table)
+    monkeypatch.setattr(table_module, "get_structure_model", lambda engine = 'torch': fake_models['structure'])
+
+    backend = CountingOcrBackend()
+    table_detector = Table_Detector(filename = "tests/resources/multipletab.pdf", use_text_layer = False, ocr_backend = backend,
+                                    blank_cell_threshold = 0.002)
+    stats = table_detector.get_run_stats()
+    assert stats['ocr_calls'] == backend.calls
+    assert stats['ocr_calls'] + stats['ocr_memo_hits'] + stats['blank_cells_skipped'] == sum([len(row) for page in table_detector.get_page_data()
+                                                                     for table in page['tables'] for row in table['table_content'].blank_cells])
+
+    backend = CountingOcrBackend()
+    table_detector = Table_Detector(filename = "tests/resources/multipletab.pdf", use_text_layer = False, ocr_backend = backend)
+    assert table_detector.get_run_stats()['blank_cells_skipped'] == 0  # every cell is read by default
+
+    # A memo shared between runs answers every cell of the second run
+    from table_processing.ocr_memo import OcrMemo
+    memo = OcrMemo()
+    Table_Detector(filename = "tests/resources/multipletab.pdf", use_text_layer = False, ocr_backend = backend, ocr_memo = memo)
+    table_detector = Table_Detector(filename = "tests/resources/multipletab.pdf", use_text_layer = False, ocr_backend = backend, ocr_memo = memo)
+    assert table_detector.get_run_stats()['ocr_calls'] == 0
+    assert table_detector.get_ocr_memo_hit_rate() == 1.0
+
+
+def test_ocr_jobs_are_made_lazily():
+    from table_processing.Table import ocr_cell
+    import numpy as np
+    made = []
+    finished = []
+
+    class OneCellTable:
+        def __init__(self, index):
+            self.index = index
+
+        def get_ocr_jobs(self):
+            made.append(self.index)
+            return [(ocr_cell, np.full((10, 10), 255, dtype = np.uint8), CountingOcrBackend())]
+
+        def set_ocr_results(self, results):
+            finished.append((self.index, len(made), results))
+
+        def clean_table_text(self):
+            pass
+
+    table_detector = Table_Detector(filename = "tests/resources/multipletab.pdf", eager = False, max_workers = 2, memoize_ocr = False)
+    table_detector.run_stats = {}
+    table_detector.extract_table_content([OneCellTable(index) for index in range(0, 50)])
+    assert [index for index, count, results in finished] == list(range(0, 50))
+    assert all(results == ['text'] for index, count, results in finished)
+    # Only the jobs of the tables the pool is working on were made when the first table got its results
+    assert finished[0][1] <= 6
@@ -2,6 +2,7 @@ import sys, os
 import pytest
 from pathlib import Path
 sys.path.append(os.path.join(sys.path[0],'table_processing'))
+from tests.test_batch_processing import fake_models
 
 
 @pytest.fixture()
@@ -116,3 +117,30 @@ def test_intermediate_output(good_input_path, good_output_path, intermediate_pat
     assert(returned_inter_path.match(intermediate_path))
     assert os.path.exists(good_output_path)
     assert os.path.exists(intermediate_path)
+
+
+def test_intermediate_output_skips_cache(fake_models, tmp_path):
+    from table_processing.Table_processor_main import process_pdf
+    for run in ['first', 'second']:
+        output_path = str(tmp_path / run / 'out.xlsx')
+        os.makedirs(str(tmp_path / run))
+        inter_path = process_pdf("tests/resources/multipletab.pdf", output_file_path = output_path, input_intermediate_output = True,
+                                 cache_dir = str(tmp_path / 'cache'))[1]
+        assert os.path.exists(inter_path + 'page_1.jpg')
+    assert fake_models['detection'].batch_sizes == [1, 1, 1, 1]
+
+
+def test_text_layer_option(fake_models, monkeypatch, tmp_path):
+    import Table_processor_main as main_module
+    options = []
+    detector_class = main_module.Table_Detector
+    def record_options(*arguments, **keywords):
+        options.append(keywords.get('use_text_layer'))
+        return detector_class(*arguments, **keywords)
+    monkeypatch.setattr(main_module, "Table_Detector", record_options)
+    output = str(tmp_path / 'out.xlsx')
+    main_module.main(["tests/resources/multipletab.pdf", "--output", output, "--text-layer"])
+    main_module.main(["tests/resources/multipletab.pdf", "--output", output])
+    with open("tests/resources/multipletab.pdf", 'rb') as file:
+        main_module.process_content(file.read(), output, input_intermediate_output = False, use_text_layer = True)
+    assert options == [True, False, True]
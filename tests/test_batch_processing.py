@@ -0,0 +1,93 @@
+import sys, os
+import json
+import shutil
+import pytest
+sys.path.append(os.path.join(sys.path[0],'table_processing'))
+from tests.test_Table_Detector import FakeModel, FakeTable
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    # The batch workers import Table_Detector and model_registry from the table_processing directory. The worker
+    # processes are forked, so they get the patched modules too.
+    import Table_Detector as detector_module
+    import model_registry
+    models = {'detection': FakeModel(), 'structure': FakeModel()}
+    monkeypatch.setattr(detector_module, "get_detection_model", lambda engine = 'torch': models['detection'])
+    monkeypatch.setattr(detector_module, "get_structure_model", lambda engine = 'torch': models['structure'])
+    monkeypatch.setattr(detector_module, "Table", FakeTable)
+    monkeypatch.setattr(model_registry, "warm_up", lambda engine = 'torch': None)
+    yield models
+
+
+@pytest.fixture
+def input_directory(tmp_path):
+    directory = tmp_path / 'input'
+    for folder in ['a', 'b/c']:
+        os.makedirs(str(directory / folder))
+        shutil.copy('tests/resources/multipletab.pdf', str(directory / folder / 'multipletab.pdf'))
+    with open(str(directory / 'broken.pdf'), 'wb') as file:
+        file.write(b'not a pdf')
+    with open(str(directory / 'notes.txt'), 'w') as file:
+        file.write('not an input')
+    yield directory
+
+
+def read_manifest(output_directory):
+    with open(str(output_directory / 'manifest.jsonl')) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_find_input_files(input_directory):
+    from table_processing.batch_processing import find_input_files, get_output_path
+    files, root = find_input_files(input_directory)
+    assert [str(path.relative_to(root)) for path in files] == ['a/multipletab.pdf', 'b/c/multipletab.pdf', 'broken.pdf']
+    glob_files, glob_root = find_input_files(str(input_directory) + '/**/multipletab.pdf')
+    assert glob_files == files[:2] and glob_root == root
+    assert str(get_output_path(files[1], root, 'out')) == os.path.join('out', 'b', 'c', 'multipletab.xlsx')
+
+
+def test_batch_resumes_from_manifest(fake_models, input_directory, tmp_path):
+    import pandas as pd
+    from table_processing.batch_processing import process_batch
+    output_directory = tmp_path / 'output'
+    counts = process_batch(input_directory, output_directory, workers = 2)
+    assert counts == {'done': 2, 'failed': 1, 'skipped': 0}
+    records = read_manifest(output_directory)
+    assert [record['input'] for record in records] == sorted(record['input'] for record in records)
+    assert [record['status'] for record in records] == ['done', 'done', 'failed']
+    assert all(record['seconds'] >= 0 and record['started'] > 0 for record in records)
+    assert records[0]['sha256'] == records[1]['sha256'] and records[0]['tables'] == 2
+    assert os.path.exists(str(output_directory / 'b' / 'c' / 'multipletab.xlsx'))
+    assert [name for name in os.listdir(str(output_directory / 'a'))] == ['multipletab.xlsx']  # no partial output left
+
+    # Files done are skipped, failed and missing ones are processed again
+    os.remove(str(output_directory / 'a' / 'multipletab.xlsx'))
+    counts = process_batch(input_directory, output_directory, workers = 2)
+    assert counts == {'done': 1, 'failed': 1, 'skipped': 1}
+    assert len(read_manifest(output_directory)) == 3
+
+    # Other settings process every file again
+    counts = process_batch(input_directory, output_directory, workers = 1, profile = 'fast')
+    assert counts == {'done': 2, 'failed': 1, 'skipped': 0}
+    assert read_manifest(output_directory)[2]['output'] == None
+
+    # The results don't depend on the number of workers or the pool
+    other_directory = tmp_path / 'other'
+    process_batch(input_directory, other_directory, workers = 3, profile = 'fast', executor_type = 'thread')
+    for first, second in zip(read_manifest(output_directory), read_manifest(other_directory)):
+        assert first['input'] == second['input'] and first['status'] == second['status'] and first['sha256'] == second['sha256']
+        if first['output'] != None:
+            assert os.path.relpath(first['output'], str(output_directory)) == os.path.relpath(second['output'], str(other_directory))
+            first_sheets = pd.read_excel(first['output'], sheet_name = None)
+            second_sheets = pd.read_excel(second['output'], sheet_name = None)
+            assert first_sheets.keys() == second_sheets.keys()
+            assert all(first_sheets[name].equals(second_sheets[name]) for name in first_sheets)
+
+
+def test_output_name_clash(fake_models, input_directory, tmp_path):
+    from table_processing.batch_processing import process_batch
+    shutil.copy(str(input_directory / 'a' / 'multipletab.pdf'), str(input_directory / 'a' / 'multipletab.PDF'))
+    with pytest.raises(Exception):
+        process_batch(input_directory, tmp_path / 'output')
+    assert fake_models['detection'].batch_sizes == []  # nothing was processed
@@ -0,0 +1,124 @@
+import sys, os
+import json
+import base64
+import pytest
+from urllib import request
+from urllib.error import HTTPError
+sys.path.append(os.path.join(sys.path[0],'table_processing'))
+from tests.test_Table_Detector import FakeModel, FakeTable
+
+
+@pytest.fixture
+def server(monkeypatch, tmp_path):
+    # The server imports Table_Detector from the table_processing directory, so that is the module patched here
+    import Table_Detector as detector_module
+    from extraction_server import ExtractionServer
+    models = {'detection': FakeModel(), 'structure': FakeModel()}
+    monkeypatch.setattr(detector_module, "get_detection_model", lambda engine = 'torch': models['detection'])
+    monkeypatch.setattr(detector_module, "get_structure_model", lambda engine = 'torch': models['structure'])
+    monkeypatch.setattr(detector_module, "Table", FakeTable)
+    server = ExtractionServer(port = 0, output_directory = str(tmp_path), warm_up = False)
+    server.start()
+    yield server
+    server.shutdown()
+
+
+def post_job(server, job):
+    submission = request.Request(server.get_url() + '/jobs', data = json.dumps(job).encode('utf8'), headers = {'Content-Type': 'application/json'})
+    with request.urlopen(submission) as response:
+        return json.loads(response.read())
+
+
+def get_json(server, path):
+    with request.urlopen(server.get_url() + path) as response:
+        return json.loads(response.read())
+
+
+def test_job_pages_are_streamed(server, tmp_path):
+    import pandas as pd
+    output = str(tmp_path / 'out.xlsx')
+    job = post_job(server, {'path': os.path.abspath('tests/resources/multipletab.pdf'), 'output': output})
+    assert job['status'] in ['queued', 'running']
+
+    with request.urlopen(server.get_url() + '/jobs/' + job['id'] + '/pages') as response:
+        lines = [json.loads(line) for line in response]
+    assert [line['page'] for line in lines[:-1]] == [1, 2]
+    assert lines[0]['tables'][0]['columns'] == ['x', 'y'] and lines[0]['tables'][0]['rows'] == [['a', 'b']]
+    assert lines[-1]['job']['status'] == 'done' and lines[-1]['job']['pages'] == 2
+    assert list(pd.read_excel(output, sheet_name = None).keys()) == ['Page1_1', 'Page2_1']
+
+    assert get_json(server, '/jobs/' + job['id'])['status'] == 'done'
+    stats = get_json(server, '/stats')
+    assert stats['queue_depth'] == 0 and stats['running'] == 0 and stats['completed'] == 1
+    assert stats['processing_seconds']['count'] == 1 and stats['processing_seconds']['max'] >= 0
+
+
+def test_content_job_and_failures(server):
+    with open('tests/resources/multipletab.pdf', 'rb') as file:
+        job = post_job(server, {'content': base64.b64encode(file.read()).decode('ascii'), 'profile': 'fast'})
+    assert job['output'].endswith(job['id'] + '.xlsx')
+    failed = post_job(server, {'content': base64.b64encode(b'not a pdf').decode('ascii')})
+    for job_id in [job['id'], failed['id']]:
+        with request.urlopen(server.get_url() + '/jobs/' + job_id + '/pages') as response:
+            response.read()  # ends when the job is finished
+    assert get_json(server, '/jobs/' + job['id'])['status'] == 'done'
+    assert get_json(server, '/jobs/' + failed['id'])['status'] == 'failed'
+    assert get_json(server, '/stats')['failed'] == 1
+
+    for bad_job in [{'path': 'tests/resources'}, {'path': 'a.pdf', 'output': 'a.csv'}, {'path': 'a.pdf', 'profile': 'fastest'}, {},
+                    {'path': 'a.pdf', 'output': '../escape.xlsx'}, {'path': 'a.pdf', 'output': '/tmp/escape.xlsx'}]:
+        with pytest.raises(HTTPError) as error:
+            post_job(server, bad_job)
+        assert error.value.code == 400
+    with pytest.raises(HTTPError) as error:
+        get_json(server, '/jobs/unknown')
+    assert error.value.code == 404
+
+
+def test_submit_pdf_client(server, tmp_path):
+    from table_processing.Table_processor_main import submit_pdf
+    output_path, status = submit_pdf('tests/resources/multipletab.pdf', 'reports/client.xlsx', server_url = server.get_url())
+    assert status == 'done'
+    assert output_path == os.path.realpath(str(tmp_path / 'client.xlsx')) and os.path.exists(output_path)
+
+    # With the default output, the output is named after the input, inside the server's output directory
+    output_path, status = submit_pdf('tests/resources/multipletab.pdf', server_url = server.get_url())
+    assert status == 'done'
+    assert output_path == os.path.realpath(str(tmp_path / 'multipletab.xlsx')) and os.path.exists(output_path)
+
+    # Refused files and unreachable servers are reported, not raised
+    server.input_roots = [str(tmp_path)]
+    assert submit_pdf('tests/resources/multipletab.pdf', server_url = server.get_url()) == (None, 'failed')
+    assert submit_pdf('tests/resources/multipletab.pdf', server_url = 'http://127.0.0.1:1') == (None, 'failed')
+
+
+def test_submissions_are_confined(server, tmp_path):
+    import shutil
+    # Outputs are relative to the output directory
+    job = post_job(server, {'path': os.path.abspath('tests/resources/multipletab.pdf'), 'output': 'reports/out.xlsx'})
+    assert job['output'] == os.path.realpath(str(tmp_path / 'reports' / 'out.xlsx'))
+    os.symlink('/tmp', str(tmp_path / 'link'))
+    with pytest.raises(Exception):
+        server.submit(filename = 'a.pdf', output = 'link/escape.xlsx')
+
+    # Only JSON requests are accepted
+    submission = request.Request(server.get_url() + '/jobs', data = json.dumps({'path': 'a.pdf'}).encode('utf8'), headers = {'Content-Type': 'text/plain'})
+    with pytest.raises(HTTPError) as error:
+        request.urlopen(submission)
+    assert error.value.code == 415
+
+    # With input roots, only the files inside them can be submitted
+    server.input_roots = [str(tmp_path / 'inputs')]
+    os.makedirs(str(tmp_path / 'inputs'))
+    shutil.copy('tests/resources/multipletab.pdf', str(tmp_path / 'inputs' / 'multipletab.pdf'))
+    with pytest.raises(HTTPError) as error:
+        post_job(server, {'path': os.path.abspath('tests/resources/multipletab.pdf')})
+    assert error.value.code == 400
+    with pytest.raises(HTTPError):
+        post_job(server, {'path': str(tmp_path / 'inputs' / '..' / 'escape.pdf')})
+    allowed = post_job(server, {'path': str(tmp_path / 'inputs' / 'multipletab.pdf')})
+    for job_id in [job['id'], allowed['id']]:
+        with request.urlopen(server.get_url() + '/jobs/' + job_id + '/pages') as response:
+            response.read()
+        assert get_json(server, '/jobs/' + job_id)['status'] == 'done'
+    assert os.path.exists(job['output'])
@@ -0,0 +1,33 @@
+import sys, os
+import subprocess
+import pytest
+sys.path.append(os.path.join(sys.path[0],'table_processing'))
+
+# Entry modules must import quickly, the heavy dependencies are only imported when they are first used
+ENTRY_MODULES = ['Table_processor_main', 'Table_Detector', 'Table', 'model_registry']
+LAZY_MODULES = ['torch', 'transformers', 'matplotlib', 'pandas', 'pytesseract']
+IMPORT_TIME_BUDGET_MS = 2000  # cumulative import time of each entry module, about 0.5s when this was written
+
+
+# Returns the cumulative import time in ms of every module imported by "import module", from python -X importtime
+def measure_import_times(module, directory):
+    source = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'table_processing'))
+    env = dict(os.environ, PYTHONPATH = source)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd = str(directory), env = env,
+                            capture_output = True, text = True)
+    assert result.returncode == 0, result.stderr
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+@pytest.mark.parametrize('module', ENTRY_MODULES)
+def test_import_time_budget(module, tmp_path):
+    times = measure_import_times(module, tmp_path)
+    imported = [name for name in times if name.split('.')[0] in LAZY_MODULES]
+    assert imported == [], module + ' imports ' + str(sorted(set(name.split('.')[0] for name in imported))) + ' at load'
+    assert times[module] < IMPORT_TIME_BUDGET_MS, module + ' took ' + str(times[module]) + 'ms to import'
@@ -0,0 +1,80 @@
+import sys, os
+import pytest
+sys.path.append(os.path.join(sys.path[0],'table_processing'))
+
+
+def make_tiny_model():
+    # A small randomly initialized TableTransformer, so the engines can be tested without downloading the checkpoints
+    import torch
+    from transformers import TableTransformerConfig, TableTransformerForObjectDetection
+    torch.manual_seed(0)
+    config = TableTransformerConfig(use_timm_backbone=True, backbone='resnet18', use_pretrained_backbone=False, d_model=32,
+                                    encoder_layers=1, decoder_layers=1, num_queries=5, encoder_ffn_dim=32, decoder_ffn_dim=32,
+                                    encoder_attention_heads=2, decoder_attention_heads=2, num_labels=2)
+    return TableTransformerForObjectDetection(config).eval()
+
+
+def make_images():
+    from PIL import Image
+    return [Image.effect_noise((300, 200), 64).convert('RGB'), Image.new('RGB', (120, 400), color=(10, 20, 30))]
+
+
+def test_invalid_engine():
+    from table_processing.inference_engines import load_engine
+    with pytest.raises(Exception):
+        load_engine('some/model', 'tensorrt', lambda model_id: None)
+
+
+def test_torch_engine_is_the_model():
+    from table_processing.inference_engines import load_engine
+    model = object()
+    assert load_engine('some/model', 'torch', lambda model_id: model) is model
+
+
+def test_missing_onnx_export(tmp_path):
+    from table_processing.inference_engines import load_engine
+    with pytest.raises(Exception):
+        load_engine('some/model', 'onnx', lambda model_id: None, directory = tmp_path)
+
+
+def test_quantized_engine_parity(tmp_path):
+    from table_processing.inference_engines import load_engine, export_engine, check_parity, parity_passed
+    model = make_tiny_model()
+    # Quantized on load when there is no export
+    engine = load_engine('some/model', 'quantized', lambda model_id: make_tiny_model(), directory = tmp_path)
+    report = check_parity(engine, model, make_images())
+    assert report['images'] == 2
+    assert parity_passed(report, 'quantized')
+
+    path = export_engine(model, 'some/model', 'quantized', tmp_path)
+    assert os.path.exists(os.path.join(path, 'model.pt'))
+    engine = load_engine('some/model', 'quantized', lambda model_id: None, directory = tmp_path)
+    assert engine.config.num_queries == 5
+    assert parity_passed(check_parity(engine, model, make_images()), 'quantized')
+
+
+def test_onnx_engine_parity(tmp_path):
+    pytest.importorskip('onnxruntime')
+    pytest.importorskip('onnx')
+    from table_processing.inference_engines import load_engine, export_engine, check_parity, parity_passed
+    model = make_tiny_model()
+    export_engine(model, 'some/model', 'onnx', tmp_path)
+    engine = load_engine('some/model', 'onnx', lambda model_id: None, directory = tmp_path)
+    assert engine.config.num_labels == 2
+    report = check_parity(engine, model, make_images())
+    assert parity_passed(report, 'onnx')
+    assert report['scores'] < 1e-4
+
+
+def test_registry_keeps_engines_apart(monkeypatch):
+    from table_processing import model_registry
+    monkeypatch.setattr(model_registry, "_load_model", lambda model_id: make_tiny_model())
+    model_registry.unload()
+    try:
+        torch_model = model_registry.get_structure_model()
+        quantized = model_registry.get_structure_model('quantized')
+        assert quantized is not torch_model
+        assert quantized is model_registry.get_structure_model('quantized')
+        assert model_registry.is_loaded(model_registry.STRUCTURE_MODEL_ID + ':quantized')
+    finally:
+        model_registry.unload()
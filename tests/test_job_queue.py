@@ -0,0 +1,113 @@
+import sys, os
+import json
+import multiprocessing
+import time
+sys.path.append(os.path.join(sys.path[0],'table_processing'))
+from tests.test_batch_processing import fake_models, input_directory
+
+
+def test_lease_heartbeat_and_retries(tmp_path):
+    from table_processing.job_queue import JobQueue
+    queue = JobQueue(tmp_path / 'jobs.db', lease_seconds = 0.3, max_attempts = 2)
+    assert queue.add([('a.pdf', 'a.xlsx'), ('b.pdf', 'b.xlsx')]) == 2
+    assert queue.add([('a.pdf', 'other.xlsx')]) == 0  # already queued
+    first = queue.lease('first')
+    second = queue.lease('second')
+    assert (first['input'], second['input']) == ('a.pdf', 'b.pdf')
+    assert queue.lease('third') == None
+    assert queue.get_counts() == {'pending': 0, 'leased': 2, 'done': 0, 'failed': 0}
+
+    # The lease of a dead worker expires and the job goes to another worker, the first can't complete it anymore
+    time.sleep(0.2)
+    assert queue.heartbeat(second)
+    time.sleep(0.2)
+    retry = queue.lease('third')
+    assert retry['input'] == 'a.pdf' and retry['attempts'] == 2 and retry['token'] != first['token']
+    assert not queue.heartbeat(first)
+    assert not queue.complete(first)
+    assert queue.complete(retry, result = {'tables': 1})
+
+    # A failed job is retried until max_attempts
+    assert queue.fail(second, 'error')
+    again = queue.lease('first')
+    assert again['input'] == 'b.pdf' and again['attempts'] == 2
+    assert queue.fail(again, 'error again')
+    assert queue.lease('first') == None
+    jobs = queue.get_jobs()
+    assert [(job['status'], job['worker'], job['attempts']) for job in jobs] == [('done', 'third', 2), ('failed', 'first', 2)]
+    assert jobs[1]['error'] == 'error again'
+
+
+def test_complete_moves_output_once(tmp_path):
+    from table_processing.job_queue import JobQueue
+    queue = JobQueue(tmp_path / 'jobs.db', lease_seconds = 0.1)
+    queue.add([('a.pdf', str(tmp_path / 'a.xlsx'))])
+    first = queue.lease('first')
+    time.sleep(0.2)
+    second = queue.lease('second')
+    for job in [first, second]:
+        with open(str(tmp_path / (job['token'] + '.xlsx')), 'w') as file:
+            file.write(job['token'])
+    assert queue.complete(second, str(tmp_path / (second['token'] + '.xlsx')))
+    assert not queue.complete(first, str(tmp_path / (first['token'] + '.xlsx')))
+    with open(str(tmp_path / 'a.xlsx')) as file:
+        assert file.read() == second['token']
+    assert os.path.exists(str(tmp_path / (first['token'] + '.xlsx')))  # left for its worker to remove
+
+
+def test_heartbeat_survives_errors(tmp_path):
+    import sqlite3
+    from table_processing.job_queue import JobQueue, Heartbeat
+    queue = JobQueue(tmp_path / 'jobs.db', lease_seconds = 0.15)
+    queue.add([('a.pdf', 'a.xlsx')])
+    job = queue.lease('first')
+    beats = []
+    heartbeat = queue.heartbeat
+    def flaky_heartbeat(job):
+        beats.append(job['id'])
+        if len(beats) <= 2:
+            raise sqlite3.OperationalError('database is locked')
+        return heartbeat(job)
+    queue.heartbeat = flaky_heartbeat
+    beat = Heartbeat(queue, job)
+    time.sleep(0.4)
+    assert beat._thread.is_alive()
+    beat.stop()
+    assert len(beats) > 2
+    assert queue.complete(job)
+
+
+def lease_and_die(queue_path):
+    from table_processing.job_queue import JobQueue
+    JobQueue(queue_path, lease_seconds = 0.5).lease('dead')
+    os._exit(0)
+
+
+def test_workers_share_queue(fake_models, input_directory, tmp_path):
+    from table_processing.job_queue import JobQueue, run_worker
+    queue_path = str(tmp_path / 'jobs.db')
+    output_directory = tmp_path / 'output'
+    queue = JobQueue(queue_path)
+    assert queue.add_files(input_directory, output_directory) == 3
+
+    # A worker that leases the first job and dies without completing it
+    context = multiprocessing.get_context('fork')
+    dead = context.Process(target = lease_and_die, args = (queue_path,))
+    dead.start()
+    dead.join()
+    time.sleep(0.6)
+
+    # The workers are forked, so they get the patched models
+    with context.Pool(3) as pool:
+        results = pool.starmap(run_worker, [(queue_path, 'worker' + str(i), 'torch', None, None, 5, 2) for i in range(0, 3)])
+    assert sum(counts['done'] for counts in results) == 2
+    assert sum(counts['lost'] for counts in results) == 0
+    jobs = queue.get_jobs()
+    assert [job['status'] for job in jobs] == ['done', 'done', 'failed']
+    assert jobs[0]['attempts'] == 2 and jobs[0]['worker'].startswith('worker')
+    assert json.loads(jobs[0]['result'])['output'] == jobs[0]['output']  # not the temporary output it was written to
+    assert jobs[2]['attempts'] == 2
+    # Each job has its one output and no temporary outputs are left
+    assert os.listdir(str(output_directory / 'a')) == ['multipletab.xlsx']
+    assert os.listdir(str(output_directory / 'b' / 'c')) == ['multipletab.xlsx']
+    assert queue.lease() == None
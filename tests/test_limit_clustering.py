@@ -0,0 +1,55 @@
+import sys, os
+import pytest
+sys.path.append(os.path.join(sys.path[0],'table_processing'))
+
+
+# Reference implementation: keep each limit unless it is within the threshold of a limit kept before it
+def naive_remove_duplicates(limits, threshold):
+    unique = []
+    for limit in limits:
+        if not True in [abs(limit - x) < abs(threshold) for x in unique]:
+            unique.append(limit)
+    unique.sort()
+    return unique
+
+
+@pytest.mark.parametrize("seed", range(0, 5))
+def test_cluster_limits_matches_naive(seed):
+    import random
+    from table_processing.limit_clustering import cluster_limits, merge_limits
+    generator = random.Random(seed)
+    limits = sorted([generator.uniform(0, 500) for i in range(0, 300)] + [100, 108, 116, 116.0001])
+    for threshold in [0, 2, 8, 16]:
+        clustered, support = cluster_limits(limits, threshold)
+        assert clustered == naive_remove_duplicates(limits, threshold)
+        assert sum(support) == len(limits)
+        assert min(support) >= 1
+
+    unsorted = [generator.uniform(0, 500) for i in range(0, 100)]
+    assert merge_limits([], unsorted, 8) == naive_remove_duplicates(unsorted, 8)
+
+
+def test_cluster_support():
+    from table_processing.limit_clustering import cluster_limits
+    limits, support = cluster_limits([30, 10, 11, 12, 50, 31, 80], 8)
+    assert limits == [10, 30, 50, 80]
+    assert support == [3, 2, 1, 1]
+    assert cluster_limits([], 8) == ([], [])
+
+
+def test_thresholds_follow_resolution():
+    from table_processing.limit_clustering import calculate_row_column_limits
+    boxes = [[0, 0, 300, 20], [0, 25, 300, 45], [0, 0, 100, 45], [110, 0, 200, 45], [200, 0, 300, 45]]
+    # 5 pixels apart rows are separate at 72 DPI (4 pixel threshold) but merged at 144 DPI (8 pixel threshold)
+    rows_72, columns_72, row_support_72, column_support_72 = calculate_row_column_limits(boxes, (300, 45), dpi = 72)
+    assert rows_72 == [0, 20, 25, 45]
+    assert row_support_72 == [4, 1, 1, 4]
+    assert columns_72 == [0, 100, 110, 200, 300]
+    assert column_support_72 == [0, 1, 1, 2, 0]
+    rows_144, columns_144, row_support_144, column_support_144 = calculate_row_column_limits(boxes, (300, 45), dpi = 144)
+    assert rows_144 == [0, 20, 45]
+    assert columns_144 == [0, 100, 200, 300]
+
+    # The same table at twice the resolution gives the same grid, scaled
+    scaled = [[value * 2 for value in box] for box in boxes]
+    assert calculate_row_column_limits(scaled, (600, 90), dpi = 144)[0] == [value * 2 for value in rows_72]
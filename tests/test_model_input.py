@@ -0,0 +1,67 @@
+import sys, os
+import pytest
+sys.path.append(os.path.join(sys.path[0],'table_processing'))
+
+
+@pytest.fixture
+def rendered_page():
+    import fitz
+    doc = fitz.open("tests/resources/multipletab.pdf")
+    pix = doc[0].get_pixmap(matrix=fitz.Matrix(2, 2))
+    yield pix
+    doc.close()
+
+
+def test_pixmap_to_array_is_a_view(rendered_page):
+    import numpy as np
+    from table_processing.model_input import pixmap_to_array
+
+    pixels = pixmap_to_array(rendered_page)
+    assert pixels.shape == (rendered_page.height, rendered_page.width, 3)
+    assert np.shares_memory(pixels, np.frombuffer(rendered_page.samples_mv, dtype=np.uint8))
+    assert pixels[10, 20].tolist() == list(rendered_page.pixel(20, 10))
+
+
+@pytest.mark.parametrize("width, height", [(1191, 1684), (1684, 1191), (800, 800), (300, 2000), (640, 480), (1333, 800)])
+def test_input_size_matches_image_processor(width, height):
+    from PIL import Image
+    from transformers import DetrImageProcessor
+    from table_processing.model_input import InputEncoder
+
+    image = Image.new('RGB', size = (width, height), color = (255, 255, 255))
+    encoding = DetrImageProcessor()(image, return_tensors="pt")
+    assert tuple(encoding['pixel_values'].shape[-2:]) == InputEncoder(DetrImageProcessor()).get_input_size(image)
+
+
+def test_encode_matches_image_processor(rendered_page):
+    import torch
+    from PIL import Image
+    from transformers import DetrImageProcessor
+    from table_processing.model_input import pixmap_to_array, InputEncoder
+
+    image = Image.frombytes("RGB", [rendered_page.width, rendered_page.height], rendered_page.samples)
+    encoding = DetrImageProcessor()(image, return_tensors="pt")
+    encoder = InputEncoder(DetrImageProcessor())
+    for source in [pixmap_to_array(rendered_page), image]:
+        pixel_values, pixel_mask = encoder.encode([source, source])
+        assert pixel_values.shape[0] == 2
+        assert torch.allclose(pixel_values[1:], encoding['pixel_values'], atol = 1e-3)
+        assert torch.equal(pixel_mask[1:], encoding['pixel_mask'])
+
+    buffer = pixel_values.data_ptr()
+    assert encoder.encode([image])[0].data_ptr() == buffer  # the buffer is reused
+
+
+def test_encode_pads_like_image_processor(rendered_page):
+    import torch
+    from PIL import Image
+    from transformers import DetrImageProcessor
+    from table_processing.model_input import InputEncoder
+
+    page = Image.frombytes("RGB", [rendered_page.width, rendered_page.height], rendered_page.samples)
+    images = [page.crop((0, 0, 600, 300)), page.crop((0, 300, 400, 1000))]
+    encoding = DetrImageProcessor()(images, return_tensors="pt")
+    pixel_values, pixel_mask = InputEncoder(DetrImageProcessor()).encode(images)
+    assert pixel_values.shape == encoding['pixel_values'].shape
+    assert torch.equal(pixel_mask, encoding['pixel_mask'])
+    assert torch.allclose(pixel_values, encoding['pixel_values'], atol = 1e-3)
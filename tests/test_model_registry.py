@@ -0,0 +1,45 @@
+import sys, os
+import pytest
+sys.path.append(os.path.join(sys.path[0],'table_processing'))
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    from table_processing import model_registry
+    loaded = []
+    def fake_load_model(model_id):
+        loaded.append(model_id)
+        return object()
+    monkeypatch.setattr(model_registry, "_load_model", fake_load_model)
+    model_registry.unload()
+    yield model_registry, loaded
+    model_registry.unload()
+
+
+def test_models_load_once(registry):
+    model_registry, loaded = registry
+    first = model_registry.get_detection_model()
+    second = model_registry.get_detection_model()
+    assert first is second
+    assert model_registry.get_structure_model() is model_registry.get_structure_model()
+    assert loaded == [model_registry.DETECTION_MODEL_ID, model_registry.STRUCTURE_MODEL_ID]
+
+
+def test_warm_up_and_unload(registry):
+    model_registry, loaded = registry
+    model_registry.warm_up()
+    assert model_registry.is_loaded(model_registry.DETECTION_MODEL_ID)
+    assert model_registry.is_loaded(model_registry.STRUCTURE_MODEL_ID)
+    model_registry.unload()
+    assert not model_registry.is_loaded(model_registry.DETECTION_MODEL_ID)
+    model_registry.get_detection_model()
+    assert loaded.count(model_registry.DETECTION_MODEL_ID) == 2
+
+
+def test_concurrent_access_loads_once(registry):
+    from concurrent.futures import ThreadPoolExecutor
+    model_registry, loaded = registry
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        models = list(executor.map(lambda i: model_registry.get_structure_model(), range(32)))
+    assert all(model is models[0] for model in models)
+    assert loaded == [model_registry.STRUCTURE_MODEL_ID]
@@ -0,0 +1,84 @@
+import sys, os
+import pytest
+sys.path.append(os.path.join(sys.path[0],'table_processing'))
+
+
+def test_default_tesseract_cmd_from_environment(monkeypatch):
+    from table_processing.ocr_backends import default_tesseract_cmd, PytesseractBackend
+    monkeypatch.setenv('TESSERACT_CMD', '/opt/tesseract/bin/tesseract')
+    assert default_tesseract_cmd() == '/opt/tesseract/bin/tesseract'
+    assert PytesseractBackend().tesseract_cmd == '/opt/tesseract/bin/tesseract'
+    assert PytesseractBackend(tesseract_cmd = 'other').tesseract_cmd == 'other'
+
+
+def test_get_ocr_backend():
+    from table_processing.ocr_backends import get_ocr_backend, PytesseractBackend
+    assert isinstance(get_ocr_backend('pytesseract'), PytesseractBackend)
+    backend = PytesseractBackend(config = '--psm 6')
+    assert get_ocr_backend(backend) is backend
+    with pytest.raises(Exception):
+        get_ocr_backend('not_a_backend')
+
+
+def test_tesserocr_backend_requires_package():
+    try:
+        import tesserocr
+        pytest.skip("tesserocr is installed")
+    except ImportError:
+        pass
+    from table_processing.ocr_backends import get_ocr_backend
+    with pytest.raises(Exception):
+        get_ocr_backend('tesserocr')
+
+
+def test_pytesseract_commands_dont_mix(monkeypatch):
+    import time
+    import pytesseract
+    from concurrent.futures import ThreadPoolExecutor
+    from table_processing.ocr_backends import PytesseractBackend
+
+    def image_to_string(image, config = ''):
+        command = pytesseract.pytesseract.tesseract_cmd
+        time.sleep(0.01)
+        assert pytesseract.pytesseract.tesseract_cmd == command  # not changed while the call runs
+        return command
+    monkeypatch.setattr(pytesseract, 'image_to_string', image_to_string)
+    monkeypatch.setattr(pytesseract.pytesseract, 'tesseract_cmd', 'tesseract')
+
+    backends = [PytesseractBackend(tesseract_cmd = 'first'), PytesseractBackend(tesseract_cmd = 'second')]
+    with ThreadPoolExecutor(max_workers = 8) as executor:
+        results = list(executor.map(lambda i: (i % 2, backends[i % 2].image_to_string(None)), range(0, 40)))
+    assert all(result == ['first', 'second'][index] for index, result in results)
+
+
+class FakeTessBaseAPI:
+    started = []
+
+    def __init__(self, lang = 'eng', path = None):
+        self.ended = False
+        FakeTessBaseAPI.started.append(self)
+
+    def SetImage(self, image):
+        self.image = image
+
+    def GetUTF8Text(self):
+        return str(self.image)
+
+    def End(self):
+        self.ended = True
+
+
+def test_tesserocr_engines_are_reused(monkeypatch):
+    import types
+    from table_processing.ocr_pool import map_ordered
+    monkeypatch.setitem(sys.modules, 'tesserocr', types.SimpleNamespace(PyTessBaseAPI = FakeTessBaseAPI))
+    FakeTessBaseAPI.started = []
+    from table_processing.ocr_backends import TesserocrBackend
+    backend = TesserocrBackend()
+    # Every call of map_ordered has a new thread pool, the engines are still started only once
+    for batch in range(0, 5):
+        assert list(map_ordered(backend.image_to_string, range(0, 20), max_workers = 3)) == [str(i) for i in range(0, 20)]
+    assert 1 <= len(FakeTessBaseAPI.started) <= 3
+    backend.close()
+    assert all(api.ended for api in FakeTessBaseAPI.started)
+    assert backend.image_to_string(1) == '1'  # still usable, with a new engine
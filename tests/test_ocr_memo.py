@@ -0,0 +1,107 @@
+import sys, os
+import pytest
+sys.path.append(os.path.join(sys.path[0],'table_processing'))
+
+
+def make_cell(text, offset = (5, 5), size = (80, 30), background = 255, text_color = 0):
+    import numpy as np
+    from PIL import Image, ImageDraw
+    image = Image.new('L', size = size, color = background)
+    draw = ImageDraw.Draw(image)
+    draw.fontmode = '1'  # no antialiasing, so the text pixels are the same on any background
+    draw.text(offset, text, fill = text_color)
+    return np.asarray(image)
+
+
+def test_hash_cell_ignores_position_and_background():
+    from table_processing.ocr_memo import hash_cell
+    assert hash_cell(make_cell('Yes')) == hash_cell(make_cell('Yes', offset = (30, 12), background = 230))
+    assert hash_cell(make_cell('Yes')) == hash_cell(make_cell('Yes', size = (120, 40)))
+    assert hash_cell(make_cell('Yes')) != hash_cell(make_cell('No'))
+    assert hash_cell(make_cell('')) == hash_cell(make_cell('', size = (10, 10)))
+
+
+def test_hash_cell_light_text():
+    import numpy as np
+    from table_processing.ocr_memo import hash_cell
+    gray_yes, gray_no = make_cell('Yes', text_color = 160), make_cell('No', text_color = 160)
+    yellow_yes = np.stack([make_cell('Yes', text_color = 230)] * 2 + [make_cell('Yes', text_color = 40)], axis = 2)  # (230, 230, 40) on white
+    keys = [hash_cell(cell) for cell in [gray_yes, gray_no, yellow_yes, make_cell(''), make_cell('Yes', background = 0, text_color = 255)]]
+    assert len(set(keys)) == 3
+    assert keys[0] == keys[2] == keys[4]  # the same text in any color
+    assert keys[1] != keys[0] and keys[3] not in [keys[0], keys[1]]
+
+
+def test_light_cells_are_not_shared():
+    from table_processing.Table import ocr_cell
+    from table_processing.ocr_memo import OcrMemo, run_ocr_jobs
+    backend = CountingBackend()
+    cells = [make_cell('Yes', text_color = 160), make_cell('No', text_color = 160), make_cell('', size = (80, 30))]
+    results, calls = run_ocr_jobs([(ocr_cell, cell, backend) for cell in cells], OcrMemo())
+    assert calls == 3 and backend.calls == 3
+
+
+def test_memo_lru_eviction():
+    from table_processing.ocr_memo import OcrMemo
+    memo = OcrMemo(max_entries = 2)
+    memo.set('a', 'A')
+    memo.set('b', 'B')
+    assert memo.get('a') == 'A'  # a is now the most recently used
+    memo.set('c', 'C')
+    assert memo.get('b') == None
+    assert memo.get('a') == 'A' and memo.get('c') == 'C'
+    assert (memo.hits, memo.misses) == (3, 1)
+    assert memo.get_hit_rate() == 0.75
+
+
+class CountingBackend:
+    def __init__(self, config = ''):
+        self.config = config
+        self._calls = [0]  # private, so it isn't part of the backend settings
+
+    @property
+    def calls(self):
+        return self._calls[0]
+
+    def image_to_string(self, image):
+        self._calls[0] += 1
+        return 'text ' + str(image.size)
+
+
+def test_run_ocr_jobs_reads_repeated_cells_once():
+    from table_processing.Table import ocr_cell
+    from table_processing.ocr_memo import OcrMemo, run_ocr_jobs
+    backend = CountingBackend()
+    cells = [make_cell('Yes'), make_cell('No'), make_cell('Yes', offset = (20, 10)), make_cell('Yes')]
+    jobs = [(ocr_cell, cell, backend) for cell in cells]
+
+    without_memo, calls = run_ocr_jobs(jobs)
+    assert calls == 4 and backend.calls == 4
+
+    backend._calls[0] = 0
+    memo = OcrMemo()
+    results, calls = run_ocr_jobs(jobs, memo, max_workers = 2)
+    assert calls == 2 and backend.calls == 2
+    assert results[0] == results[2] == results[3] == without_memo[0]
+    assert results[1] == without_memo[1]
+    assert (memo.hits, memo.misses) == (2, 2)
+
+    results, calls = run_ocr_jobs(jobs, memo)
+    assert calls == 0 and backend.calls == 2
+
+    # Different backend settings are memoized separately
+    other_backend = CountingBackend(config = '--psm 7')
+    results, calls = run_ocr_jobs([(ocr_cell, cells[0], other_backend)], memo)
+    assert calls == 1
+
+
+def test_persistent_memo(tmp_path):
+    from table_processing.Table import ocr_cell
+    from table_processing.ocr_memo import OcrMemo, run_ocr_jobs
+    from table_processing.result_cache import ResultCache
+    cache = ResultCache(str(tmp_path / 'ocr_memo'))
+    backend = CountingBackend()
+    run_ocr_jobs([(ocr_cell, make_cell('Yes'), backend)], OcrMemo(persistent = cache))
+    results, calls = run_ocr_jobs([(ocr_cell, make_cell('Yes'), backend)], OcrMemo(persistent = cache))
+    assert calls == 0 and backend.calls == 1
+    cache.close()
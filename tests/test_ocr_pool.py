@@ -0,0 +1,64 @@
+import sys, os
+import pytest
+sys.path.append(os.path.join(sys.path[0],'table_processing'))
+
+
+def slow_square(x):
+    import time
+    time.sleep(0.01 * (x % 3))
+    return x * x
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_map_ordered_keeps_order(max_workers):
+    from table_processing.ocr_pool import map_ordered
+    results = list(map_ordered(slow_square, range(20), max_workers = max_workers))
+    assert results == [x * x for x in range(20)]
+
+
+def test_map_ordered_process_pool():
+    from table_processing.ocr_pool import map_ordered
+    results = list(map_ordered(abs, [-3, 2, -1], max_workers = 2, executor_type = 'process'))
+    assert results == [3, 2, 1]
+
+
+def test_map_ordered_bounded_pending():
+    from table_processing.ocr_pool import map_ordered
+    produced = []
+    def items():
+        for x in range(100):
+            produced.append(x)
+            yield x
+    results = map_ordered(slow_square, items(), max_workers = 2, max_pending = 4)
+    for count, result in enumerate(results):
+        # Items are only pulled from the input as results are consumed
+        assert len(produced) <= count + 1 + 4
+    assert len(produced) == 100
+
+
+def test_map_ordered_invalid_executor():
+    from table_processing.ocr_pool import map_ordered
+    with pytest.raises(Exception):
+        list(map_ordered(abs, [1], max_workers = 2, executor_type = 'fiber'))
+
+
+@pytest.mark.parametrize("max_workers", [1, 3])
+def test_map_ordered_initializer(max_workers):
+    from table_processing.ocr_pool import map_ordered
+    initialized = []
+    results = list(map_ordered(abs, [-1, -2, -3, -4], max_workers = max_workers, initializer = initialized.append, initargs = ('worker',)))
+    assert results == [1, 2, 3, 4]
+    assert 1 <= len(initialized) <= max_workers and set(initialized) == {'worker'}
+
+
+@pytest.mark.parametrize("max_workers", [1, 3])
+def test_map_unordered_yields_as_completed(max_workers):
+    import time
+    from table_processing.ocr_pool import map_unordered
+    def wait(x):
+        time.sleep(x)
+        return x
+    results = list(map_unordered(wait, [0.3, 0.0, 0.1, 0.0], max_workers = max_workers))
+    assert sorted(results) == [0.0, 0.0, 0.1, 0.3]
+    if max_workers > 1:
+        assert results[-1] == 0.3  # the slow first item doesn't hold back the others
@@ -0,0 +1,48 @@
+import sys, os
+import pytest
+sys.path.append(os.path.join(sys.path[0],'table_processing'))
+
+
+def slow_increment(x):
+    import time
+    time.sleep(0.005 * ((x * 7) % 5))
+    return x + 1
+
+
+def test_pipeline_keeps_order():
+    from table_processing.pipeline import Pipeline
+    pipeline = Pipeline([('add', slow_increment, 3), ('double', lambda x: x * 2, 2), ('add_again', slow_increment, 4)])
+    assert list(pipeline.run(range(50))) == [(x + 1) * 2 + 1 for x in range(50)]
+
+
+def test_pipeline_bounded_in_flight():
+    import threading
+    from table_processing.pipeline import Pipeline
+    produced = []
+    def items():
+        for x in range(40):
+            produced.append(x)
+            yield x
+    pipeline = Pipeline([('add', slow_increment, 2), ('add_again', slow_increment, 2)], queue_size = 1, max_in_flight = 3)
+    for count, result in enumerate(pipeline.run(items())):
+        assert len(produced) <= count + 1 + 3
+    assert len(produced) == 40
+
+
+def test_pipeline_raises_stage_errors():
+    from table_processing.pipeline import Pipeline
+    def fail_on_three(x):
+        if x == 3:
+            raise ValueError("bad item")
+        return x
+    pipeline = Pipeline([('check', fail_on_three, 2)])
+    with pytest.raises(ValueError):
+        list(pipeline.run(range(10)))
+
+
+def test_pipeline_stops_early():
+    from table_processing.pipeline import Pipeline
+    pipeline = Pipeline([('add', slow_increment, 2)])
+    results = pipeline.run(range(1000))
+    assert next(results) == 1
+    results.close()
@@ -0,0 +1,50 @@
+import sys, os
+import pytest
+sys.path.append(os.path.join(sys.path[0],'table_processing'))
+
+
+def test_named_profiles():
+    from table_processing.profiles import get_profile, get_profile_names, PROFILE_SETTINGS, RENDER_ZOOM, TABLE_PADDING, OCR_UPSCALE
+    assert get_profile_names()[:3] == ['fast', 'balanced', 'accurate']
+    for name in ['fast', 'balanced', 'accurate']:
+        profile = get_profile(name)
+        assert profile['name'] == name
+        assert all(key in profile for key in PROFILE_SETTINGS)
+    balanced = get_profile()
+    assert balanced['name'] == 'balanced'
+    assert balanced['detection_zoom'] == RENDER_ZOOM and balanced['padding'] == TABLE_PADDING and balanced['ocr_upscale'] == OCR_UPSCALE
+    with pytest.raises(Exception):
+        get_profile('fastest')
+
+
+def test_custom_profiles():
+    from table_processing.profiles import get_profile, register_profile, get_profile_names, PROFILES
+    custom = get_profile({'ocr_upscale': 3.0})
+    assert custom['name'] == 'custom'
+    assert custom['ocr_upscale'] == 3.0 and custom['ocr_zoom'] == get_profile('balanced')['ocr_zoom']
+    assert get_profile({'base': 'fast', 'threshold': 0.8})['detection_zoom'] == get_profile('fast')['detection_zoom']
+    with pytest.raises(Exception):
+        get_profile({'zoom': 3.0})
+
+    custom['padding'][0] = -100  # profiles are copies
+    assert get_profile('balanced')['padding'][0] != -100
+
+    register_profile('scans', {'base': 'accurate', 'ocr_upscale': 3.0, 'name': 'ignored'})
+    try:
+        assert 'scans' in get_profile_names()
+        scans = get_profile('scans')
+        assert scans['name'] == 'scans' and scans['ocr_upscale'] == 3.0 and scans['ocr_zoom'] == get_profile('accurate')['ocr_zoom']
+    finally:
+        del PROFILES['scans']
+
+
+def test_ocr_upscale_is_part_of_memo_key():
+    from PIL import Image
+    import numpy as np
+    from table_processing.Table import ocr_cell
+    from table_processing.ocr_memo import OcrMemo
+    class Backend:
+        name = 'fake'
+    memo = OcrMemo()
+    cell = np.asarray(Image.new('L', (40, 20), color = 0))
+    assert memo.make_key(ocr_cell, cell, Backend(), 2.5) != memo.make_key(ocr_cell, cell, Backend(), 2.0)
@@ -0,0 +1,33 @@
+import sys, os
+import pytest
+sys.path.append(os.path.join(sys.path[0],'table_processing'))
+
+
+@pytest.fixture
+def result_cache(tmp_path):
+    from table_processing.result_cache import ResultCache
+    cache = ResultCache(str(tmp_path / 'cache'))
+    yield cache
+    cache.close()
+
+
+def test_make_key(result_cache):
+    key = result_cache.make_key(b'pdf content', {'zoom': 2.0, 'ocr_mode': 'cell'})
+    assert key == result_cache.make_key(b'pdf content', {'ocr_mode': 'cell', 'zoom': 2.0})
+    assert key != result_cache.make_key(b'other pdf content', {'zoom': 2.0, 'ocr_mode': 'cell'})
+    assert key != result_cache.make_key(b'pdf content', {'zoom': 1.0, 'ocr_mode': 'cell'})
+
+
+def test_get_and_set(result_cache):
+    import pandas as pd
+    key = result_cache.make_key(b'pdf content', {})
+    assert result_cache.get(key) == None
+    result_cache.set(key, [{'pageNum': 1, 'tables': [pd.DataFrame([['a']])]}])
+    assert result_cache.get(key)[0]['tables'][0].equals(pd.DataFrame([['a']]))
+    assert (result_cache.hits, result_cache.misses) == (1, 1)
+
+
+def test_unpicklable_value_is_not_cached(result_cache):
+    key = result_cache.make_key(b'pdf content', {})
+    result_cache.set(key, lambda x: x)
+    assert result_cache.get(key) == None
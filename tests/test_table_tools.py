@@ -70,4 +70,168 @@ threshold_values = [(1, 1, 1, True),
 def test_within_threshold(a, b, c, expected_result):
     from table_processing.table_tools import within_threshold
     assert within_threshold(a, b, c) == expected_result
-    
\ No newline at end of file
+    
+
+class FakeStructureModel:
+    # Stands in for a TableTransformer model, predictions depend only on each image's own pixels
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, pixel_values, pixel_mask):
+        from types import SimpleNamespace
+        import torch
+        self.batch_sizes.append(pixel_values.shape[0])
+        batch_size = pixel_values.shape[0]
+        means = pixel_values.mean(dim=(1, 2, 3)).reshape(batch_size, 1, 1)
+        logits = torch.tensor([[[5.0, -5.0]]]).repeat(batch_size, 1, 1)
+        pred_boxes = torch.tensor([[[0.5, 0.5, 0.2, 0.3]]]) + means * 0.01
+        return SimpleNamespace(logits=logits, pred_boxes=pred_boxes)
+
+
+def test_get_bounding_boxes_batched_matches_unbatched():
+    from PIL import Image
+    import torch
+    from table_processing.table_tools import get_bounding_boxes
+    images = [Image.new('RGB', (300, 200), color=(i * 40, 100, 200)) for i in range(5)]
+    images.insert(2, Image.new('RGB', (120, 400), color=(10, 20, 30)))
+
+    model = FakeStructureModel()
+    batched = get_bounding_boxes(images, model, batch_size=4)[0]
+    assert sorted(model.batch_sizes) == [1, 1, 4]
+
+    # Only images of the same size are batched, with no padding, so the results are exactly the same
+    for image, batched_result in zip(images, batched):
+        single_result = get_bounding_boxes(image, FakeStructureModel())[0][0]
+        for key in ['boxes', 'scores', 'labels']:
+            assert torch.equal(single_result[key], batched_result[key])
+
+
+def test_get_bounding_boxes_padded_batches():
+    from PIL import Image
+    import torch
+    from table_processing.table_tools import get_bounding_boxes
+    import fitz
+    from tests.test_inference_engines import make_tiny_model
+    doc = fitz.open('tests/resources/multipletab.pdf')
+    pix = doc[0].get_pixmap(matrix=fitz.Matrix(2, 2))
+    doc.close()
+    page = Image.frombytes('RGB', [pix.width, pix.height], pix.samples)
+    images = [page.crop((100, 100, 900, 500)), page.crop((100, 600, 700, 1400)), page.crop((50, 50, 1100, 400))]
+
+    # With pad_batches, tables of different sizes are batched together, padded to the largest, and match running each
+    # on its own within a tolerance
+    model = make_tiny_model()
+    for fast_inputs in [False, True]:
+        batched = get_bounding_boxes(images, model, batch_size=3, threshold=0.0, fast_inputs=fast_inputs, pad_batches=True)[0]
+        for image, batched_result in zip(images, batched):
+            single_result = get_bounding_boxes(image, model, threshold=0.0, fast_inputs=fast_inputs)[0][0]
+            assert torch.equal(single_result['labels'], batched_result['labels'])
+            assert torch.allclose(single_result['scores'], batched_result['scores'], atol=5e-3)
+            assert torch.allclose(single_result['boxes'], batched_result['boxes'], atol=0.5)  # pixels
+
+
+def test_get_bounding_boxes_fast_inputs_match():
+    from PIL import Image
+    import torch
+    from table_processing.table_tools import get_bounding_boxes
+    images = [Image.effect_noise((300, 200), 64).convert('RGB') for i in range(3)]
+    images.insert(1, Image.new('RGB', (120, 400), color=(10, 20, 30)))
+
+    model = FakeStructureModel()
+    fast = get_bounding_boxes(images, model, batch_size=4, fast_inputs=True)[0]
+    assert sorted(model.batch_sizes) == [1, 3]
+    slow = get_bounding_boxes(images, FakeStructureModel(), batch_size=4)[0]
+    for fast_result, slow_result in zip(fast, slow):
+        assert torch.allclose(fast_result['boxes'], slow_result['boxes'], atol=1e-3)
+
+
+def test_get_bounding_boxes_input_size():
+    from PIL import Image
+    import torch
+    from table_processing.table_tools import get_bounding_boxes
+
+    class ShapeModel(FakeStructureModel):
+        def __call__(self, pixel_values, pixel_mask):
+            self.shapes = getattr(self, 'shapes', []) + [tuple(pixel_values.shape[2:])]
+            return FakeStructureModel.__call__(self, pixel_values, pixel_mask)
+
+    image = Image.effect_noise((300, 200), 64).convert('RGB')
+    for fast_inputs in [False, True]:
+        model = ShapeModel()
+        get_bounding_boxes(image, model, fast_inputs=fast_inputs)
+        get_bounding_boxes(image, model, fast_inputs=fast_inputs, input_size=(600, 1000))
+        assert model.shapes == [(800, 1200), (600, 900)]
+    assert len(get_bounding_boxes(image, FakeStructureModel(), threshold=0.5)[0][0]['boxes']) == 1
+    assert len(get_bounding_boxes(image, FakeStructureModel(), threshold=1.0)[0][0]['boxes']) == 0
+
+
+def test_get_grid_intervals():
+    from table_processing.table_tools import get_grid_intervals
+    assert get_grid_intervals([30.4, 0, 60.2, 60.4, 90]) == [(0, 30), (30, 60), (60, 90)]
+
+
+def test_assign_words_to_cells():
+    from table_processing.table_tools import assign_words_to_cells
+    row_limits = [0, 20, 40]
+    column_limits = [0, 50, 100]
+    words = [(2, 2, 20, 18, 'Name', (1, 1, 1)),
+             (55, 2, 90, 18, 'Value', (1, 1, 1)),
+             (2, 22, 20, 28, 'first', (1, 1, 2)),
+             (22, 22, 45, 28, 'line', (1, 1, 2)),
+             (2, 30, 20, 38, 'second', (1, 1, 3)),
+             (60, 25, 80, 35, '42', (1, 1, 2))]
+    cells = assign_words_to_cells(words, row_limits, column_limits)
+    assert cells == [['Name', 'Value'], ['first line\nsecond', '42']]
+
+
+def test_assign_words_to_cells_empty_cells():
+    from table_processing.table_tools import assign_words_to_cells
+    cells = assign_words_to_cells([], [0, 10, 20, 30], [0, 40])
+    assert cells == [[''], [''], ['']]
+
+
+def test_get_words_in_box():
+    from table_processing.table_tools import get_words_in_box
+    words = [(10, 10, 30, 20, 'inside', (0, 0)),
+             (95, 10, 120, 20, 'outside', (0, 0)),
+             (90, 40, 104, 50, 'centre_inside', (0, 1))]
+    assert get_words_in_box(words, (5, 5, 100, 60)) == [(5, 5, 25, 15, 'inside', (0, 0)), (85, 35, 99, 45, 'centre_inside', (0, 1))]
+    assert get_words_in_box(words, (200, 200, 300, 300)) == None
+
+
+def test_adaptive_binarize():
+    from PIL import Image, ImageDraw
+    from table_processing.table_tools import adaptive_binarize, convert_colorspace
+
+    # Dark text on a background that gets darker from left to right
+    image = Image.linear_gradient('L').rotate(90).resize((200, 60))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([20, 20, 40, 40], fill = 0)
+    draw.rectangle([150, 20, 170, 40], fill = 0)
+    binary = adaptive_binarize(image)
+    assert binary.mode == 'L' and binary.size == image.size
+    assert set(color for count, color in binary.getcolors()) == {0, 255}
+    assert binary.getpixel((30, 30)) == 0 and binary.getpixel((160, 30)) == 0
+    assert binary.getpixel((100, 5)) == 255  # the background is white even where it is dark
+
+    rgb = Image.new('RGB', size = (20, 10), color = (255, 255, 255))
+    assert convert_colorspace(rgb, 'rgb') is rgb
+    assert convert_colorspace(rgb, 'gray').mode == 'L'
+    assert convert_colorspace(rgb, 'binary').getcolors() == [(200, 255)]
+    with pytest.raises(Exception):
+        convert_colorspace(rgb, 'cmyk')
+
+
+def test_find_blank_cells():
+    import numpy as np
+    from table_processing.table_tools import find_blank_cells
+
+    image = np.full((60, 200), 255, dtype=np.uint8)
+    image[:, 99:101] = 0  # grid line on the cell border
+    image[40:45, 150:160] = 0  # 50 dark pixels in the bottom right cell
+    blank = find_blank_cells(image, [(0, 30), (30, 60)], [(0, 100), (100, 200)], threshold = 0.01)
+    assert blank.tolist() == [[True, True], [True, False]]
+    blank = find_blank_cells(image, [(0, 30), (30, 60)], [(0, 100), (100, 200)], threshold = 0.05)
+    assert blank.tolist() == [[True, True], [True, True]]
+    rgb = np.stack([image] * 3, axis=2)
+    assert find_blank_cells(rgb, [(0, 30), (30, 60), (60, 60)], [(0, 100), (100, 200)], threshold = 0.01).tolist() == [[True, True], [True, False], [True, True]]